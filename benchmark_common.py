@@ -0,0 +1,21 @@
+#
+#
+# Helpers shared by the benchmark scripts (benchmark_country_mask.py,
+# benchmark_power_curve.py and benchmark_solar_PV.py).
+#
+import time
+
+
+def best_time(func,*args,repeats=3):
+
+    """
+    Returns the fastest time (s) of repeats calls of func(*args), and the
+    result of the last call.
+    """
+
+    times = []
+    for i in range(0,repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return(min(times),result)
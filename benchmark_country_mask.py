@@ -0,0 +1,61 @@
+#
+#
+# Benchmark of the vectorised country-mask engine against the original
+# loop over one shapely.geometry.Point per gridpoint.
+#
+# Runs offline: the grid is taken from the ERA5 turbine file shipped with
+# the repository and the 'country' is a synthetic two-part MultiPolygon
+# (a mainland plus an island) roughly the size of France.
+#
+import os
+
+import numpy as np
+import shapely.geometry
+from netCDF4 import Dataset
+
+import energy_model_functions_country_masks as country_masks
+from benchmark_common import best_time
+
+
+# the data files shipped with the repository, wherever this is run from
+_module_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def loop_country_mask(country_geometry,lons,lats):
+    # the original per-gridpoint method from load_country_weather_data
+    LONS, LATS = np.meshgrid(lons,lats)
+    x, y = LONS.flatten(), LATS.flatten()
+    MASK_MATRIX = np.zeros((len(x),1))
+    for i in range(0,len(x)):
+        my_point = shapely.geometry.Point(x[i],y[i])
+        if country_geometry.contains(my_point) == True:
+            MASK_MATRIX[i,0] = 1.0
+    return(np.reshape(MASK_MATRIX,(len(lats),len(lons))))
+
+
+if __name__ == '__main__':
+
+    grid = Dataset(os.path.join(_module_dir,
+                                'ERA5_turbine_array_total_BC_v16_hourly.nc'),
+                   mode='r')
+    lons = grid.variables['lon'][:]
+    lats = grid.variables['lat'][:]
+    grid.close()
+
+    mainland = shapely.geometry.Polygon([(-4.5,48.5),(2.5,51.0),(8.0,49.0),
+                                         (7.5,43.5),(3.0,42.5),(-1.5,43.5)])
+    island = shapely.geometry.Polygon([(8.5,41.4),(9.6,41.4),(9.5,43.0),
+                                       (8.6,42.6)])
+    country_geometry = shapely.geometry.MultiPolygon([mainland,island])
+
+    loop_time, loop_mask = best_time(loop_country_mask,country_geometry,
+                                     lons,lats,repeats=1)
+    fast_time, fast_mask = best_time(country_masks.make_country_mask,
+                                     country_geometry,lons,lats)
+
+    print('grid size:            ' + str(len(lats)) + ' x ' + str(len(lons)))
+    print('gridpoints in country: ' + str(int(fast_mask.sum())))
+    print('point loop:           %.4f s' % loop_time)
+    print('vectorised:           %.4f s' % fast_time)
+    print('speed-up:             %.0fx' % (loop_time/fast_time))
+    print('masks identical:      ' + str(np.array_equal(loop_mask,fast_mask)))
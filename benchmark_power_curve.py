@@ -0,0 +1,78 @@
+#
+#
+# Benchmark of the lookup-table power curve (power_curve_lookup) against the
+# original np.digitize method, checking that the two agree bit-for-bit.
+#
+# Runs offline on synthetic Weibull-distributed wind speeds on the ERA5
+# grid (one week of hourly data by default) plus every bin edge exactly,
+# as those are where rounding could make the two methods disagree, and
+# missing (NaN) and infinite speeds. Masked speeds are checked to stay
+# masked. With --dtype float32 the capacity factors are asked for in
+# float32 too, and compared with the np.digitize ones rounded to float32.
+#
+import argparse
+import os
+
+import numpy as np
+
+import energy_model_functions_wind_power as wind_power
+from benchmark_common import best_time
+
+
+# the data files shipped with the repository, wherever this is run from
+_module_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def digitize_windpower(wind_speed_data,power_curve_w,power_curve_p):
+    # the original method from convert_to_windpower
+    pc_winds = np.linspace(0,50,501)
+    pc_power = np.interp(pc_winds,power_curve_w,power_curve_p)
+    reshaped_speed = wind_speed_data.flatten()
+    test = np.digitize(reshaped_speed,pc_winds,right=False)
+    test[test ==len(pc_winds)] = 500
+    wind_power_flattened = 0.5*(pc_power[test-1]+pc_power[test])
+    return(np.reshape(wind_power_flattened,(np.shape(wind_speed_data))))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours',type=int,default=168)
+    parser.add_argument('--dtype',default='float64')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    wind_speed_data = (8.*rng.weibull(2.,size=(args.hours,214,304))).astype(args.dtype)
+    # include every bin edge, and a few speeds off the top of the curve
+    edges = np.linspace(0,50,501).astype(args.dtype)
+    wind_speed_data[0,0,:] = 0.
+    wind_speed_data.reshape(-1)[:len(edges)] = edges
+    wind_speed_data.reshape(-1)[len(edges):len(edges)+3] = [50.,60.,1000.]
+    wind_speed_data.reshape(-1)[len(edges)+3:len(edges)+5] = [np.nan,np.inf]
+    masked_speed = np.ma.masked_greater(wind_speed_data[-1],20.)
+
+    for turbine in ['Enercon_E70_2300MW_ECEM_turbine.csv',
+                    'Gamesa_G87_2000MW_ECEM_turbine.csv',
+                    'Vestas_v110_2000MW_ECEM_turbine.csv']:
+        power_curve = np.loadtxt(os.path.join(_module_dir,turbine))
+        power_curve_w = power_curve[:,0]
+        power_curve_p = power_curve[:,2]
+
+        digitize_time, digitize_cf = best_time(digitize_windpower,wind_speed_data,
+                                               power_curve_w,power_curve_p)
+        table = wind_power.make_power_curve_table(power_curve_w,power_curve_p)
+        lookup_time, lookup_cf = best_time(wind_power.power_curve_lookup,
+                                           wind_speed_data,table,args.dtype)
+
+        n_values = wind_speed_data.size
+        print(turbine)
+        print('    np.digitize:   %.3f s  (%.1f M values/s)' %
+              (digitize_time,n_values/digitize_time/1e6))
+        print('    lookup table:  %.3f s  (%.1f M values/s)' %
+              (lookup_time,n_values/lookup_time/1e6))
+        print('    speed-up:      %.1fx' % (digitize_time/lookup_time))
+        print('    bit-for-bit:   ' + str(np.array_equal(digitize_cf.astype(lookup_cf.dtype),
+                                                         lookup_cf)))
+        masked_cf = wind_power.power_curve_lookup(masked_speed,table)
+        print('    masks kept:    ' + str(np.array_equal(np.ma.getmaskarray(masked_cf),
+                                                         np.ma.getmaskarray(masked_speed))))
@@ -0,0 +1,72 @@
+#
+#
+# Benchmark of the fused solar PV engine (solar_PV_model_fused) against
+# solar_PV_model, checking that the national capacity factors agree to
+# float32 precision. Exits with an error if they don't. The equivalence,
+# including missing values, is also checked by tests/test_solar_PV.py.
+#
+# Runs offline on synthetic temperatures and irradiances on the ERA5 grid
+# (one week of hourly data by default) with a synthetic 'country' roughly
+# the size of France.
+#
+import argparse
+import os
+import sys
+
+import numpy as np
+import shapely.geometry
+from netCDF4 import Dataset
+
+import energy_model_functions_country_masks as country_masks
+import energy_model_functions_solar_PV as solar_PV
+from benchmark_common import best_time
+
+
+# the data files shipped with the repository, wherever this is run from
+_module_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours',type=int,default=168)
+    parser.add_argument('--tolerance',type=float,default=1e-5)
+    args = parser.parse_args()
+
+    grid = Dataset(os.path.join(_module_dir,
+                                'ERA5_turbine_array_total_BC_v16_hourly.nc'),
+                   mode='r')
+    lons = grid.variables['lon'][:]
+    lats = grid.variables['lat'][:]
+    grid.close()
+
+    country_geometry = shapely.geometry.Polygon([(-4.5,48.5),(2.5,51.0),
+                                                 (8.0,49.0),(7.5,43.5),
+                                                 (3.0,42.5),(-1.5,43.5)])
+    country_mask = country_masks.make_country_mask(country_geometry,lons,lats)
+
+    # a daily cycle of irradiance, with some night-time NaNs
+    rng = np.random.default_rng(0)
+    shape = (args.hours,len(lats),len(lons))
+    hours = np.arange(args.hours)[:,np.newaxis,np.newaxis]
+    t2m = 10. + 8.*rng.standard_normal(shape)
+    ssrd = np.maximum(800.*np.sin(2*np.pi*hours/24.),0.)*rng.uniform(0.3,1.,shape)
+    ssrd[ssrd == 0.] = np.nan
+    t2m_masked = t2m*country_mask
+    ssrd_masked = ssrd*country_mask
+
+    original_time, original_cf = best_time(solar_PV.solar_PV_model,t2m_masked,
+                                           ssrd_masked,country_mask)
+    fused_time, fused_cf = best_time(solar_PV.solar_PV_model_fused,t2m_masked,
+                                     ssrd_masked,country_mask)
+
+    max_error = np.max(np.abs(fused_cf - original_cf))
+    print('grid size:             ' + str(len(lats)) + ' x ' + str(len(lons)))
+    print('gridpoints in country: ' + str(int(country_mask.sum())))
+    print('solar_PV_model:        %.3f s' % original_time)
+    print('solar_PV_model_fused:  %.3f s' % fused_time)
+    print('speed-up:              %.1fx' % (original_time/fused_time))
+    print('max difference:        %.2e' % max_error)
+    if not max_error <= args.tolerance:
+        print('FAILED: the fused engine differs by more than %.0e' % args.tolerance)
+        sys.exit(1)
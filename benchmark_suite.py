@@ -0,0 +1,452 @@
+#
+#
+# Benchmark suite for the wind, solar PV and demand models, run offline on
+# synthetic ERA5 files, e.g.
+#
+#   python benchmark_suite.py --sizes month year --save-baselines
+#   ... make changes ...
+#   python benchmark_suite.py --sizes month year
+#
+# The fixtures are monthly files named like the real downloads
+# (ERA5_1hr_2001_01_DET.nc) on the real ERA5 grid (the grid of
+# ERA5_turbine_array_total_BC_v16_hourly.nc), with packed int16 u100, v100,
+# t2m and ssrd with plausible values and a daily cycle. They are made once in
+# --fixture-dir and reused. The sizes are 1 month, 1 year and 10 years of
+# hourly data; the 10 year record repeats the 1 year fixture under later
+# years' names (as links) so it needs no more disk space.
+#
+# Every model chain is run over each record a month at a time (the streaming
+# wind model over the whole record), with profiling on (see
+# energy_model_functions_profiling.py). For each public function the report
+# gives the calls, total time, throughput and peak memory. The throughput is
+# the number of gridpoint-hours in the record divided by the total time
+# spent in the function. The countries are simple polygons registered with
+# country_masks, so no shapefiles are needed.
+#
+# The results are compared with the baselines in --baselines (if it exists)
+# and the script exits with an error if a function has become slower than
+# its baseline by more than --tolerance. Baselines depend on the machine, so
+# save them (--save-baselines) on the machine the comparison will be run on.
+#
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import shapely.geometry
+from netCDF4 import Dataset, date2num
+
+import energy_model_functions_country_masks as country_masks
+import energy_model_functions_demand as demand
+import energy_model_functions_era5_io as era5_io
+import energy_model_functions_profiling as profiling
+import energy_model_functions_solar_PV as solar_PV
+import energy_model_functions_wind_power as wind_power
+
+
+SIZES = {'month': 1,'year': 12,'decade': 120} # in months
+FIXTURE_YEAR = 2001
+FIXTURE_FILENAME = 'ERA5_1hr_{year}_{month:02d}_DET.nc'
+BENCHMARKED_MODULES = [wind_power,solar_PV,demand]
+
+_module_dir = os.path.dirname(os.path.abspath(__file__))
+GRID_FILE = os.path.join(_module_dir,'ERA5_turbine_array_total_BC_v16_hourly.nc')
+BIAS_CORRECTION_FILE = os.path.join(_module_dir,'ERA5_speed100m_mean_factor_v16_hourly.npy')
+OPTIMAL_TURBINES = os.path.join(_module_dir,'ERA5_turbine_array_total_BC_v16_hourly.nc')
+POWER_CURVES = [os.path.join(_module_dir,power_curve_file) for power_curve_file in
+                ['Enercon_E70_2300MW_ECEM_turbine.csv',
+                 'Gamesa_G87_2000MW_ECEM_turbine.csv',
+                 'Vestas_v110_2000MW_ECEM_turbine.csv']]
+WINDFARM_FILE = os.path.join(_module_dir,'United_Kingdom_ERA5_windfarm_dist.nc')
+# the wind farm distributions stand in for solar capacity scenarios
+CAPACITY_FILES = [os.path.join(_module_dir,'United_Kingdom_ERA5_windfarm_dist.nc'),
+                  os.path.join(_module_dir,'Ireland_ERA5_windfarm_dist.nc')]
+REG_COEFFICIENTS = os.path.join(_module_dir,'ERA5_Regression_coeffs_demand_model.csv')
+
+COUNTRY_GEOMETRIES = {
+    'United Kingdom': shapely.geometry.Polygon([(-5.7,50.0),(1.8,51.0),
+                                                (1.7,52.9),(-1.6,55.7),
+                                                (-2.0,58.6),(-6.2,58.5)]),
+    'France': shapely.geometry.Polygon([(-4.5,48.5),(2.5,51.0),(8.0,49.0),
+                                        (7.5,43.5),(3.0,42.5),(-1.5,43.5)]),
+}
+
+# (scale_factor, add_offset) of the packed fixture variables
+PACKING = {'u100': (40./32000.,0.),'v100': (40./32000.,0.),
+           't2m': (80./32000.,265.),'ssrd': (2.5e6/32000.,2.5e6)}
+
+
+def fixture_files(n_months):
+
+    """
+    Returns the filenames of a record of n_months monthly fixture files.
+    """
+
+    return([FIXTURE_FILENAME.format(year=FIXTURE_YEAR + i//12,month=i%12 + 1)
+            for i in range(0,n_months)])
+
+
+def _synthetic_fields(hours,lons,lats,rng):
+    # a day of plausible weather: westerly-ish winds, temperatures falling
+    # to the north with a daily cycle, and sunshine during the day
+    lat_grid = lats[np.newaxis,:,np.newaxis]
+    lon_grid = lons[np.newaxis,np.newaxis,:]
+    hour_of_day = (hours % 24)[:,np.newaxis,np.newaxis]
+    shape = (len(hours),len(lats),len(lons))
+    local_hour = hour_of_day + lon_grid/15.
+    daylight = np.maximum(np.sin(2*np.pi*(local_hour - 6.)/24.),0.)
+
+    fields = {}
+    fields['u100'] = 4. + 6.*rng.standard_normal(shape,dtype=np.float32)
+    fields['v100'] = 1. + 6.*rng.standard_normal(shape,dtype=np.float32)
+    fields['t2m'] = (300. - 0.6*np.abs(lat_grid) + 4.*daylight +
+                     3.*rng.standard_normal(shape,dtype=np.float32))
+    fields['ssrd'] = 3600.*900.*daylight*rng.uniform(0.2,1.,shape)
+    return(fields)
+
+
+def make_fixture_file(file_str,year,month,lons,lats,seed=0):
+
+    """
+    Writes one month of synthetic hourly ERA5 data on the grid lons, lats.
+    """
+
+    time_units = 'hours since 1900-01-01 00:00:00.0'
+    start = date2num(datetime.datetime(year,month,1),time_units,'gregorian')
+    if month == 12:
+        end = date2num(datetime.datetime(year + 1,1,1),time_units,'gregorian')
+    else:
+        end = date2num(datetime.datetime(year,month + 1,1),time_units,'gregorian')
+    hours = np.arange(start,end)
+
+    tmp_file = file_str + '.tmp'
+    dataset = Dataset(tmp_file,mode='w')
+    dataset.createDimension('longitude',len(lons))
+    dataset.createDimension('latitude',len(lats))
+    dataset.createDimension('time',None)
+    longitude = dataset.createVariable('longitude','f4',('longitude',))
+    longitude.units = 'degrees_east'
+    longitude[:] = lons
+    latitude = dataset.createVariable('latitude','f4',('latitude',))
+    latitude.units = 'degrees_north'
+    latitude[:] = lats
+    time_variable = dataset.createVariable('time','i4',('time',))
+    time_variable.units = time_units
+    time_variable.calendar = 'gregorian'
+    time_variable[:] = hours
+
+    variables = {}
+    for nc_key, (scale_factor, add_offset) in PACKING.items():
+        variables[nc_key] = dataset.createVariable(
+            nc_key,'i2',('time','latitude','longitude'),fill_value=-32767)
+        variables[nc_key].scale_factor = scale_factor
+        variables[nc_key].add_offset = add_offset
+
+    rng = np.random.default_rng([seed,year,month])
+    for day_start in range(0,len(hours),24):
+        fields = _synthetic_fields(hours[day_start:day_start+24],lons,lats,rng)
+        for nc_key in variables:
+            variables[nc_key][day_start:day_start+24] = fields[nc_key]
+    dataset.close()
+    os.replace(tmp_file,file_str)
+
+
+def make_fixtures(fixture_dir,n_months):
+
+    """
+    This function makes (or reuses) the synthetic fixture files for a record
+    of n_months months. Only the first year is generated, later years are
+    links to it.
+
+    Returns:
+
+        filenames (list): The fixture filenames, in time order.
+
+    """
+
+    os.makedirs(fixture_dir,exist_ok=True)
+    grid = Dataset(GRID_FILE,mode='r')
+    lons = np.asarray(grid.variables['lon'][:])
+    lats = np.asarray(grid.variables['lat'][:])
+    grid.close()
+
+    filenames = fixture_files(n_months)
+    for i, filename in enumerate(filenames):
+        file_str = os.path.join(fixture_dir,filename)
+        if os.path.exists(file_str):
+            continue
+        if i < 12:
+            print('Making ' + file_str)
+            make_fixture_file(file_str,FIXTURE_YEAR,i + 1,lons,lats)
+            continue
+        try:
+            os.symlink(filenames[i % 12],file_str)
+        except OSError: # e.g. no symlinks on this filesystem
+            shutil.copyfile(os.path.join(fixture_dir,filenames[i % 12]),file_str)
+    return(filenames)
+
+
+def record_gridpoint_hours(data_dir,filenames):
+    n_gridpoint_hours = 0
+    for filename in filenames:
+        times = era5_io.load_era5_times(data_dir + filename)[0]
+        lons, lats = era5_io.load_era5_grid(data_dir + filename)
+        n_gridpoint_hours += len(times)*len(lats)*len(lons)
+    return(n_gridpoint_hours)
+
+
+def run_wind(data_dir,filenames):
+    for filename in filenames:
+        wind_speed_data = wind_power.load_100mwindspeed_data(
+            data_dir,filename,dtype=np.float32,fast=True)
+        wind_power.meanBC_wind_speed_data(wind_speed_data,BIAS_CORRECTION_FILE,
+                                          out=wind_speed_data)
+        wind_power_cf = wind_power.convert_to_windpower(wind_speed_data,
+                                                        POWER_CURVES[0],
+                                                        dtype=np.float32)
+        del wind_power_cf
+        wind_power_cf = wind_power.convert_to_windpower_optimal_turbine(
+            wind_speed_data,OPTIMAL_TURBINES,*POWER_CURVES,dtype=np.float32)
+        del wind_speed_data
+        wind_power.country_wind_power(wind_power_cf,WINDFARM_FILE)
+        del wind_power_cf
+        wind_power.load_100mwindspeed_data_BC(data_dir,filename,
+                                              BIAS_CORRECTION_FILE)
+    wind_power.country_wind_power_streaming(data_dir,filenames,
+                                            BIAS_CORRECTION_FILE,WINDFARM_FILE,
+                                            POWER_CURVES,OPTIMAL_TURBINES,
+                                            dtype=np.float32)
+    histogram = wind_power.wind_speed_histogram_streaming(
+        data_dir,filenames,BIAS_CORRECTION_FILE,WINDFARM_FILE,OPTIMAL_TURBINES,
+        dtype=np.float32)
+    wind_power.histogram_capacity_factor(histogram,*POWER_CURVES)
+    wind_power.histogram_cf_percentiles(histogram,[5,50,95],*POWER_CURVES)
+    wind_power.histogram_cf_duration_curve(histogram,*POWER_CURVES)
+    histogram = wind_power.wind_speed_histogram_streaming(
+        data_dir,filenames,BIAS_CORRECTION_FILE,dtype=np.float32)
+    wind_power.histogram_capacity_factor(histogram,POWER_CURVES[0])
+
+
+def run_solar(data_dir,filenames):
+    COUNTRIES = list(COUNTRY_GEOMETRIES)
+    capacity_weights = solar_PV.load_solar_capacity_weights(CAPACITY_FILES)
+    for filename in filenames:
+        for COUNTRY in COUNTRIES:
+            T2m_data, country_mask = solar_PV.load_country_weather_data(
+                COUNTRY,data_dir,filename,'t2m',fast=True)
+            ssrd_data, country_mask = solar_PV.load_country_weather_data(
+                COUNTRY,data_dir,filename,'ssrd',fast=True)
+            solar_PV.solar_PV_model(T2m_data,ssrd_data,country_mask)
+            solar_PV.solar_PV_model_fused(T2m_data,ssrd_data,country_mask)
+            del T2m_data, ssrd_data
+        T2m_data = solar_PV.load_country_weather_data_multi(
+            COUNTRIES,data_dir,filename,'t2m',fast=True)
+        ssrd_data = solar_PV.load_country_weather_data_multi(
+            COUNTRIES,data_dir,filename,'ssrd',fast=True)
+        del T2m_data, ssrd_data
+        T2m_data = era5_io.load_era5_variable(data_dir + filename,'t2m',fast=True)[2]
+        ssrd_data = era5_io.load_era5_variable(data_dir + filename,'ssrd',fast=True)[2]
+        solar_PV.solar_PV_model_multi(T2m_data,ssrd_data,capacity_weights)
+        del T2m_data, ssrd_data
+
+
+def run_demand(data_dir,filenames):
+    COUNTRIES = list(COUNTRY_GEOMETRIES)
+    demand.load_demand_coefficients(REG_COEFFICIENTS)
+    for filename in filenames:
+        file_str = data_dir + filename
+        for COUNTRY in COUNTRIES:
+            t2m_daily, country_mask = demand.load_country_weather_data_daily(
+                COUNTRY,data_dir,filename,'t2m',1,fast=True)
+            hdd, cdd = demand.calc_hdd_cdd(t2m_daily,country_mask)
+            # the demand model names countries as in filenames
+            demand.calc_national_wd_demand_2017(hdd,cdd,REG_COEFFICIENTS,
+                                                COUNTRY.replace(' ','_'))
+        country_data = demand.load_country_weather_data_daily_multi(
+            COUNTRIES,data_dir,filename,'t2m',1,fast=True)
+        del country_data
+
+        times, time_units, calendar = era5_io.load_era5_times(file_str)
+        day_starts = demand.day_start_indices(times,time_units,calendar)
+        weekdays = demand.day_of_week(times[day_starts],time_units,calendar)
+        lons, lats = era5_io.load_era5_grid(file_str)
+        country_mask_list = [country_masks.get_country_mask(COUNTRY,lons,lats)
+                             for COUNTRY in COUNTRIES]
+        t2m_data = era5_io.load_era5_variable(file_str,'t2m',fast=True)[2]
+        hdd, cdd = demand.calc_hdd_cdd_multi(t2m_data,country_mask_list,
+                                             hourly=True,day_starts=day_starts)
+        # and the daily-mean-first route
+        demand.degree_days(demand.daily_mean(t2m_data,day_starts))
+        del t2m_data
+        demand.calc_national_demand(hdd,cdd,weekdays,REG_COEFFICIENTS,
+                                    [COUNTRY.replace(' ','_') for COUNTRY in COUNTRIES])
+
+
+MODEL_RUNS = {'wind': run_wind,'solar': run_solar,'demand': run_demand}
+
+
+def unexercised_functions(stages):
+
+    """
+    Returns the profiled public functions of the benchmarked modules that
+    the suite didn't call.
+    """
+
+    missing = []
+    for module in BENCHMARKED_MODULES:
+        for name in dir(module):
+            function = getattr(module,name)
+            if (callable(function) and hasattr(function,'__wrapped__') and
+                    getattr(function,'__module__',None) == module.__name__):
+                if profiling.stage_name(function) not in stages:
+                    missing.append(profiling.stage_name(function))
+    return(missing)
+
+
+def run_size(size,fixture_dir,models,memory=True):
+
+    """
+    This function runs the chosen models over the record of one size and
+    returns the statistics of each profiled function.
+
+    Returns:
+
+        results (dict): stage -> {'calls','total_s','gridpoint_hours_per_s',
+            'peak_memory_bytes'}, plus 'record' with the size of the record
+            and the wall time.
+
+    """
+
+    filenames = make_fixtures(fixture_dir,SIZES[size])
+    data_dir = os.path.join(fixture_dir,'')
+    n_gridpoint_hours = record_gridpoint_hours(data_dir,filenames)
+
+    profiling.reset_profile()
+    profiling.enable_profiling(memory)
+    start = time.perf_counter()
+    for model in models:
+        with profiling.stage('suite.' + model):
+            MODEL_RUNS[model](data_dir,filenames)
+    wall_s = time.perf_counter() - start
+    report = profiling.profile_report()
+    profiling.disable_profiling()
+
+    results = {'record': {'months': len(filenames),
+                          'gridpoint_hours': n_gridpoint_hours,
+                          'wall_s': wall_s,'memory_tracking': memory}}
+    for stats in report:
+        results[stats.stage] = {
+            'calls': stats.calls,'total_s': stats.total_s,
+            'gridpoint_hours_per_s': n_gridpoint_hours/stats.total_s
+                if stats.total_s > 0 else None,
+            'peak_memory_bytes': stats.peak_memory_bytes if memory else None}
+    return(results)
+
+
+def compare_with_baselines(results,baselines,tolerance,min_time=0.05):
+
+    """
+    Prints each function's time against its baseline and returns the
+    (size, stage, ratio) of those more than tolerance slower. Functions
+    whose baseline total is under min_time seconds are too noisy to judge
+    and aren't counted.
+    """
+
+    regressions = []
+    for size in results:
+        if size not in baselines:
+            print('No baselines for ' + size)
+            continue
+        print('\n' + size + ' vs baseline (time ratio, >1 is slower)')
+        for stage in results[size]:
+            if stage == 'record' or stage not in baselines[size]:
+                continue
+            ratio = results[size][stage]['total_s']/baselines[size][stage]['total_s']
+            flag = ''
+            if baselines[size][stage]['total_s'] < min_time:
+                flag = '  (too short to judge)'
+            elif ratio > 1 + tolerance:
+                flag = '  <-- slower'
+                regressions.append((size,stage,ratio))
+            print('    %-55s %6.2f%s' % (stage,ratio,flag))
+    return(regressions)
+
+
+def print_results(size,results):
+    record = results['record']
+    print('\n%s: %d months, %.3g gridpoint-hours, %.1f s' %
+          (size,record['months'],record['gridpoint_hours'],record['wall_s']))
+    print('    %-55s %6s %9s %14s %10s' % ('function','calls','total s',
+                                           'gp-hours/s','peak MB'))
+    for stage, stats in results.items():
+        if stage == 'record':
+            continue
+        peak = stats['peak_memory_bytes']
+        print('    %-55s %6d %9.3f %14.4g %10s' %
+              (stage,stats['calls'],stats['total_s'],
+               stats['gridpoint_hours_per_s'] or 0.,
+               '-' if peak is None else '%.1f' % (peak/1e6)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the energy models '
+                                     'on synthetic ERA5 files.')
+    parser.add_argument('--sizes',nargs='+',default=['month'],choices=list(SIZES))
+    parser.add_argument('--models',nargs='+',default=list(MODEL_RUNS),
+                        choices=list(MODEL_RUNS))
+    parser.add_argument('--fixture-dir',default=os.environ.get(
+        'ENERGY_MODEL_BENCHMARK_DIR','benchmark_fixtures'))
+    parser.add_argument('--output',default='benchmark_results.json')
+    parser.add_argument('--baselines',default='benchmark_baselines.json')
+    parser.add_argument('--save-baselines',action='store_true',
+                        help='store these results as the baselines')
+    parser.add_argument('--tolerance',type=float,default=0.25,
+                        help='fail if a function is this much slower (0.25 = 25%%)')
+    parser.add_argument('--min-time',type=float,default=0.05,
+                        help="don't judge functions whose baseline is under "
+                        "this many seconds in total")
+    parser.add_argument('--no-memory',action='store_true',
+                        help="don't track peak memory (it slows some functions)")
+    args = parser.parse_args()
+
+    for COUNTRY, country_geometry in COUNTRY_GEOMETRIES.items():
+        country_masks.register_country_geometry(COUNTRY,country_geometry)
+
+    results = {}
+    for size in args.sizes:
+        results[size] = run_size(size,args.fixture_dir,args.models,
+                                 memory=not args.no_memory)
+        print_results(size,results[size])
+        missing = unexercised_functions(results[size])
+        if len(missing) > 0 and set(args.models) == set(MODEL_RUNS):
+            print('Not benchmarked: ' + ', '.join(missing))
+
+    with open(args.output,'w') as f:
+        json.dump(results,f,indent=1)
+
+    regressions = []
+    if os.path.exists(args.baselines) and not args.save_baselines:
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+        regressions = compare_with_baselines(results,baselines,args.tolerance,
+                                             args.min_time)
+
+    if args.save_baselines:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(args.baselines,'w') as f:
+            json.dump(baselines,f,indent=1)
+        print('Baselines saved to ' + args.baselines)
+
+    if len(regressions) > 0:
+        print('\n' + str(len(regressions)) + ' functions slower than their '
+              'baselines by more than ' + str(int(100*args.tolerance)) + '%')
+        sys.exit(1)
@@ -0,0 +1,286 @@
+import collections
+
+import numpy as np
+from netCDF4 import Dataset
+
+import energy_model_functions_profiling as profiling
+
+try: # scipy is optional, without it weight matrices are stored dense
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+# The gridpoints with a nonzero weight (as indices into the flattened
+# [lat,lon] grid) and their weights, normalised to sum to one.
+AggregationWeights = collections.namedtuple('AggregationWeights',
+                                            ['index','weights','shape'])
+
+# As AggregationWeights for several countries (or capacity scenarios) at
+# once. index is the union of their gridpoints and matrix has dimensions
+# [n_countries, len(index)].
+WeightMatrix = collections.namedtuple('WeightMatrix',
+                                      ['index','matrix','shape'])
+
+
+@profiling.profiled
+def make_aggregation_weights(weight_field):
+
+    """
+    This function precomputes what is needed to take a weighted spatial mean
+    over a country: the gridpoints that have a nonzero weight and their
+    normalised weights.
+
+    Args:
+
+        weight_field (array): Dimensions [lat,lon], e.g. a country mask of
+            1's and 0's or the installed capacity in each gridbox.
+
+    Returns:
+
+        aggregation_weights (AggregationWeights): to be passed to
+            aggregate_gridded_data.
+
+    """
+
+    weight_field = np.ma.filled(weight_field,0.).astype(np.float64)
+    flat_weights = weight_field.ravel()
+    index = np.flatnonzero(flat_weights)
+    total_weight = np.sum(flat_weights[index])
+    if total_weight == 0:
+        raise ValueError('The weights sum to zero, there is nothing to '
+                         'aggregate over.')
+
+    aggregation_weights = AggregationWeights(index,flat_weights[index]/total_weight,
+                                             np.shape(weight_field))
+    return(aggregation_weights)
+
+
+@profiling.profiled
+def make_weight_matrix(weight_fields):
+
+    """
+    This function precomputes the weights for several countries (or
+    installed-capacity scenarios) so that they can all be aggregated with a
+    single matrix product. If scipy is available the matrix is sparse.
+
+    Args:
+
+        weight_fields (list): Arrays of dimensions [lat,lon], one per country,
+            e.g. country masks or installed capacities.
+
+    Returns:
+
+        weight_matrix (WeightMatrix): to be passed to
+            aggregate_gridded_data_multi.
+
+    """
+
+    all_weights = [make_aggregation_weights(weight_field)
+                   for weight_field in weight_fields]
+    index = np.unique(np.concatenate([weights.index for weights in all_weights]))
+
+    rows = np.concatenate([np.full(len(weights.index),i)
+                           for i, weights in enumerate(all_weights)])
+    columns = np.concatenate([np.searchsorted(index,weights.index)
+                              for weights in all_weights])
+    values = np.concatenate([weights.weights for weights in all_weights])
+
+    if scipy is not None:
+        matrix = scipy.sparse.csr_matrix((values,(rows,columns)),
+                                         shape=(len(all_weights),len(index)))
+    else:
+        matrix = np.zeros((len(all_weights),len(index)))
+        matrix[rows,columns] = values
+
+    weight_matrix = WeightMatrix(index,matrix,all_weights[0].shape)
+    return(weight_matrix)
+
+
+@profiling.profiled
+def gather_gridpoints(gridded_data,index,shape):
+
+    """
+    Returns the values of gridded_data (dimensions [...,lat,lon]) at the
+    flattened gridpoint indices index, with dimensions [...,len(index)].
+    If gridded_data has masked (missing) values the result is masked there
+    too.
+    """
+
+    if np.shape(gridded_data)[-2:] != tuple(shape):
+        raise ValueError('The data is on a different grid to the weights.')
+
+    lead_shape = np.shape(gridded_data)[:-2]
+    flat_data = np.reshape(np.ma.getdata(gridded_data),lead_shape + (-1,))
+    gridpoint_data = np.take(flat_data,index,axis=-1)
+    if np.ma.is_masked(gridded_data):
+        flat_mask = np.reshape(np.ma.getmaskarray(gridded_data),lead_shape + (-1,))
+        gridpoint_data = np.ma.masked_array(gridpoint_data,
+                                            mask=np.take(flat_mask,index,axis=-1))
+    return(gridpoint_data)
+
+
+def fill_missing(gridpoint_data):
+
+    """
+    Returns gridpoint_data with any masked (missing) values set to zero, so
+    that a weighted mean leaves them out but still divides by the total
+    weight. This is what np.average did with masked arrays in the original
+    models.
+    """
+
+    if np.ma.is_masked(gridpoint_data):
+        return(np.ma.filled(gridpoint_data,0.))
+    return(np.ma.getdata(gridpoint_data))
+
+
+@profiling.profiled
+def aggregate_gridded_data(gridded_data,aggregation_weights):
+
+    """
+    This function takes the weighted spatial mean of gridded data, e.g. to
+    make a national time series. Only the gridpoints with a nonzero weight
+    are read and the whole record is reduced with one matrix-vector product.
+    Masked (missing) values count as zero, see fill_missing.
+
+    Args:
+
+        gridded_data (array): Dimensions [...,lat,lon], e.g. [time,lat,lon].
+
+        aggregation_weights (AggregationWeights): from
+            make_aggregation_weights.
+
+    Returns:
+
+        aggregated_data (array): Dimensions [...], e.g. [time].
+
+    """
+
+    gridpoint_data = gather_gridpoints(gridded_data,aggregation_weights.index,
+                                       aggregation_weights.shape)
+    aggregated_data = np.dot(fill_missing(gridpoint_data),
+                             aggregation_weights.weights)
+    return(aggregated_data)
+
+
+@profiling.profiled
+def aggregate_gridded_data_multi(gridded_data,weight_matrix):
+
+    """
+    This function takes the weighted spatial mean of gridded data for many
+    countries at once with a single (sparse) matrix product. Masked
+    (missing) values count as zero, see fill_missing.
+
+    Args:
+
+        gridded_data (array): Dimensions [...,lat,lon], e.g. [time,lat,lon].
+
+        weight_matrix (WeightMatrix): from make_weight_matrix.
+
+    Returns:
+
+        aggregated_data (array): Dimensions [...,n_countries], e.g.
+            [time,n_countries].
+
+    """
+
+    gridpoint_data = gather_gridpoints(gridded_data,weight_matrix.index,
+                                       weight_matrix.shape)
+    aggregated_data = aggregate_gridpoint_data_multi(gridpoint_data,weight_matrix)
+    return(aggregated_data)
+
+
+@profiling.profiled
+def aggregate_gridpoint_data_multi(gridpoint_data,weight_matrix):
+
+    """
+    As aggregate_gridded_data_multi for data that has already been gathered
+    at the gridpoints of weight_matrix.index (see gather_gridpoints), e.g.
+    a model evaluated only at those gridpoints.
+
+    Args:
+
+        gridpoint_data (array): Dimensions [...,len(weight_matrix.index)].
+
+        weight_matrix (WeightMatrix): from make_weight_matrix.
+
+    Returns:
+
+        aggregated_data (array): Dimensions [...,n_countries].
+
+    """
+
+    lead_shape = np.shape(gridpoint_data)[:-1]
+    gridpoint_data = np.reshape(fill_missing(gridpoint_data),
+                                (-1,len(weight_matrix.index)))
+
+    # (W x^T)^T so that a sparse W is on the left of the product
+    aggregated_data = np.asarray(weight_matrix.matrix.dot(gridpoint_data.T)).T
+    aggregated_data = np.reshape(aggregated_data,
+                                 lead_shape + (weight_matrix.matrix.shape[0],))
+    return(aggregated_data)
+
+
+@profiling.profiled
+def load_capacity_field(capacity_file):
+
+    """
+    Returns the gridded installed capacity (the 'totals' variable, with any
+    missing values set to zero) from e.g. France_ERA5_windfarm_dist.nc,
+    dimensions [lat,lon].
+    """
+
+    dataset = Dataset(capacity_file,mode='r')
+    total_MW = np.ma.filled(dataset.variables['totals'][:],0.)
+    dataset.close()
+
+    return(total_MW)
+
+
+@profiling.profiled
+def load_capacity_weights(capacity_file):
+
+    """
+    This function loads a gridded installed-capacity field (the 'totals'
+    variable of e.g. France_ERA5_windfarm_dist.nc) as aggregation weights.
+
+    Args:
+
+        capacity_file (str): The filename of a .nc file containing the
+            installed capacity in each reanalysis gridbox.
+
+    Returns:
+
+        aggregation_weights (AggregationWeights): to be passed to
+            aggregate_gridded_data.
+
+    """
+
+    total_MW = load_capacity_field(capacity_file)
+    aggregation_weights = make_aggregation_weights(total_MW)
+    return(aggregation_weights)
+
+
+@profiling.profiled
+def load_capacity_weight_matrix(capacity_files):
+
+    """
+    This function loads several gridded installed-capacity fields (e.g. one
+    per country, or several capacity scenarios for one country) as a single
+    weight matrix, so that they can all be aggregated in one product.
+
+    Args:
+
+        capacity_files (list): Filenames of .nc files containing the
+            installed capacity in each reanalysis gridbox ('totals').
+
+    Returns:
+
+        weight_matrix (WeightMatrix): to be passed to
+            aggregate_gridded_data_multi.
+
+    """
+
+    weight_matrix = make_weight_matrix([load_capacity_field(capacity_file)
+                                        for capacity_file in capacity_files])
+    return(weight_matrix)
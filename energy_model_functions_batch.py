@@ -0,0 +1,528 @@
+#
+#
+# Batch driver for running the wind, solar PV and demand models over many
+# ERA5 files and countries on a process pool, e.g.
+#
+#   python energy_model_functions_batch.py '/data/ERA5_1hr_*_DET.nc' \
+#       --models wind solar demand --output-dir /data/energy_output
+#
+# Each (file, model) pair is one task and covers every country. Masks,
+# power curves, capacity weights and bias correction factors are loaded once
+# in the parent before the pool starts, so (with the default fork start
+# method on Linux) the workers share them read-only rather than loading
+# their own copies. Results are written as each task completes.
+#
+# Set OMP_NUM_THREADS=1 (or similar for your BLAS) before starting so that
+# the workers don't compete for cores.
+#
+# As well as one .npz file per task, the national time series are appended
+# (with their times) to output_dir/store/<quantity>.nc, see
+# energy_model_functions_output_store.py.
+#
+# With --profile report.json (or .csv) the time (and with --profile-memory
+# the peak memory) of each stage of the models is gathered from every worker
+# and written to one report, see energy_model_functions_profiling.py.
+#
+import argparse
+import collections
+import concurrent.futures
+import glob
+import os
+
+import numpy as np
+
+import energy_model_functions_aggregation as aggregation
+import energy_model_functions_country_masks as country_masks
+import energy_model_functions_demand as demand
+import energy_model_functions_era5_io as era5_io
+import energy_model_functions_manifest as manifest
+import energy_model_functions_output_store as output_store
+import energy_model_functions_profiling as profiling
+import energy_model_functions_solar_PV as solar_PV
+import energy_model_functions_wind_power as wind_power
+
+
+MODELS = ['wind','solar','demand']
+
+# Everything a batch run needs apart from the input files and countries.
+BatchConfig = collections.namedtuple('BatchConfig',
+    ['output_dir','bias_correction_file','optimal_turbines','power_curves',
+     'windfarm_file_pattern','filestr_reg_coefficients','chunk_size'])
+
+_module_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = BatchConfig(
+    output_dir='energy_model_output',
+    bias_correction_file=os.path.join(_module_dir,'ERA5_speed100m_mean_factor_v16_hourly.npy'),
+    optimal_turbines=os.path.join(_module_dir,'ERA5_turbine_array_total_BC_v16_hourly.nc'),
+    power_curves=('Enercon_E70','Gamesa_G87','Vestas_v110'),
+    windfarm_file_pattern=os.path.join(_module_dir,'{country}_ERA5_windfarm_dist.nc'),
+    filestr_reg_coefficients=os.path.join(_module_dir,'ERA5_Regression_coeffs_demand_model.csv'),
+    chunk_size=168)
+
+# read-only state shared with the workers, filled in by load_shared_state
+_shared = {}
+
+
+def file_country_name(COUNTRY):
+
+    """
+    Returns the name used for COUNTRY in filenames and in the demand model,
+    e.g. 'United Kingdom' -> 'United_Kingdom'.
+    """
+
+    return(COUNTRY.replace(' ','_'))
+
+
+def load_shared_state(COUNTRIES,models,grid_file,config):
+
+    """
+    This function loads everything the tasks share: the country masks on the
+    grid of grid_file, the power curve tables, the turbine classes, the
+    installed capacity of each country and the bias correction factors.
+    It is run in the parent before the pool starts (and again in a worker
+    if it was started without them, e.g. with the spawn start method).
+
+    Args:
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France','Czech Republic']
+
+        models (list): Which of MODELS will be run.
+
+        grid_file (str): Any ERA5 file on the grid being used.
+
+        config (BatchConfig): The run configuration.
+
+    """
+
+    _shared['key'] = (tuple(COUNTRIES),tuple(models),grid_file,config)
+
+    if 'solar' in models or 'demand' in models:
+        lons, lats = era5_io.load_era5_grid(grid_file)
+        country_masks.warm_country_mask_cache(COUNTRIES,lons,lats)
+
+    if 'wind' in models:
+        power_curve_tables = [wind_power.get_power_curve_table(power_curve)
+                              for power_curve in config.power_curves]
+        _shared['power_curve_tables'] = power_curve_tables
+        _shared['class_index'] = wind_power.load_turbine_class_index(
+            config.optimal_turbines,len(power_curve_tables))
+        wind_power.load_bias_correction_factors(config.bias_correction_file,
+                                                np.float32)
+
+        # countries without an installed capacity file are left out
+        wind_countries = []
+        capacity_fields = []
+        for COUNTRY in COUNTRIES:
+            windfarm_file = config.windfarm_file_pattern.format(
+                country=file_country_name(COUNTRY))
+            if os.path.exists(windfarm_file):
+                wind_countries.append(COUNTRY)
+                capacity_fields.append(
+                    aggregation.load_capacity_field(windfarm_file))
+            else:
+                print('No installed capacity file for ' + COUNTRY +
+                      ', skipping its wind power')
+        _shared['wind_countries'] = wind_countries
+        if len(wind_countries) > 0:
+            _shared['wind_weights'] = aggregation.make_weight_matrix(capacity_fields)
+
+
+def _init_worker(COUNTRIES,models,grid_file,config,profile_memory=None):
+    if profile_memory is not None:
+        profiling.enable_profiling(profile_memory)
+    if _shared.get('key') != (tuple(COUNTRIES),tuple(models),grid_file,config):
+        load_shared_state(COUNTRIES,models,grid_file,config)
+
+
+def run_wind_task(file_str,COUNTRIES,config):
+
+    """
+    Runs the optimal-turbine wind power model on one file for all countries
+    with installed capacity data, a chunk of timesteps at a time.
+
+    Returns:
+
+        results (dict): {'wind_cf': {COUNTRY: time series}}
+
+    """
+
+    data_dir, filename = os.path.split(file_str)
+    wind_countries = _shared['wind_countries']
+    country_cf_chunks = []
+    if len(wind_countries) > 0:
+        for wind_speed_data in wind_power.iter_100mwindspeed_data(
+                data_dir + os.sep,filename,config.chunk_size,np.float32):
+            wind_power.meanBC_wind_speed_data(wind_speed_data,
+                                              config.bias_correction_file,
+                                              out=wind_speed_data)
+            wind_power_cf = wind_power.power_curve_lookup_by_class(
+                wind_speed_data,_shared['power_curve_tables'],
+                _shared['class_index'],np.float32)
+            country_cf_chunks.append(aggregation.aggregate_gridded_data_multi(
+                wind_power_cf,_shared['wind_weights']))
+
+    results = {'wind_cf': {}}
+    if len(country_cf_chunks) > 0:
+        country_cf = np.concatenate(country_cf_chunks)
+        for i, COUNTRY in enumerate(wind_countries):
+            results['wind_cf'][COUNTRY] = country_cf[:,i]
+    return(results)
+
+
+def run_solar_task(file_str,COUNTRIES,config):
+
+    """
+    Runs the solar PV model on one file for all countries, reading t2m and
+    ssrd once each. They are read without masked arrays with missing values
+    set to NaN, which the model counts as a capacity factor of zero as the
+    masked np.average of solar_PV_model did.
+
+    Returns:
+
+        results (dict): {'solar_cf': {COUNTRY: time series}}
+
+    """
+
+    data_dir, filename = os.path.split(file_str)
+    missing_values = []
+    t2m_data = solar_PV.load_country_weather_data_multi(COUNTRIES,data_dir + os.sep,
+                                                        filename,'t2m',fast=True,
+                                                        missing_values=missing_values)
+    ssrd_data = solar_PV.load_country_weather_data_multi(COUNTRIES,data_dir + os.sep,
+                                                         filename,'ssrd',fast=True,
+                                                         missing_values=missing_values)
+    for variable_missing in missing_values:
+        if variable_missing.count > 0:
+            print(filename + ': ' + str(variable_missing.count) + ' missing ' +
+                  variable_missing.nc_key + ' values count as zero solar power')
+
+    results = {'solar_cf': {}}
+    for COUNTRY in COUNTRIES:
+        country_t2m, country_mask, _ = t2m_data[COUNTRY]
+        country_ssrd = ssrd_data[COUNTRY][0]
+        if np.any(country_mask):
+            results['solar_cf'][COUNTRY] = solar_PV.solar_PV_model_fused(
+                country_t2m,country_ssrd,country_mask)
+    return(results)
+
+
+def run_demand_task(file_str,COUNTRIES,config):
+
+    """
+    Runs the demand model on one (hourly) file for all countries, reading
+    t2m once. The national means are taken hourly and then daily-meaned,
+    so incomplete days at the ends of the file are kept.
+
+    Returns:
+
+        results (dict): {'hdd': {...}, 'cdd': {...}, 'demand': {...},
+            'demand_full': {...}}, each {COUNTRY: daily time series}.
+            'demand' is the weather-dependent demand of
+            calc_national_wd_demand_2017 and 'demand_full' also has the
+            day-of-week terms, see demand.calc_national_demand.
+
+    """
+
+    lons, lats = era5_io.load_era5_grid(file_str)
+    demand_countries = []
+    full_masks = []
+    for COUNTRY in COUNTRIES:
+        full_mask = country_masks.get_country_mask(COUNTRY,lons,lats)
+        if np.any(full_mask):
+            demand_countries.append(COUNTRY)
+            full_masks.append(full_mask)
+
+    results = {'hdd': {},'cdd': {},'demand': {},'demand_full': {}}
+    if len(demand_countries) == 0:
+        return(results)
+
+    # read only the window covering all of the countries
+    lat_window, lon_window = country_masks.union_mask_window(full_masks)
+    t2m_data = era5_io.load_era5_variable(file_str,'t2m',lat_window,lon_window)[2]
+    weight_matrix = aggregation.make_weight_matrix(
+        [full_mask[lat_window,lon_window] for full_mask in full_masks])
+    times, time_units, calendar = era5_io.load_era5_times(file_str)
+    day_starts = demand.day_start_indices(times,time_units,calendar)
+    hdd, cdd = demand.calc_hdd_cdd_multi(t2m_data,weight_matrix,hourly=True,
+                                         day_starts=day_starts)
+    for i, COUNTRY in enumerate(demand_countries):
+        results['hdd'][COUNTRY] = hdd[:,i]
+        results['cdd'][COUNTRY] = cdd[:,i]
+
+    # only the 28 countries in the demand model have demand
+    coefficients = demand.load_demand_coefficients(config.filestr_reg_coefficients)
+    modelled = [i for i, COUNTRY in enumerate(demand_countries)
+                if file_country_name(COUNTRY) in coefficients.countries]
+    if len(modelled) == 0:
+        return(results)
+    modelled_names = [file_country_name(demand_countries[i]) for i in modelled]
+    weekdays = demand.day_of_week(times[day_starts],time_units,calendar)
+    demand_full = demand.calc_national_demand(hdd[:,modelled],cdd[:,modelled],
+                                              weekdays,
+                                              config.filestr_reg_coefficients,
+                                              modelled_names)
+    for j, i in enumerate(modelled):
+        COUNTRY = demand_countries[i]
+        results['demand'][COUNTRY] = demand.calc_national_wd_demand_2017(
+            hdd[:,i],cdd[:,i],config.filestr_reg_coefficients,
+            file_country_name(COUNTRY))
+        results['demand_full'][COUNTRY] = demand_full[:,j]
+    return(results)
+
+
+TASKS = {'wind': run_wind_task,'solar': run_solar_task,'demand': run_demand_task}
+
+
+def run_task(file_str,model,COUNTRIES,config):
+
+    """
+    Runs one (file, model) task, returning (file_str, model, results,
+    profile). profile is the task's profiling.profile_snapshot, or None if
+    profiling is off.
+    """
+
+    if not profiling.profiling_enabled():
+        return(file_str,model,TASKS[model](file_str,COUNTRIES,config),None)
+
+    # only this task's stages go back to the parent
+    profiling.reset_profile()
+    with profiling.stage('batch.' + model + '_task'):
+        results = TASKS[model](file_str,COUNTRIES,config)
+    return(file_str,model,results,profiling.profile_snapshot())
+
+
+def write_task_results(file_str,model,results,config):
+
+    """
+    Writes the results of one task to
+    output_dir/model/<input file name>.npz, one array per quantity and
+    country (e.g. 'wind_cf/France').
+    """
+
+    out_dir = os.path.join(config.output_dir,model)
+    os.makedirs(out_dir,exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file_str))[0]
+    out_file = os.path.join(out_dir,stem + '.npz')
+
+    arrays = {}
+    for quantity in results:
+        for COUNTRY in results[quantity]:
+            arrays[quantity + '/' + COUNTRY] = results[quantity][COUNTRY]
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file,'wb') as f:
+        np.savez(f,**arrays)
+    os.replace(tmp_file,out_file)
+    return(out_file)
+
+
+def task_day_starts(file_str):
+
+    """
+    Returns the index of the first timestep of each day in an hourly file.
+    """
+
+    return(demand.day_start_indices(*era5_io.load_era5_times(file_str)))
+
+
+def task_times(file_str,model):
+
+    """
+    Returns the times of the results of one (file, model) task as
+    (times, time_units, calendar): hourly for wind and solar, and the first
+    timestep of each day for the daily demand model.
+    """
+
+    times, time_units, calendar = era5_io.load_era5_times(file_str)
+    if model == 'demand':
+        times = times[task_day_starts(file_str)]
+    return(times,time_units,calendar)
+
+
+def write_task_store(file_str,model,results,config):
+
+    """
+    Appends the results of one task to the time-series stores in
+    output_dir/store, one file per quantity.
+    """
+
+    store_dir = os.path.join(config.output_dir,'store')
+    times, time_units, calendar = task_times(file_str,model)
+    for quantity in results:
+        if len(results[quantity]) == 0:
+            continue
+        output_store.append_time_series(
+            output_store.store_file(store_dir,quantity),quantity,times,
+            time_units,results[quantity],calendar)
+
+
+def model_settings(model,COUNTRIES,config):
+
+    """
+    Returns the settings that affect the output of a model, including the
+    size and modification time of the files it depends on, to be hashed
+    into the run manifest.
+    """
+
+    def file_state(file_str):
+        if not os.path.exists(file_str):
+            return(None)
+        return(manifest.input_signature(file_str))
+
+    settings = {'model': model}
+    if model == 'wind':
+        power_curve_files = [wind_power.POWER_CURVE_FILES.get(power_curve,power_curve)
+                             for power_curve in config.power_curves]
+        settings['power_curves'] = [(power_curve_file,file_state(power_curve_file))
+                                    for power_curve_file in power_curve_files]
+        settings['bias_correction'] = (config.bias_correction_file,
+                                       file_state(config.bias_correction_file))
+        settings['optimal_turbines'] = (config.optimal_turbines,
+                                        file_state(config.optimal_turbines))
+        windfarm_files = [config.windfarm_file_pattern.format(
+            country=file_country_name(COUNTRY)) for COUNTRY in COUNTRIES]
+        settings['windfarms'] = [(windfarm_file,file_state(windfarm_file))
+                                 for windfarm_file in windfarm_files]
+    if model == 'demand':
+        settings['reg_coefficients'] = (config.filestr_reg_coefficients,
+                                        file_state(config.filestr_reg_coefficients))
+    return(settings)
+
+
+def run_batch(file_pattern,COUNTRIES,models=MODELS,config=DEFAULT_CONFIG,
+              processes=None,resume=True,checksum=False,profile_file=None,
+              profile_memory=False):
+
+    """
+    This function runs the chosen models over every file matching
+    file_pattern for all of COUNTRIES, spreading the (file, model) tasks
+    over a pool of processes and writing each task's results as it
+    completes.
+
+    Args:
+        file_pattern (str): A glob pattern for the ERA5 files, e.g.
+            '/data/ERA5_1hr_*_DET.nc'
+
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France','Czech Republic']
+
+        models (list): Which of 'wind', 'solar' and 'demand' to run.
+
+        config (BatchConfig): The run configuration, see DEFAULT_CONFIG.
+
+        processes (int): The number of worker processes, defaults to the
+            number of cores.
+
+        resume (bool): If True, (file, model) tasks whose every country is
+            recorded in output_dir/manifest.json as done, with an unchanged
+            input file and the same settings, are skipped. This means only
+            new (e.g. newly downloaded) months are computed.
+
+        checksum (bool): Also record the checksum of each input file, so a
+            file re-downloaded with identical contents is still skipped.
+
+        profile_file (str): If given, profile the run and write the report
+            here (.json or .csv), see energy_model_functions_profiling.py.
+
+        profile_memory (bool): Also track the peak memory of each stage in
+            the profile. This slows the run down a lot.
+
+    Returns:
+
+        output_files (list): The files written, in order of completion.
+
+    """
+
+    filenames = sorted(glob.glob(file_pattern))
+    if len(filenames) == 0:
+        raise ValueError('No files match ' + file_pattern)
+    for model in models:
+        if model not in TASKS:
+            raise ValueError('Unknown model: ' + model)
+
+    manifest_file = os.path.join(config.output_dir,manifest.MANIFEST_FILENAME)
+    run_manifest = manifest.load_manifest(manifest_file)
+    settings_hashes = dict((model,manifest.config_hash(
+        model_settings(model,COUNTRIES,config))) for model in models)
+
+    # only the tasks with a country that is new, changed or missing output
+    tasks = []
+    for file_str in filenames:
+        for model in models:
+            if resume and all(manifest.is_complete(run_manifest,file_str,model,
+                                                   COUNTRY,settings_hashes[model])
+                              for COUNTRY in COUNTRIES):
+                continue
+            tasks.append((file_str,model))
+    print(str(len(tasks)) + ' of ' + str(len(filenames)*len(models)) +
+          ' tasks to run')
+    if len(tasks) == 0:
+        return([])
+
+    if profile_file is not None:
+        profiling.enable_profiling(profile_memory)
+    load_shared_state(COUNTRIES,models,filenames[0],config)
+
+    output_files = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes,initializer=_init_worker,
+            initargs=(COUNTRIES,models,filenames[0],config,
+                      None if profile_file is None else profile_memory)) as pool:
+        futures = [pool.submit(run_task,file_str,model,COUNTRIES,config)
+                   for file_str, model in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            file_str, model, results, task_profile = future.result()
+            if task_profile is not None:
+                profiling.merge_profile(task_profile)
+            out_file = write_task_results(file_str,model,results,config)
+            write_task_store(file_str,model,results,config)
+            output_files.append(out_file)
+
+            # record the task as soon as its output is safely written
+            for COUNTRY in COUNTRIES:
+                has_output = any(COUNTRY in results[quantity]
+                                 for quantity in results)
+                manifest.record_complete(run_manifest,file_str,model,COUNTRY,
+                                         settings_hashes[model],
+                                         out_file if has_output else None,
+                                         checksum)
+            manifest.save_manifest(run_manifest,manifest_file)
+            print('Finished ' + model + ' for ' + file_str)
+
+    if profile_file is not None:
+        profiling.write_profile_report(profile_file,
+                                       {'tasks': len(tasks),'processes': processes})
+        print('Profile written to ' + profile_file)
+
+    return(output_files)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run the energy models over '
+                                     'many ERA5 files and countries.')
+    parser.add_argument('file_pattern',help="e.g. '/data/ERA5_1hr_*_DET.nc'")
+    parser.add_argument('--countries',nargs='+',
+                        default=country_masks.EUROPEAN_COUNTRIES)
+    parser.add_argument('--models',nargs='+',default=MODELS,choices=MODELS)
+    parser.add_argument('--output-dir',default=DEFAULT_CONFIG.output_dir)
+    parser.add_argument('--processes',type=int,default=None)
+    parser.add_argument('--chunk-size',type=int,default=DEFAULT_CONFIG.chunk_size)
+    parser.add_argument('--no-resume',action='store_true',
+                        help='rerun everything, ignoring the manifest')
+    parser.add_argument('--checksum',action='store_true',
+                        help='also checksum the input files in the manifest')
+    parser.add_argument('--profile',default=None,metavar='REPORT',
+                        help='write a profile of the run to REPORT (.json or .csv)')
+    parser.add_argument('--profile-memory',action='store_true',
+                        help='also track peak memory in the profile (slow)')
+    parser.add_argument('--windfarm-file-pattern',
+                        default=DEFAULT_CONFIG.windfarm_file_pattern,
+                        help="with '{country}' for the country name")
+    args = parser.parse_args()
+
+    config = DEFAULT_CONFIG._replace(output_dir=args.output_dir,
+                                     chunk_size=args.chunk_size,
+                                     windfarm_file_pattern=args.windfarm_file_pattern)
+    run_batch(args.file_pattern,args.countries,args.models,config,args.processes,
+              resume=not args.no_resume,checksum=args.checksum,
+              profile_file=args.profile,profile_memory=args.profile_memory)
@@ -0,0 +1,460 @@
+import argparse
+import collections
+import hashlib
+import os
+
+import numpy as np
+import cartopy.io.shapereader as shpreader
+import shapely.ops
+from netCDF4 import Dataset
+
+import energy_model_functions_profiling as profiling
+
+try: # shapely >= 2.0 has vectorised point-in-polygon tests built in
+    from shapely import contains_xy, prepare
+except ImportError: # shapely 1.x
+    from shapely.vectorized import contains as contains_xy
+    prepare = None
+
+
+# where masks are kept between runs, set ENERGY_MODEL_MASK_CACHE=''
+# to keep them in memory only.
+MASK_CACHE_DIR = os.environ.get('ENERGY_MODEL_MASK_CACHE',
+                                os.path.join(os.path.expanduser('~'),'.cache',
+                                             'energy_model_masks'))
+# how many masks are held in memory at once.
+MASK_CACHE_SIZE = 64
+
+# the 28 countries covered by the demand model (Natural Earth NAME_LONG).
+EUROPEAN_COUNTRIES = ['Austria','Belgium','Bulgaria','Croatia','Czech Republic',
+                      'Denmark','Finland','France','Germany','Greece','Hungary',
+                      'Ireland','Italy','Latvia','Lithuania','Luxembourg',
+                      'Montenegro','Netherlands','Norway','Poland','Portugal',
+                      'Romania','Slovakia','Slovenia','Spain','Sweden',
+                      'Switzerland','United Kingdom']
+
+_mask_cache = collections.OrderedDict()
+_country_geometries = {} # COUNTRY -> (geometry, version string)
+_registered_countries = set()
+_shapefile_versions = {}
+_natural_earth_version = None # worked out once per process
+
+
+def natural_earth_shapefile():
+
+    """
+    Returns the path of the Natural Earth 10m admin_0 shapefile, downloading
+    it through cartopy if it is not already on disk.
+    """
+
+    countries_shp = shpreader.natural_earth(resolution='10m',category='cultural',
+                                            name='admin_0_countries')
+    return(countries_shp)
+
+
+def shapefile_version(countries_shp):
+
+    """
+    Returns a hash of the contents of a shapefile (the .shp geometries and
+    the .dbf attributes the countries are looked up by), so that cached
+    masks are rebuilt if the shapefile is ever updated. The hash is only
+    recomputed when the size or modification time of the files change.
+    """
+
+    filenames = [countries_shp]
+    dbf_file = os.path.splitext(countries_shp)[0] + '.dbf'
+    if os.path.exists(dbf_file):
+        filenames.append(dbf_file)
+    key = tuple((filename,os.stat(filename).st_size,os.stat(filename).st_mtime_ns)
+                for filename in filenames)
+    if key not in _shapefile_versions:
+        file_hash = hashlib.sha1()
+        for filename in filenames:
+            with open(filename,'rb') as f:
+                for block in iter(lambda: f.read(1 << 20),b''):
+                    file_hash.update(block)
+        _shapefile_versions[key] = file_hash.hexdigest()
+    return(_shapefile_versions[key])
+
+
+def natural_earth_version():
+
+    """
+    Returns shapefile_version of the Natural Earth shapefile. It is only
+    worked out once per process, so looking up a cached mask doesn't stat
+    (or find) the shapefile every time.
+    """
+
+    global _natural_earth_version
+    if _natural_earth_version is None:
+        _natural_earth_version = shapefile_version(natural_earth_shapefile())
+    return(_natural_earth_version)
+
+
+def register_country_geometry(COUNTRY,country_geometry):
+
+    """
+    Use your own border for COUNTRY instead of the Natural Earth one, e.g.
+    for a custom region or for running offline. Masks for it are cached
+    against a hash of the geometry itself.
+
+    Args:
+        COUNTRY (str): The name the region will be requested by.
+
+        country_geometry (shapely geometry): Polygon or MultiPolygon of the
+            region border.
+    """
+
+    version = 'wkb-' + hashlib.sha1(country_geometry.wkb).hexdigest()
+    _country_geometries[COUNTRY] = (country_geometry,version)
+    _registered_countries.add(COUNTRY)
+
+
+@profiling.profiled
+def load_country_geometries(COUNTRIES):
+
+    """
+    This function reads the Natural Earth admin_0 shapefile once and returns
+    the border of each of the requested countries as a single shapely
+    geometry. If a country is stored as more than one record (or as a
+    MultiPolygon) all of the parts are kept. Borders are kept in memory so
+    the shapefile is only read again for countries not seen before.
+
+    You will need the shpreader.natural_earth data downloaded
+    to find the shapefiles.
+
+    Args:
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France','Czech Republic']
+
+    Returns:
+
+        country_geometries (dict): COUNTRY -> Polygon or MultiPolygon of the
+            country border.
+
+    """
+
+    missing = [COUNTRY for COUNTRY in COUNTRIES
+               if COUNTRY not in _country_geometries]
+    if len(missing) > 0:
+        countries_shp = natural_earth_shapefile()
+        version = natural_earth_version()
+        country_shapely = dict((COUNTRY,[]) for COUNTRY in missing)
+        for country in shpreader.Reader(countries_shp).records():
+            if country.attributes['NAME_LONG'] in country_shapely:
+                print('Found country')
+                country_shapely[country.attributes['NAME_LONG']].append(
+                    country.geometry)
+
+        for COUNTRY in missing:
+            if len(country_shapely[COUNTRY]) == 0:
+                raise ValueError('Country not found in the shapefile: ' + COUNTRY)
+            country_geometry = shapely.ops.unary_union(country_shapely[COUNTRY])
+            _country_geometries[COUNTRY] = (country_geometry,version)
+
+    country_geometries = dict((COUNTRY,_country_geometries[COUNTRY][0])
+                              for COUNTRY in COUNTRIES)
+    return(country_geometries)
+
+
+@profiling.profiled
+def load_country_geometry(COUNTRY):
+
+    """
+    This function reads the Natural Earth admin_0 shapefile and returns the
+    border of the requested country as a single shapely geometry. If the
+    country is stored as more than one record (or as a MultiPolygon) all
+    of the parts are kept.
+
+    You will need the shpreader.natural_earth data downloaded
+    to find the shapefiles.
+
+    Args:
+        COUNTRY (str): This must be a name of a country (or set of) e.g.
+            'United Kingdom','France','Czech Republic'
+
+    Returns:
+
+        country_geometry (shapely geometry): Polygon or MultiPolygon of the
+            country border.
+
+    """
+
+    country_geometry = load_country_geometries([COUNTRY])[COUNTRY]
+
+    return(country_geometry)
+
+
+@profiling.profiled
+def make_country_mask(country_geometry,lons,lats):
+
+    """
+    This function rasterises a country border onto a regular lat/lon grid in
+    one vectorised pass. Only the gridpoints inside the bounding box of the
+    country are tested, and these are tested all at once against a
+    prepared geometry rather than one shapely.geometry.Point at a time.
+
+    Args:
+        country_geometry (shapely geometry): Polygon or MultiPolygon of the
+            country border, e.g. from load_country_geometry.
+
+        lons (array): Dimensions [lon], the longitudes of the grid.
+
+        lats (array): Dimensions [lat], the latitudes of the grid.
+
+    Returns:
+
+        MASK_MATRIX_RESHAPE (array): Dimensions [lat,lon] where there are 1's if
+           the data is within a country border and zeros if data is outside a
+           country border.
+
+    """
+
+    lons = np.asarray(lons,dtype=np.float64)
+    lats = np.asarray(lats,dtype=np.float64)
+    MASK_MATRIX_RESHAPE = np.zeros((len(lats),len(lons)))
+
+    # cut down to the gridpoints within the country's bounding box first
+    min_lon, min_lat, max_lon, max_lat = country_geometry.bounds
+    lon_in_box = (lons >= min_lon) & (lons <= max_lon)
+    lat_in_box = (lats >= min_lat) & (lats <= max_lat)
+    if not (lon_in_box.any() and lat_in_box.any()):
+        return(MASK_MATRIX_RESHAPE)
+
+    if prepare is not None:
+        prepare(country_geometry)
+
+    LONS, LATS = np.meshgrid(lons[lon_in_box],lats[lat_in_box])
+    inside = contains_xy(country_geometry,LONS,LATS)
+    MASK_MATRIX_RESHAPE[np.ix_(lat_in_box,lon_in_box)] = inside
+
+    return(MASK_MATRIX_RESHAPE)
+
+
+def country_mask_window(country_mask):
+
+    """
+    This function finds the smallest lat/lon window that holds every nonzero
+    gridpoint of a mask, so that data can be cropped to the country.
+
+    Args:
+        country_mask (array): Dimensions [lat,lon], nonzero within the country.
+
+    Returns:
+
+        lat_slice (slice): The latitude indices of the window.
+
+        lon_slice (slice): The longitude indices of the window. Both slices
+            are empty if the mask is zero everywhere.
+
+    """
+
+    lat_index = np.flatnonzero(np.any(country_mask,axis=1))
+    lon_index = np.flatnonzero(np.any(country_mask,axis=0))
+    if len(lat_index) == 0:
+        return(slice(0,0),slice(0,0))
+
+    lat_slice = slice(int(lat_index[0]),int(lat_index[-1])+1)
+    lon_slice = slice(int(lon_index[0]),int(lon_index[-1])+1)
+    return(lat_slice,lon_slice)
+
+
+def union_mask_window(country_masks):
+
+    """
+    Returns the smallest lat/lon window (as from country_mask_window) that
+    holds every nonzero gridpoint of all of the given masks.
+    """
+
+    any_country = np.zeros(np.shape(country_masks[0]),dtype=bool)
+    for country_mask in country_masks:
+        any_country |= (country_mask != 0)
+    return(country_mask_window(any_country))
+
+
+@profiling.profiled
+def apply_country_mask(data,country_mask):
+
+    """
+    Returns data (dimensions [...,lat,lon]) multiplied by a country mask,
+    i.e. with zeros outside the country. Plain arrays keep their dtype, so
+    float32 data isn't promoted by the float64 mask.
+    """
+
+    if isinstance(data,np.ma.MaskedArray):
+        return(data*country_mask)
+    return(np.multiply(data,country_mask,dtype=data.dtype))
+
+
+def mask_cache_key(COUNTRY,lons,lats):
+
+    """
+    Returns the key a country mask is cached under: a hash of the country
+    name, the version of the border it is built from and the grid
+    coordinates.
+    """
+
+    if COUNTRY in _registered_countries:
+        version = _country_geometries[COUNTRY][1]
+    else:
+        version = natural_earth_version()
+
+    key_hash = hashlib.sha1()
+    key_hash.update(COUNTRY.encode('utf-8'))
+    key_hash.update(version.encode('utf-8'))
+    key_hash.update(np.ascontiguousarray(lons,dtype=np.float64).tobytes())
+    key_hash.update(b'|')
+    key_hash.update(np.ascontiguousarray(lats,dtype=np.float64).tobytes())
+    return(key_hash.hexdigest())
+
+
+def _mask_cache_file(cache_dir,COUNTRY,key):
+    return(os.path.join(cache_dir,COUNTRY.replace(' ','_') + '_' + key[:20] + '.npz'))
+
+
+def _remember_mask(key,country_mask):
+    country_mask.setflags(write=False) # shared between callers
+    _mask_cache[key] = country_mask
+    _mask_cache.move_to_end(key)
+    while len(_mask_cache) > MASK_CACHE_SIZE:
+        _mask_cache.popitem(last=False)
+
+
+def _cached_mask(COUNTRY,key,cache_dir):
+    # returns the mask from memory or disk, or None if it hasn't been built
+    if key in _mask_cache:
+        _mask_cache.move_to_end(key)
+        return(_mask_cache[key])
+
+    if cache_dir:
+        cache_file = _mask_cache_file(cache_dir,COUNTRY,key)
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                MASK_MATRIX_RESHAPE = cached['mask'].astype(np.float64)
+            _remember_mask(key,MASK_MATRIX_RESHAPE)
+            return(MASK_MATRIX_RESHAPE)
+
+    return(None)
+
+
+@profiling.profiled
+def get_country_mask(COUNTRY,lons,lats,cache_dir=None):
+
+    """
+    This function returns the mask of COUNTRY on the grid given by lons and
+    lats. Masks are looked up in an in-memory LRU cache, then in the on-disk
+    cache, and only rebuilt from the shapefile if neither has them.
+
+    Args:
+        COUNTRY (str): This must be a name of a country (or set of) e.g.
+            'United Kingdom','France','Czech Republic'
+
+        lons (array): Dimensions [lon], the longitudes of the grid.
+
+        lats (array): Dimensions [lat], the latitudes of the grid.
+
+        cache_dir (str): Directory for the on-disk cache, defaults to
+            MASK_CACHE_DIR. If '' masks are only cached in memory.
+
+    Returns:
+
+        MASK_MATRIX_RESHAPE (array): Dimensions [lat,lon] where there are 1's if
+           the data is within a country border and zeros if data is outside a
+           country border. The array is read-only as it is shared.
+
+    """
+
+    if cache_dir is None:
+        cache_dir = MASK_CACHE_DIR
+
+    key = mask_cache_key(COUNTRY,lons,lats)
+    MASK_MATRIX_RESHAPE = _cached_mask(COUNTRY,key,cache_dir)
+    if MASK_MATRIX_RESHAPE is not None:
+        return(MASK_MATRIX_RESHAPE)
+
+    country_geometry = load_country_geometry(COUNTRY)
+    MASK_MATRIX_RESHAPE = make_country_mask(country_geometry,lons,lats)
+
+    if cache_dir:
+        cache_file = _mask_cache_file(cache_dir,COUNTRY,key)
+        os.makedirs(cache_dir,exist_ok=True)
+        # write to a temporary file first so a killed run can't leave a
+        # half-written mask behind.
+        tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_file,'wb') as f:
+            np.savez_compressed(f,mask=MASK_MATRIX_RESHAPE.astype(bool))
+        os.replace(tmp_file,cache_file)
+
+    _remember_mask(key,MASK_MATRIX_RESHAPE)
+    return(MASK_MATRIX_RESHAPE)
+
+
+@profiling.profiled
+def warm_country_mask_cache(COUNTRIES,lons,lats,cache_dir=None):
+
+    """
+    Builds and caches the masks for all of COUNTRIES ahead of a run, reading
+    the shapefile only once.
+
+    Args:
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France','Czech Republic']
+
+        lons (array): Dimensions [lon], the longitudes of the grid.
+
+        lats (array): Dimensions [lat], the latitudes of the grid.
+
+        cache_dir (str): Directory for the on-disk cache, defaults to
+            MASK_CACHE_DIR.
+
+    Returns:
+
+        country_masks (dict): COUNTRY -> mask, dimensions [lat,lon].
+
+    """
+
+    if cache_dir is None:
+        cache_dir = MASK_CACHE_DIR
+
+    # read the shapefile once for every mask that still needs building
+    load_country_geometries([COUNTRY for COUNTRY in COUNTRIES
+                             if COUNTRY not in _registered_countries and
+                             _cached_mask(COUNTRY,mask_cache_key(COUNTRY,lons,lats),
+                                          cache_dir) is None])
+    country_masks = dict((COUNTRY,get_country_mask(COUNTRY,lons,lats,cache_dir))
+                         for COUNTRY in COUNTRIES)
+    return(country_masks)
+
+
+def clear_country_mask_cache():
+
+    """
+    Empties the in-memory mask cache (the on-disk cache is left alone).
+    """
+
+    _mask_cache.clear()
+
+
+if __name__ == '__main__':
+
+    # e.g. python energy_model_functions_country_masks.py ERA5_1hr_1979_01_DET.nc
+    parser = argparse.ArgumentParser(
+        description='Build the country masks for the grid of an ERA5 file '
+                    'and store them in the on-disk mask cache.')
+    parser.add_argument('grid_file',help='a .nc file on the required grid')
+    parser.add_argument('--countries',nargs='+',default=EUROPEAN_COUNTRIES)
+    parser.add_argument('--cache-dir',default=None)
+    args = parser.parse_args()
+
+    dataset = Dataset(args.grid_file,mode='r')
+    lon_key = 'longitude' if 'longitude' in dataset.variables else 'lon'
+    lat_key = 'latitude' if 'latitude' in dataset.variables else 'lat'
+    lons = dataset.variables[lon_key][:]
+    lats = dataset.variables[lat_key][:]
+    dataset.close()
+
+    country_masks = warm_country_mask_cache(args.countries,lons,lats,
+                                            args.cache_dir)
+    for COUNTRY in args.countries:
+        print(COUNTRY + ': ' + str(int(country_masks[COUNTRY].sum())) +
+              ' gridpoints')
@@ -1,10 +1,130 @@
+import collections
+import os
+
 import numpy as np
-import cartopy.io.shapereader as shpreader
-from netCDF4 import Dataset
-import shapely.geometry
+from netCDF4 import date2num, num2date
+import energy_model_functions_aggregation as aggregation
+import energy_model_functions_country_masks as country_masks
+import energy_model_functions_era5_io as era5_io
+import energy_model_functions_profiling as profiling
+
+
+# The base temperatures (celsius) of the heating and cooling degree days in
+# Bloomfield et al.,(2020) https://doi.org/10.1002/met.1858
+HDD_BASE = 15.5
+CDD_BASE = 22.0
+
+# The year the demand model is set up to recreate demand for.
+DEMAND_TIME_POINT = 2017.
+
+# The regression coefficients of the demand model (e.g. from
+# ERA5_Regression_coeffs_demand_model.csv). terms are the row names
+# ('time', 'WD1'-'WD5' for Monday-Friday, 'WK1' and 'WK2' for Saturday and
+# Sunday, 'HDD', 'CDD'), countries the column names (e.g. 'Czech_Republic')
+# and matrix the read-only coefficients, dimensions [term,country].
+DemandCoefficients = collections.namedtuple('DemandCoefficients',
+                                            ['terms','countries','matrix'])
+
+DAY_TYPE_TERMS = ['WD1','WD2','WD3','WD4','WD5','WK1','WK2']
+
+_demand_coefficients = {} # (file path, mtime) -> DemandCoefficients
+
+
+@profiling.profiled
+def day_start_indices(times,time_units,calendar='standard'):
+
+    """
+    This function finds where each day starts in a series of (e.g. hourly)
+    times, so that data can be daily-meaned even if the first or last day
+    is incomplete.
+
+    Args:
+
+        times (array): Dimensions [time], as numbers in time_units, e.g. from
+            era5_io.load_era5_times.
+
+        time_units (str): e.g. 'hours since 1900-01-01 00:00:00.0'
+
+        calendar (str): The calendar of times.
+
+    Returns:
+
+        day_starts (array): The index of the first timestep of each day.
+
+    """
+
+    days = np.floor(date2num(num2date(times,time_units,calendar),
+                             'days since 1900-01-01 00:00:00',calendar))
+    day_starts = np.flatnonzero(np.diff(days,prepend=np.nan) != 0)
+    return(day_starts)
+
+
+@profiling.profiled
+def daily_mean(data,day_starts=None,axis=0):
+
+    """
+    This function converts (e.g. hourly) data to daily means in one pass
+    with np.add.reduceat. Incomplete days are the mean of the timesteps
+    that are there. For masked arrays the masked (missing) values are left
+    out of the means and days with no values are masked, as np.ma.mean
+    would do.
+
+    Args:
+
+        data (array): Any dimensions, with time along axis.
+
+        day_starts (array): The index of the first timestep of each day, see
+            day_start_indices. Default every 24 timesteps from the first,
+            i.e. hourly data starting at 00 UTC.
+
+        axis (int): The time axis of data.
+
+    Returns:
+
+        daily_data (array): As data, with days rather than timesteps along
+            axis.
+
+    """
+
+    len_time = np.shape(data)[axis]
+    if day_starts is None:
+        day_starts = np.arange(0,len_time,24)
+    day_starts = np.asarray(day_starts)
+
+    day_lengths = np.diff(np.append(day_starts,len_time))
+    count_shape = [1]*np.ndim(data)
+    count_shape[axis] = len(day_lengths)
+    dtype = np.result_type(np.asarray(data).dtype,np.float32)
+    if np.ma.is_masked(data):
+        # the mean of the values that are there
+        missing = np.ma.getmaskarray(data)
+        daily_data = np.add.reduceat(np.ma.filled(data,0.),day_starts,
+                                     axis=axis,dtype=dtype)
+        day_counts = np.add.reduceat(~missing,day_starts,axis=axis,
+                                     dtype=dtype)
+        np.divide(daily_data,day_counts,out=daily_data,where=day_counts > 0)
+        return(np.ma.masked_array(daily_data,mask=day_counts == 0))
+
+    data = np.ma.getdata(data)
+    daily_data = np.add.reduceat(data,day_starts,axis=axis,dtype=dtype)
+    daily_data /= np.reshape(day_lengths,count_shape).astype(daily_data.dtype)
+    return(daily_data)
+
+
+def _daily_mean(data,hourflag):
+    # if hourly data convert to daily
+    if hourflag == 1:
+        data = daily_mean(data,axis=-3)
+        print('Converting to daily-mean')
+    if hourflag ==0:
+        print('data is daily (if not consult documentation!)')
+    return(data)
 
 
-def load_country_weather_data_daily(COUNTRY,data_dir,filename,nc_key,hourflag):
+@profiling.profiled
+def load_country_weather_data_daily(COUNTRY,data_dir,filename,nc_key,hourflag,
+                                    crop_to_country=False,fast=False,
+                                    missing_values=None):
 
     """
     This function takes the ERA5 reanalysis data, loads it and applied a 
@@ -30,6 +150,18 @@ def load_country_weather_data_daily(COUNTRY,data_dir,filename,nc_key,hourflag):
         hourflag (int): This is either 1 or 0, if daily data =0, if
            hourly data = 1.
 
+        crop_to_country (bool): If True only the lat/lon window around the
+            country is read from the file, and the returned arrays cover
+            that window rather than the whole domain.
+
+        fast (bool): If True the data is read without netCDF4's masked
+            arrays, as plain float32 with missing values set to NaN (see
+            era5_io.load_era5_variable_fast).
+
+        missing_values (list): If given (and fast is True), the
+            era5_io.MissingValues record of how the missing values of
+            nc_key were dealt with is appended to it.
+
     Returns:
 
         country_masked_data (array): Country-masked daily weather data,
@@ -41,61 +173,151 @@ def load_country_weather_data_daily(COUNTRY,data_dir,filename,nc_key,hourflag):
            the data is within a country border and zeros if data is outside a 
            country border. 
 
-    """
+        (lat_offset, lon_offset) (tuple): Only returned if crop_to_country is
+           True, the index of the window's first gridpoint in the full grid.
 
+    """
 
-    # first loop through the countries and extract the appropraite shapefile
-    countries_shp = shpreader.natural_earth(resolution='10m',category='cultural',
-                                            name='admin_0_countries')
-    country_shapely = []
-    for country in shpreader.Reader(countries_shp).records():
-        if country.attributes['NAME_LONG'] == COUNTRY:
-            print('Found country')
-            country_shapely.append(country.geometry)
 
-    # load in the data you wish to mask
     file_str = data_dir + filename
-    dataset = Dataset(file_str,mode='r')
-    lons = dataset.variables['longitude'][:]
-    lats = dataset.variables['latitude'][:]
-    data = dataset.variables[nc_key][:] # data in shape [time,lat,lon]
-    dataset.close()
-
-    # get data in appropriate units for models
-    if nc_key == 't2m':
-        data = data-273.15 # convert to Kelvin from Celsius
-    if nc_key == 'ssrd':
-        data = data/3600. # convert Jh-1m-2 to Wm-2
-
-    if hourflag == 1: # if hourly data convert to daily
-        data = np.mean ( np.reshape(data, (len(data)/24,24,len(lats),len(lons))),axis=1)
-        print('Converting to daily-mean')
-    if hourflag ==0:
-        print('data is daily (if not consult documentation!)')
-
-    LONS, LATS = np.meshgrid(lons,lats) # make grids of the lat and lon data
-    x, y = LONS.flatten(), LATS.flatten() # flatten these to make it easier to 
-    #loop over.
-    points = np.vstack((x,y)).T
-    MASK_MATRIX = np.zeros((len(x),1))
-    # loop through all the lat/lon combinations to get the masked points
-    for i in range(0,len(x)):
-        my_point = shapely.geometry.Point(x[i],y[i]) 
-        if country_shapely[0].contains(my_point) == True: 
-            MASK_MATRIX[i,0] = 1.0 # creates 1s and 0s where the country is
-    
-    MASK_MATRIX_RESHAPE = np.reshape(MASK_MATRIX,(len(lats),len(lons)))
+    if crop_to_country:
+        # find the country's window from the grid alone, then read only the
+        # hyperslab of data inside it.
+        lons, lats = era5_io.load_era5_grid(file_str)
+        full_mask = country_masks.get_country_mask(COUNTRY,lons,lats)
+        lat_slice, lon_slice = country_masks.country_mask_window(full_mask)
+        lons, lats, data = era5_io.load_era5_variable(file_str,nc_key,
+                                                      lat_slice,lon_slice,
+                                                      fast=fast,
+                                                      missing_values=missing_values)
+        data = _daily_mean(data,hourflag)
+
+        MASK_MATRIX_RESHAPE = full_mask[lat_slice,lon_slice]
+        country_masked_data = country_masks.apply_country_mask(data,
+                                                               MASK_MATRIX_RESHAPE)
+        return(country_masked_data,MASK_MATRIX_RESHAPE,
+               (lat_slice.start,lon_slice.start))
+
+    # load in the data you wish to mask, in appropriate units for models
+    lons, lats, data = era5_io.load_era5_variable(file_str,nc_key,fast=fast,
+                                                  missing_values=missing_values)
+
+    data = _daily_mean(data,hourflag)
+
+    # creates 1s and 0s where the country is (cached between calls)
+    MASK_MATRIX_RESHAPE = country_masks.get_country_mask(COUNTRY,lons,lats)
 
     # now apply the mask to the data that has been loaded in:
 
-    country_masked_data = data*MASK_MATRIX_RESHAPE
+    country_masked_data = country_masks.apply_country_mask(data,
+                                                           MASK_MATRIX_RESHAPE)
                                      
 
 
     return(country_masked_data,MASK_MATRIX_RESHAPE)
 
 
-def calc_hdd_cdd(t2m_array,country_mask):
+@profiling.profiled
+def load_country_weather_data_daily_multi(COUNTRIES,data_dir,filename,nc_key,
+                                          hourflag,fast=False,
+                                          member_slice=slice(None),
+                                          missing_values=None):
+
+    """
+    This function does the same as load_country_weather_data_daily for a list
+    of countries at once. The file is read, converted to the model units and
+    daily-meaned only once, then each country is cut out of it using its
+    own lat/lon window, so the results are cropped to each country rather
+    than the size of the original domain. Only the window covering all of
+    the countries is read from the file.
+
+    Args:
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France','Czech Republic']
+
+        data_dir (str): The parth for where the data is stored.
+            e.g '/home/users/zd907959/'
+
+        filename (str): The filename of a .netcdf file
+            e.g. 'ERA5_1979_01.nc'
+
+        nc_key (str): The string you need to load the .nc data
+            e.g. 't2m','rsds'
+
+        hourflag (int): This is either 1 or 0, if daily data =0, if
+           hourly data = 1.
+
+        fast (bool): If True the data is read without netCDF4's masked
+            arrays, as plain float32 with missing values set to NaN (see
+            era5_io.load_era5_variable_fast).
+
+        member_slice (slice): For ensembles, the members to read, default
+            all. Members can be streamed through the models by reading a
+            few at a time, see era5_io.member_slices.
+
+        missing_values (list): If given (and fast is True), the
+            era5_io.MissingValues record of how the missing values of
+            nc_key were dealt with is appended to it.
+
+    Returns:
+
+        country_data (dict): COUNTRY -> (country_masked_data, country_mask,
+            (lat_offset, lon_offset)). country_masked_data has dimensions
+            [time,lat,lon] (or [member,time,lat,lon] for ensembles) and
+            country_mask [lat,lon], both over the country's
+            window only. The offsets give the index of the window's first
+            gridpoint in the original grid.
+
+    """
+
+    file_str = data_dir + filename
+    lons, lats = era5_io.load_era5_grid(file_str)
+    full_masks = [country_masks.get_country_mask(COUNTRY,lons,lats)
+                  for COUNTRY in COUNTRIES]
+
+    # read only the window that covers all of the countries
+    lat_window, lon_window = country_masks.union_mask_window(full_masks)
+    lons, lats, data = era5_io.load_era5_variable(file_str,nc_key,
+                                                  lat_window,lon_window,
+                                                  fast=fast,
+                                                  member_slice=member_slice,
+                                                  missing_values=missing_values)
+
+    data = _daily_mean(data,hourflag)
+
+    country_data = {}
+    for COUNTRY, full_mask in zip(COUNTRIES,full_masks):
+        lat_slice, lon_slice = country_masks.country_mask_window(full_mask)
+        country_mask = full_mask[lat_slice,lon_slice]
+        # position of the country's window within the data that was read
+        lat_start = max(lat_slice.start-lat_window.start,0)
+        lon_start = max(lon_slice.start-lon_window.start,0)
+        country_masked_data = country_masks.apply_country_mask(
+            data[...,lat_start:lat_start+country_mask.shape[0],
+                 lon_start:lon_start+country_mask.shape[1]],country_mask)
+        country_data[COUNTRY] = (country_masked_data,country_mask,
+                                 (lat_slice.start,lon_slice.start))
+
+    return(country_data)
+
+
+@profiling.profiled
+def degree_days(t2m,hdd_base=HDD_BASE,cdd_base=CDD_BASE):
+
+    """
+    Returns the heating and cooling degree days (HDD, CDD) of daily-mean
+    temperatures (celsius) of any shape: how far each is below hdd_base
+    and above cdd_base, or zero.
+    """
+
+    HDD_term = np.maximum(hdd_base - t2m,0.)
+    CDD_term = np.maximum(t2m - cdd_base,0.)
+    return(HDD_term,CDD_term)
+
+
+@profiling.profiled
+def calc_hdd_cdd(t2m_array,country_mask,hdd_base=HDD_BASE,cdd_base=CDD_BASE,
+                 hourly=False,day_starts=None):
 
     """
 
@@ -107,43 +329,229 @@ def calc_hdd_cdd(t2m_array,country_mask):
     Args:
 
         t2m_array (array): array of country_masked 2m temperatures, Dimensions 
-            [time, lat,lon] or [lat,lon] in units of celsius. 
+            [time, lat,lon], [member,time,lat,lon] or [lat,lon] in units of
+            celsius.
         country_mask (array): array of the country mask applied to the t2m data 
             Dimensions [lat,lon] with 1's for gridpoints within the country.
+        hdd_base (float): The base temperature of the HDD, default 15.5.
+        cdd_base (float): The base temperature of the CDD, default 22.0.
+        hourly (bool): If True t2m_array is hourly, and the national mean is
+            daily-meaned (see daily_mean). Otherwise it must be daily.
+        day_starts (array): For hourly data, the index of the first
+            timestep of each day, see day_start_indices. Default every 24
+            timesteps.
     Returns:
 
-        HDD_term (array): Dimesions [time], timeseries of heating degree days
-        CDD_term (array): Dimesions [time], timeseries of cooling degree days
+        HDD_term (array): Dimesions [time] (or [member,time]), timeseries of
+            heating degree days
+        CDD_term (array): Dimesions [time] (or [member,time]), timeseries of
+            cooling degree days
+
+
+    """
+
+    spatial_mean_t2m = aggregation.aggregate_gridded_data(
+        t2m_array,aggregation.make_aggregation_weights(country_mask))
+    if hourly:
+        spatial_mean_t2m = daily_mean(spatial_mean_t2m,day_starts,axis=-1)
+
+    # note the degree days are of daily temperatures, so without hourly=True
+    # make sure these are daily!
+    HDD_term, CDD_term = degree_days(spatial_mean_t2m,hdd_base,cdd_base)
+
+    return(HDD_term,CDD_term)
+
 
+@profiling.profiled
+def calc_hdd_cdd_multi(t2m_array,country_weights,hdd_base=HDD_BASE,
+                       cdd_base=CDD_BASE,hourly=False,day_starts=None):
 
     """
-    len_time = np.shape(t2m_array)[0]
+    This function does calc_hdd_cdd for many countries, and any number of
+    ensemble members, at once. The national means are taken with one
+    (sparse) matrix product; if the data is hourly they are then
+    daily-meaned, which is the same as daily-meaning the gridded data first
+    but much cheaper.
+
+    Args:
+
+        t2m_array (array): 2m temperatures (celsius), dimensions
+            [...,time,lat,lon], e.g. [member,time,lat,lon].
+
+        country_weights (list or WeightMatrix): The country masks, each
+            [lat,lon], or a WeightMatrix made from them with
+            aggregation.make_weight_matrix.
 
-    spatial_mean_t2m =np.zeros(len_time)
-    for i in range(0,len_time):
-        spatial_mean_t2m[i] = np.average(t2m_array[i,:,:],weights=country_mask)
+        hdd_base (float): The base temperature of the HDD, default 15.5.
 
-    # note the function works on daily temperatures. so make sure these are daily!
+        cdd_base (float): The base temperature of the CDD, default 22.0.
 
-    HDD_term = np.zeros(len_time)
-    CDD_term = np.zeros(len_time)
+        hourly (bool): If True t2m_array is hourly and is daily-meaned
+            (see daily_mean).
 
-    for i in range(0,len_time):
-        if spatial_mean_t2m[i] <= 15.5:
-            HDD_term[i] = 15.5 - spatial_mean_t2m[i]
-        else:
-            HDD_term[i] =0
+        day_starts (array): For hourly data, the index of the first
+            timestep of each day, see day_start_indices. Default every 24
+            timesteps.
 
-    for i in range(0,len_time):
-        if spatial_mean_t2m[i] >= 22.0:
-            CDD_term[i] = spatial_mean_t2m[i] - 22.0
-        else:
-            CDD_term[i] =0
+    Returns:
+
+        HDD_term (array): Dimensions [...,time,country], heating degree days.
+
+        CDD_term (array): Dimensions [...,time,country], cooling degree days.
+
+    """
 
+    if not isinstance(country_weights,aggregation.WeightMatrix):
+        country_weights = aggregation.make_weight_matrix(country_weights)
 
+    national_t2m = aggregation.aggregate_gridded_data_multi(t2m_array,
+                                                            country_weights)
+    if hourly:
+        national_t2m = daily_mean(national_t2m,day_starts,axis=-2)
+
+    HDD_term, CDD_term = degree_days(national_t2m,hdd_base,cdd_base)
     return(HDD_term,CDD_term)
 
 
+@profiling.profiled
+def load_demand_coefficients(filestr_reg_coefficients):
+
+    """
+    This function reads the regression coefficients of the demand model.
+    The file is only parsed once (unless it changes on disk).
+
+    Args:
+
+        filestr_reg_coefficients (string): the filepath of the regression
+            coeffients for the dmeand model published here:
+            http://dx.doi.org/10.17864/1947.272
+
+    Returns:
+
+        coefficients (DemandCoefficients): The coefficients of all of the
+            countries.
+
+    """
+
+    modified = os.stat(filestr_reg_coefficients).st_mtime_ns
+    key = (os.path.abspath(filestr_reg_coefficients),modified)
+    if key not in _demand_coefficients:
+        with open(filestr_reg_coefficients) as f:
+            header = f.readline().strip().split(',')
+        # e.g. 'Czech_Republic_regression_coeffs_no_pop_weights.txt'
+        countries = [column.split('_regression_coeffs')[0]
+                     for column in header[1:]]
+        terms = [str(term) for term in np.genfromtxt(
+            filestr_reg_coefficients,skip_header=1,delimiter=',',usecols=0,
+            dtype=str)]
+        matrix = np.genfromtxt(filestr_reg_coefficients,skip_header=1,
+                               delimiter=',')[:,1:]
+        matrix.setflags(write=False)
+        _demand_coefficients[key] = DemandCoefficients(terms,countries,matrix)
+    return(_demand_coefficients[key])
+
+
+@profiling.profiled
+def day_of_week(times,time_units,calendar='standard'):
+
+    """
+    Returns the day of the week (0 for Monday to 6 for Sunday) of each of
+    times, given as numbers in time_units e.g. from era5_io.load_era5_times.
+    """
+
+    # 1900-01-01 was a Monday
+    days = np.floor(date2num(num2date(times,time_units,calendar),
+                             'days since 1900-01-01 00:00:00',calendar))
+    return(days.astype(int) % 7)
+
+
+@profiling.profiled
+def demand_design_matrix(weekdays,time_point=DEMAND_TIME_POINT):
+
+    """
+    This function makes the part of the demand model's design matrix that
+    is the same for every country: the time term and an indicator of the
+    day of the week, in the order of DAY_TYPE_TERMS.
+
+    Args:
+
+        weekdays (array): Dimensions [time], the day of the week of each day,
+            0 for Monday to 6 for Sunday, see day_of_week.
+
+        time_point (float): The year to model demand for.
+
+    Returns:
+
+        design_matrix (array): Dimensions [time,8], columns 'time' and then
+            DAY_TYPE_TERMS.
+
+    """
+
+    weekdays = np.asarray(weekdays)
+    design_matrix = np.zeros((len(weekdays),1 + len(DAY_TYPE_TERMS)))
+    design_matrix[:,0] = time_point
+    design_matrix[np.arange(len(weekdays)),1 + weekdays] = 1.
+    return(design_matrix)
+
+
+@profiling.profiled
+def calc_national_demand(hdd,cdd,weekdays,filestr_reg_coefficients,
+                         COUNTRIES=None,time_point=DEMAND_TIME_POINT):
+
+    """
+    This function computes daily demand for many countries at once with the
+    full demand model of Bloomfield et al.,(2020)
+    https://doi.org/10.1002/met.1858: the time trend, the day of the week
+    and the HDD and CDD terms. The time and day-of-week terms for every
+    country are one matrix product of demand_design_matrix with the
+    coefficients; the HDD and CDD terms differ between countries so are
+    added elementwise.
+
+    Args:
+
+        hdd (array): national heating degree days, dimensions
+            [...,time,country] (e.g. from calc_hdd_cdd_multi).
+
+        cdd (array): national cooling degree days, dimensions
+            [...,time,country].
+
+        weekdays (array): Dimensions [time], the day of the week of each day,
+            0 for Monday to 6 for Sunday, see day_of_week.
+
+        filestr_reg_coefficients (string): the filepath of the regression
+            coeffients for the dmeand model published here:
+            http://dx.doi.org/10.17864/1947.272
+
+        COUNTRIES (list): The countries of the last dimension of hdd and
+            cdd, with underscores e.g. 'Czech_Republic'. Default all 28
+            countries in the coefficient file, in its order.
+
+        time_point (float): The year to model demand for.
+
+    Returns:
+
+        demand_timeseries (array): Dimensions [...,time,country].
+
+    """
+
+    coefficients = load_demand_coefficients(filestr_reg_coefficients)
+    if COUNTRIES is None:
+        COUNTRIES = coefficients.countries
+    column_dictionary = dict((COUNTRY,i) for i, COUNTRY
+                             in enumerate(coefficients.countries))
+    columns = [column_dictionary[COUNTRY] for COUNTRY in COUNTRIES]
+    rows = [coefficients.terms.index(term) for term in ['time'] + DAY_TYPE_TERMS]
+    country_coeffs = coefficients.matrix[:,columns]
+
+    design_matrix = demand_design_matrix(weekdays,time_point)
+    demand_timeseries = np.dot(design_matrix,country_coeffs[rows])
+    demand_timeseries = (demand_timeseries +
+                         country_coeffs[coefficients.terms.index('HDD')]*hdd +
+                         country_coeffs[coefficients.terms.index('CDD')]*cdd)
+    return(demand_timeseries)
+
+
+@profiling.profiled
 def calc_national_wd_demand_2017(hdd,cdd,filestr_reg_coefficients,COUNTRY):
 
 
@@ -156,6 +564,9 @@ def calc_national_wd_demand_2017(hdd,cdd,filestr_reg_coefficients,COUNTRY):
     Regression coefficients are available here for the ERA5 hourly demand model
     https://researchdata.reading.ac.uk/272/
 
+    The day-of-week terms of the model are left out, see
+    calc_national_demand for the full model.
+
     Args:
 
         hdd (array): array of national heating degree days, Dimensions 
@@ -173,57 +584,17 @@ def calc_national_wd_demand_2017(hdd,cdd,filestr_reg_coefficients,COUNTRY):
 
     """
 
-    all_coeffs = np.genfromtxt(filestr_reg_coefficients,skip_header=1,
-                               delimiter=',')
-    time_point = 2017. # this is the year the demand model is setup to 
-                       # recreate data from.
-
-    # Dictionary saying which country is in which column of the regression
-    # coefficent file, filestr_reg_coefficients.
-    column_dictionary = {
-        "Austria" : 1,
-        "Belgium" : 2,
-        "Bulgaria" : 3,
-        "Croatia" : 4,
-        "Czech_Republic" : 5,
-        "Denmark" : 6,
-        "Finland" : 7,
-        "France" : 8,
-        "Germany" : 9,
-        "Greece" : 10,
-        "Hungary" : 11,
-        "Ireland" : 12,
-        "Italy" : 13,
-        "Latvia" : 14,
-        "Lithuania" : 15,
-        "Luxembourg" : 16,
-        "Montenegro" : 17,
-        "Netherlands" : 18,
-        "Norway" : 19,
-        "Poland" : 20,
-        "Portugal" : 21,
-        "Romania" : 22,
-        "Slovakia" : 23,
-        "Slovenia" : 24,
-        "Spain" : 25,
-        "Sweden" : 26,
-        "Switzerland" : 27,
-        "United_Kingdom" : 28,
-
-    }
-
-    column = column_dictionary[COUNTRY]
-    reg_coeffs = all_coeffs[:,column]
-
-    time_coeff = reg_coeffs[0]
-    hdd_coeff = reg_coeffs[8]
-    cdd_coeff = reg_coeffs[9]
-    #weekday_coeff = reg_coeffs[1]
-
-    demand_timeseries = (time_coeff*time_point) + (hdd_coeff*hdd) + (cdd_coeff*cdd)
-                  
+    # the coefficients are read once and kept, see load_demand_coefficients
+    coefficients = load_demand_coefficients(filestr_reg_coefficients)
+    column_dictionary = dict((COUNTRY,i) for i, COUNTRY
+                             in enumerate(coefficients.countries))
+    reg_coeffs = dict(zip(coefficients.terms,
+                          coefficients.matrix[:,column_dictionary[COUNTRY]]))
 
+    time_coeff = reg_coeffs['time']
+    hdd_coeff = reg_coeffs['HDD']
+    cdd_coeff = reg_coeffs['CDD']
 
+    demand_timeseries = (time_coeff*DEMAND_TIME_POINT) + (hdd_coeff*hdd) + (cdd_coeff*cdd)
 
     return(demand_timeseries)
-
@@ -0,0 +1,346 @@
+#
+#
+# Download manager for the monthly ERA5 files the energy models are run on,
+# e.g. to backfill 1979-2020:
+#
+#   python energy_model_functions_download.py 1979 2020 --output-dir /data/ERA5
+#
+# One client is shared by a bounded pool of concurrent requests. Failed
+# requests are retried with exponential backoff. Each finished file's
+# size, modification time and checksum are recorded in
+# output_dir/downloads.json, so months already on disk are skipped and an
+# interrupted backfill carries on where it stopped. Files are only
+# checksummed again if their size or modification time has changed, or
+# with --verify.
+#
+# With --split each month is also split into per-variable files once it is
+# downloaded (see energy_model_functions_era5_io.split_era5_file).
+#
+# The backend is pluggable: cdsapi_backend talks to the Climate Data Store,
+# http_backend to anything speaking the simple protocol of
+# fake_cds_server.py, which can be used to test downloads offline.
+#
+import argparse
+import calendar
+import concurrent.futures
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+
+from netCDF4 import Dataset
+
+import energy_model_functions_era5_io as era5_io
+import energy_model_functions_manifest as manifest
+
+
+ERA5_DATASET = 'reanalysis-era5-single-levels'
+ERA5_VARIABLES = ['100m_u_component_of_wind','100m_v_component_of_wind',
+                  '2m_temperature','surface_solar_radiation_downwards']
+ERA5_AREA = [90,-45,29.8,40.3] # N/W/S/E, same area as seasonal forecasts
+ERA5_GRID = '0.28/0.28'
+ERA5_FILENAME = 'ERA5_1hr_{year}_{month:02d}_DET.nc'
+DOWNLOAD_MANIFEST = 'downloads.json'
+
+_netcdf_lock = threading.Lock() # the netCDF library isn't thread safe
+
+
+def month_days(year,month):
+
+    """
+    Returns the days of a month as strings, e.g. ['01',...,'29'] for
+    February 2020.
+    """
+
+    n_days = calendar.monthrange(year,month)[1]
+    return([str(day).zfill(2) for day in range(1,n_days + 1)])
+
+
+def era5_month_request(year,month,variables=ERA5_VARIABLES,area=ERA5_AREA,
+                       grid=ERA5_GRID):
+
+    """
+    Returns the CDS request for one month of hourly ERA5 data.
+    """
+
+    request = {'variable': list(variables),
+               'product_type': 'reanalysis',
+               'year': [str(year)],
+               'month': [str(month).zfill(2)],
+               'day': month_days(year,month),
+               'time': [str(hour).zfill(2) + ':00' for hour in range(0,24)],
+               'area': list(area),
+               'grid': grid,
+               'format': 'netcdf'}
+    return(request)
+
+
+def cdsapi_backend(**client_args):
+
+    """
+    Returns a backend that retrieves from the Climate Data Store with one
+    cdsapi.Client, shared by every request. client_args are passed to
+    cdsapi.Client (e.g. url, key), by default it reads ~/.cdsapirc.
+    """
+
+    import cdsapi # only needed for this backend
+
+    client = cdsapi.Client(**client_args)
+
+    def retrieve(dataset,request,target):
+        client.retrieve(dataset,request,target)
+    return(retrieve)
+
+
+def http_backend(url,timeout=600):
+
+    """
+    Returns a backend that POSTs each request as JSON
+    ({'dataset': ..., 'request': ...}) to url + '/retrieve' and saves the
+    file that comes back, e.g. from fake_cds_server.py.
+    """
+
+    def retrieve(dataset,request,target):
+        body = json.dumps({'dataset': dataset,'request': request}).encode('utf-8')
+        http_request = urllib.request.Request(
+            url.rstrip('/') + '/retrieve',data=body,
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(http_request,timeout=timeout) as response:
+            with open(target,'wb') as f:
+                while True:
+                    block = response.read(1 << 20)
+                    if not block:
+                        break
+                    f.write(block)
+    return(retrieve)
+
+
+def valid_era5_file(file_str,n_hours=None):
+
+    """
+    Returns True if file_str is a readable netCDF file with n_hours
+    timesteps (any number if n_hours is None).
+    """
+
+    with _netcdf_lock:
+        try:
+            dataset = Dataset(file_str,mode='r')
+        except (OSError,RuntimeError):
+            return(False)
+        try:
+            if n_hours is None:
+                return(True)
+            if 'time' in dataset.dimensions:
+                len_time = len(dataset.dimensions['time'])
+            elif 'valid_time' in dataset.dimensions:
+                len_time = len(dataset.dimensions['valid_time'])
+            else:
+                return(False)
+            return(len_time == n_hours)
+        finally:
+            dataset.close()
+
+
+def download_with_retries(retrieve,dataset,request,target,n_hours=None,
+                          retries=5,backoff=30.):
+
+    """
+    This function retrieves one file, retrying with exponential backoff
+    (backoff, 2*backoff, 4*backoff... seconds, with some jitter) if the
+    request fails or the file isn't a valid netCDF file with n_hours
+    timesteps. The file is downloaded to target + '.part' and only moved
+    to target once it is complete.
+
+    Returns:
+
+        attempts (int): How many attempts it took.
+
+    """
+
+    part_file = target + '.part'
+    for attempt in range(0,retries + 1):
+        try:
+            retrieve(dataset,request,part_file)
+            if not valid_era5_file(part_file,n_hours):
+                raise IOError('Incomplete or unreadable download of ' + target)
+            os.replace(part_file,target)
+            return(attempt + 1)
+        except Exception as error:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            if attempt == retries:
+                raise
+            wait = backoff*2**attempt*random.uniform(0.8,1.2)
+            print('Retrying ' + os.path.basename(target) + ' in %.1f s (%s)'
+                  % (wait,error))
+            time.sleep(wait)
+
+
+def download_era5_months(months,output_dir,retrieve,max_concurrent=4,
+                         retries=5,backoff=30.,variables=ERA5_VARIABLES,
+                         filename=ERA5_FILENAME,split=False,split_dir=None,
+                         verify=False):
+
+    """
+    This function downloads monthly ERA5 files, max_concurrent at a time,
+    skipping the ones already downloaded. A month is skipped if its file
+    has the size and modification time (or failing that the checksum)
+    recorded in output_dir/downloads.json for the same request. A file that is on disk without a record (e.g. from an earlier
+    script) is kept, and recorded, if it is a readable netCDF file with a
+    whole month of hours.
+
+    Args:
+
+        months (list): (year, month) pairs e.g. [(1979,1),(1979,2)]
+
+        output_dir (str): Where to put the files.
+
+        retrieve (function): The backend, e.g. from cdsapi_backend or
+            http_backend.
+
+        max_concurrent (int): The maximum number of requests at once.
+
+        retries (int): How many times a failed month is retried.
+
+        backoff (float): The wait before the first retry (seconds), doubled
+            for each retry after that.
+
+        variables (list): The ERA5 variables to download.
+
+        filename (str): The file name pattern, with {year} and {month}.
+
+        split (bool): If True each month is also split into per-variable
+            files (see era5_io.split_era5_file), including months that
+            were already downloaded but not split.
+
+        split_dir (str): Where to put the split files, default
+            era5_io.ERA5_SPLIT_DIR.
+
+        verify (bool): If True the checksum of every file already
+            downloaded is checked, even if its size and modification time
+            are unchanged.
+
+    Returns:
+
+        downloaded (list): The files downloaded (not the ones skipped).
+
+    """
+
+    os.makedirs(output_dir,exist_ok=True)
+    manifest_file = os.path.join(output_dir,DOWNLOAD_MANIFEST)
+    downloads = manifest.load_manifest(manifest_file)
+
+    to_download = []
+    to_split = []
+    for year, month in months:
+        target = os.path.join(output_dir,filename.format(year=year,month=month))
+        request = era5_month_request(year,month,variables)
+        request_hash = manifest.config_hash([ERA5_DATASET,request])
+        n_hours = 24*len(request['day'])
+        record = downloads.get(os.path.basename(target))
+
+        if os.path.exists(target):
+            if record is not None and record['request_hash'] == request_hash:
+                if _same_download(record,target,verify):
+                    to_split.append(target)
+                    continue
+            elif record is None and valid_era5_file(target,n_hours):
+                downloads[os.path.basename(target)] = _download_record(
+                    target,request_hash)
+                to_split.append(target)
+                continue
+        to_download.append((target,request,request_hash,n_hours))
+    manifest.save_manifest(downloads,manifest_file)
+    print(str(len(to_download)) + ' of ' + str(len(months)) +
+          ' months to download')
+
+    downloaded = []
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        futures = dict((pool.submit(download_with_retries,retrieve,ERA5_DATASET,
+                                    request,target,n_hours,retries,backoff),
+                        (target,request_hash))
+                       for target, request, request_hash, n_hours in to_download)
+        for future in concurrent.futures.as_completed(futures):
+            target, request_hash = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                print('Failed to download ' + target + ': ' + str(error))
+                failed.append(target)
+                continue
+            # record each month as soon as it is done
+            downloads[os.path.basename(target)] = _download_record(
+                target,request_hash)
+            manifest.save_manifest(downloads,manifest_file)
+            downloaded.append(target)
+            print('Downloaded ' + target)
+            if split:
+                with _netcdf_lock:
+                    era5_io.split_era5_file(target,split_dir=split_dir)
+
+    if split:
+        # months downloaded before, split files that are up to date are kept
+        for target in to_split:
+            era5_io.split_era5_file(target,split_dir=split_dir)
+
+    if len(failed) > 0:
+        raise RuntimeError(str(len(failed)) + ' months failed to download: ' +
+                           ', '.join(failed))
+    return(downloaded)
+
+
+def _download_record(target,request_hash):
+    # {'size': ..., 'mtime_ns': ..., 'sha1': ..., 'request_hash': ...}
+    record = manifest.input_signature(target,checksum=True)
+    record['request_hash'] = request_hash
+    return(record)
+
+
+def _same_download(record,target,verify):
+    # an unchanged size and modification time is trusted unless verify is
+    # True, otherwise the file is checksummed and (if it matches) the
+    # record is brought up to date so it isn't checksummed next time
+    stat = os.stat(target)
+    if (not verify and record.get('size') == stat.st_size and
+            record.get('mtime_ns') == stat.st_mtime_ns):
+        return(True)
+    if manifest.file_checksum(target) != record['sha1']:
+        return(False)
+    record.update(manifest.input_signature(target))
+    return(True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Download monthly ERA5 files '
+                                     'for the energy models.')
+    parser.add_argument('start_year',type=int)
+    parser.add_argument('end_year',type=int)
+    parser.add_argument('--months',type=int,nargs='+',default=list(range(1,13)))
+    parser.add_argument('--output-dir',default='.')
+    parser.add_argument('--max-concurrent',type=int,default=4)
+    parser.add_argument('--retries',type=int,default=5)
+    parser.add_argument('--backoff',type=float,default=30.)
+    parser.add_argument('--url',default=None,
+                        help='use a server with the http_backend protocol, '
+                        'e.g. http://localhost:8765 for fake_cds_server.py')
+    parser.add_argument('--split',action='store_true',
+                        help='also split each month into per-variable files')
+    parser.add_argument('--split-dir',default=None)
+    parser.add_argument('--verify',action='store_true',
+                        help='checksum every file already downloaded, not '
+                        'just the ones whose size or time has changed')
+    args = parser.parse_args()
+
+    if args.url is None:
+        retrieve = cdsapi_backend()
+    else:
+        retrieve = http_backend(args.url)
+    months = [(year,month) for year in range(args.start_year,args.end_year + 1)
+              for month in args.months]
+    download_era5_months(months,args.output_dir,retrieve,args.max_concurrent,
+                         args.retries,args.backoff,split=args.split,
+                         split_dir=args.split_dir,verify=args.verify)
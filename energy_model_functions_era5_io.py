@@ -0,0 +1,820 @@
+import argparse
+import collections
+import json
+import os
+
+import numpy as np
+from netCDF4 import Dataset, default_fillvals
+
+import energy_model_functions_profiling as profiling
+
+
+# An ERA5 file can be converted once (convert_era5_to_cache) into a cache
+# directory holding each gridded variable as a raw .npy file (as stored in
+# the .nc file, e.g. packed int16) and a JSON sidecar with the coordinates,
+# scale factors and fill values. When a cache is present the loaders
+# memory-map it instead of decoding the .nc file, so only the hyperslab
+# asked for is read and unpacked.
+#
+# By default the cache of /data/ERA5_1979_01.nc is /data/ERA5_1979_01_cache,
+# set ENERGY_MODEL_ERA5_CACHE to keep all caches in another directory.
+ERA5_CACHE_DIR = os.environ.get('ENERGY_MODEL_ERA5_CACHE','')
+CACHE_SIDECAR = 'era5_cache.json'
+
+_cache_sidecars = {} # (sidecar path, mtime) -> sidecar contents
+
+# An ERA5 file can also be split once (split_era5_file), e.g. straight after
+# it is downloaded, into one NetCDF4 file per variable, e.g.
+# ERA5_1979_01_split/u100.nc, chunked along time and in small lat/lon tiles
+# and compressed. The loaders then open only the variables they need and
+# decompress only the chunks inside the window they read. A cache is still
+# preferred to the split files if there is one. The split files are kept in
+# a directory of their own so that patterns for the monthly files, such as
+# ERA5_1979_*.nc, don't pick them up.
+#
+# By default the split directory goes next to the original,
+# set ENERGY_MODEL_ERA5_SPLIT to keep them all in another directory.
+ERA5_SPLIT_DIR = os.environ.get('ENERGY_MODEL_ERA5_SPLIT','')
+SPLIT_TIME_CHUNK = 168 # a week of hourly data
+SPLIT_SPACE_CHUNK = 32 # gridpoints along lat and lon
+
+# Gridded variables are [time,lat,lon], or [member,time,lat,lon] for
+# ensembles such as the seasonal forecasts. The loaders read all members by
+# default, or the members in member_slice, and the models broadcast over
+# the leading member dimension.
+
+# How load_era5_variable_fast dealt with the missing values of a variable:
+# how many there were, the raw values that marked them and what they were
+# replaced with.
+MissingValues = collections.namedtuple('MissingValues',
+                                       ['nc_key','count','fill_values',
+                                        'replaced_with'])
+
+
+class _CachedVariable:
+
+    # Reads a variable from an ERA5 cache, decoding it as netCDF4 would
+    # (scale_factor, add_offset and fill values), so it can be used in
+    # place of a netCDF4 Variable.
+
+    def __init__(self,cache_dir,name,info):
+        self.name = name
+        self.info = info
+        if 'values' in info:
+            self.raw = np.asarray(info['values'],dtype=info['dtype'])
+        else:
+            self.raw = np.load(os.path.join(cache_dir,info['file']),mmap_mode='r')
+        self.shape = self.raw.shape
+        for attribute, value in info['attributes'].items():
+            setattr(self,attribute,value)
+
+    def __getitem__(self,key):
+        raw = self.raw[key]
+        info = self.info
+        if len(info['fill_values']) > 0:
+            missing = _fill_value_mask(raw,info['fill_values'])
+        else:
+            missing = None
+        # the same operations as netCDF4, so the values are identical
+        data = raw
+        if info['scale_factor'] is not None:
+            data = data*np.dtype(info['scale_dtype']).type(info['scale_factor'])
+        if info['add_offset'] is not None:
+            data = data + np.dtype(info['offset_dtype']).type(info['add_offset'])
+        if missing is not None and np.any(missing):
+            data = np.ma.masked_array(data,mask=missing)
+        return(data)
+
+
+class _CachedDataset:
+
+    # The variables of an ERA5 cache, in place of a netCDF4 Dataset.
+
+    def __init__(self,cache_dir,sidecar):
+        self.variables = dict((name,_CachedVariable(cache_dir,name,info))
+                              for name, info in sidecar['variables'].items())
+
+    def close(self):
+        pass
+
+
+class _SplitDataset:
+
+    # The per-variable files of a split ERA5 file, in place of a netCDF4
+    # Dataset. The coordinates come from the files too.
+
+    def __init__(self,datasets):
+        self.datasets = datasets
+        self.variables = {}
+        for dataset in datasets:
+            self.variables.update(dataset.variables)
+
+    def close(self):
+        for dataset in self.datasets:
+            dataset.close()
+
+
+def era5_cache_dir(file_str,cache_dir=None):
+
+    """
+    Returns the cache directory for an ERA5 file, see ERA5_CACHE_DIR.
+    """
+
+    if cache_dir is None:
+        cache_dir = ERA5_CACHE_DIR
+    stem = os.path.splitext(os.path.basename(file_str))[0]
+    if cache_dir:
+        return(os.path.join(cache_dir,stem + '_cache'))
+    return(os.path.splitext(file_str)[0] + '_cache')
+
+
+def _fill_value_mask(raw,fill_values):
+    # where the raw (packed) values are one of the fill values. np.isin
+    # never matches NaN, so a NaN fill value (as in float32 split files)
+    # is checked for separately
+    fill_values = np.asarray(fill_values,dtype=np.float64)
+    nan_fill = np.isnan(fill_values)
+    missing = np.isin(raw,fill_values[~nan_fill])
+    if np.any(nan_fill) and raw.dtype.kind == 'f':
+        missing |= np.isnan(raw)
+    return(missing)
+
+
+def _variable_info(variable):
+    info = {'dtype': variable.dtype.str,'attributes': {},
+            'scale_factor': None,'add_offset': None,
+            'scale_dtype': None,'offset_dtype': None}
+    attributes = variable.ncattrs()
+    for attribute in ['units','calendar','long_name']:
+        if attribute in attributes:
+            info['attributes'][attribute] = str(variable.getncattr(attribute))
+    for attribute in ['scale_factor','add_offset']:
+        if attribute in attributes:
+            value = np.asarray(variable.getncattr(attribute))
+            info[attribute] = value.item()
+            info[attribute.split('_')[0] + '_dtype'] = value.dtype.str
+
+    if '_FillValue' in attributes:
+        fill_values = [variable.getncattr('_FillValue')]
+    elif variable.dtype.kind in 'iuf':
+        fill_values = [default_fillvals[variable.dtype.str[1:]]]
+    else:
+        fill_values = []
+    if 'missing_value' in attributes:
+        fill_values += list(np.atleast_1d(variable.getncattr('missing_value')))
+    info['fill_values'] = [np.asarray(value).item() for value in fill_values]
+    return(info)
+
+
+@profiling.profiled
+def convert_era5_to_cache(file_str,nc_keys=None,cache_dir=None,chunk_size=168):
+
+    """
+    This function converts an ERA5 file, once, into a memory-mappable cache
+    (see ERA5_CACHE_DIR). After this the loaders read the cache instead of
+    the .nc file. The cache records the size and modification time of the
+    .nc file and is ignored if the file changes.
+
+    Args:
+
+        file_str (str): The full path of a .netcdf file
+            e.g. '/home/users/zd907959/ERA5_1979_01.nc'
+
+        nc_keys (list): The gridded variables to cache, e.g.
+            ['u100','v100'], default all of them.
+
+        cache_dir (str): Where to keep the cache, default ERA5_CACHE_DIR.
+
+        chunk_size (int): The number of timesteps copied at once.
+
+    Returns:
+
+        cache_path (str): The cache directory.
+
+    """
+
+    cache_path = era5_cache_dir(file_str,cache_dir)
+    os.makedirs(cache_path,exist_ok=True)
+    stat = os.stat(file_str)
+    sidecar = {'source': os.path.basename(file_str),'size': stat.st_size,
+               'mtime_ns': stat.st_mtime_ns,'variables': {}}
+
+    dataset = Dataset(file_str,mode='r')
+    for name, variable in dataset.variables.items():
+        variable.set_auto_maskandscale(False)
+        info = _variable_info(variable)
+        if variable.ndim <= 1:
+            # coordinates go in the sidecar itself
+            info['values'] = np.asarray(variable[:]).tolist()
+        elif nc_keys is None or name in nc_keys:
+            info['file'] = name + '.npy'
+            tmp_file = os.path.join(cache_path,name + '.tmp.npy')
+            raw = np.lib.format.open_memmap(tmp_file,mode='w+',
+                                            dtype=variable.dtype,
+                                            shape=variable.shape)
+            for start in range(0,variable.shape[0],chunk_size):
+                raw[start:start+chunk_size] = variable[start:start+chunk_size]
+            raw.flush()
+            del raw
+            os.replace(tmp_file,os.path.join(cache_path,info['file']))
+        else:
+            continue
+        sidecar['variables'][name] = info
+    dataset.close()
+
+    # the sidecar goes last, so a half-written cache is never used
+    sidecar_file = os.path.join(cache_path,CACHE_SIDECAR)
+    with open(sidecar_file + '.tmp','w') as f:
+        json.dump(sidecar,f)
+    os.replace(sidecar_file + '.tmp',sidecar_file)
+
+    return(cache_path)
+
+
+def load_era5_cache(file_str,cache_dir=None):
+
+    """
+    Returns the sidecar of the cache of an ERA5 file, or None if there is no
+    cache or the .nc file has changed since it was made.
+    """
+
+    sidecar_file = os.path.join(era5_cache_dir(file_str,cache_dir),CACHE_SIDECAR)
+    if not os.path.exists(sidecar_file):
+        return(None)
+    key = (sidecar_file,os.stat(sidecar_file).st_mtime_ns)
+    if key not in _cache_sidecars:
+        with open(sidecar_file) as f:
+            _cache_sidecars[key] = json.load(f)
+    sidecar = _cache_sidecars[key]
+
+    if os.path.exists(file_str):
+        stat = os.stat(file_str)
+        if (stat.st_size,stat.st_mtime_ns) != (sidecar['size'],sidecar['mtime_ns']):
+            return(None)
+    return(sidecar)
+
+
+def era5_split_file(file_str,nc_key,split_dir=None):
+
+    """
+    Returns the filename of one variable of a split ERA5 file, see
+    ERA5_SPLIT_DIR, e.g. /data/ERA5_1979_01_split/u100.nc
+    """
+
+    return(os.path.join(era5_split_dir(file_str,split_dir),nc_key + '.nc'))
+
+
+def era5_split_dir(file_str,split_dir=None):
+
+    """
+    Returns the directory of the split files of an ERA5 file, see
+    ERA5_SPLIT_DIR, e.g. /data/ERA5_1979_01_split
+    """
+
+    if split_dir is None:
+        split_dir = ERA5_SPLIT_DIR
+    stem = os.path.splitext(os.path.basename(file_str))[0]
+    if not split_dir:
+        split_dir = os.path.dirname(file_str)
+    return(os.path.join(split_dir,stem + '_split'))
+
+
+def _split_is_current(dataset,file_str):
+    # a split file made from an older version of the .nc file is ignored,
+    # if the .nc file has gone (e.g. deleted after splitting) it is used
+    if not os.path.exists(file_str):
+        return(True)
+    stat = os.stat(file_str)
+    return(int(dataset.getncattr('source_size')) == stat.st_size and
+           int(dataset.getncattr('source_mtime_ns')) == stat.st_mtime_ns)
+
+
+def split_variables(file_str,split_dir=None):
+
+    """
+    Returns the variables of an ERA5 file that have split files.
+    """
+
+    split_path = era5_split_dir(file_str,split_dir)
+    if not os.path.isdir(split_path):
+        return([])
+    return(sorted(name[:-3] for name in os.listdir(split_path)
+                  if name.endswith('.nc')))
+
+
+def open_era5_split(file_str,nc_keys,split_dir=None):
+
+    """
+    Opens the split files of the variables nc_keys of an ERA5 file (see
+    split_era5_file), or returns None unless they are all there and up to
+    date.
+    """
+
+    datasets = []
+    for nc_key in nc_keys:
+        split_filename = era5_split_file(file_str,nc_key,split_dir)
+        if not os.path.exists(split_filename):
+            break
+        dataset = Dataset(split_filename,mode='r')
+        datasets.append(dataset)
+        if not _split_is_current(dataset,file_str):
+            break
+    else:
+        if len(datasets) > 0:
+            return(_SplitDataset(datasets))
+    for dataset in datasets:
+        dataset.close()
+    return(None)
+
+
+@profiling.profiled
+def open_era5_dataset(file_str,nc_keys=(),cache_dir=None,split_dir=None):
+
+    """
+    Opens an ERA5 file for reading: its cache (see convert_era5_to_cache)
+    if it has one with all of nc_keys in it, otherwise its split files (see
+    split_era5_file) if it has them for all of nc_keys, otherwise the .nc
+    file. The result has the same .variables and .close() as a netCDF4
+    Dataset and returns the same values.
+    """
+
+    sidecar = load_era5_cache(file_str,cache_dir)
+    if sidecar is not None and all(nc_key in sidecar['variables']
+                                   for nc_key in nc_keys):
+        return(_CachedDataset(era5_cache_dir(file_str,cache_dir),sidecar))
+
+    if len(nc_keys) == 0 and not os.path.exists(file_str):
+        # only the coordinates are wanted, any one of the split files has them
+        nc_keys = split_variables(file_str,split_dir)[:1]
+    split_dataset = open_era5_split(file_str,nc_keys,split_dir)
+    if split_dataset is not None:
+        return(split_dataset)
+    return(Dataset(file_str,mode='r'))
+
+
+def _copy_attributes(source,target,skip=('_FillValue','scale_factor',
+                                         'add_offset')):
+    for attribute in source.ncattrs():
+        if attribute not in skip:
+            target.setncattr(attribute,source.getncattr(attribute))
+
+
+def _int16_packing(variable,chunk_size):
+    # scale_factor and add_offset spanning the range of a float variable,
+    # keeping -32767 for missing values
+    lowest, highest = np.inf, -np.inf
+    for start in range(0,variable.shape[-3],chunk_size):
+        index = era5_index(variable.ndim,slice(start,start+chunk_size))
+        chunk = np.ma.compressed(variable[index])
+        if len(chunk) > 0:
+            lowest = min(lowest,float(chunk.min()))
+            highest = max(highest,float(chunk.max()))
+    if lowest > highest:
+        lowest, highest = 0., 0.
+    scale_factor = (highest - lowest)/(2*32766) or 1.
+    add_offset = (highest + lowest)/2
+    return(scale_factor,add_offset)
+
+
+@profiling.profiled
+def split_era5_file(file_str,nc_keys=None,split_dir=None,dtype='int16',
+                    time_chunk=SPLIT_TIME_CHUNK,space_chunk=SPLIT_SPACE_CHUNK,
+                    complevel=4,overwrite=False):
+
+    """
+    This function rewrites an ERA5 file, once, as one compressed NetCDF4
+    file per gridded variable (see ERA5_SPLIT_DIR). After this the loaders
+    read the split files instead of the .nc file. The split files record
+    the size and modification time of the .nc file and are ignored if the
+    file changes.
+
+    Args:
+
+        file_str (str): The full path of a .netcdf file
+            e.g. '/home/users/zd907959/ERA5_1979_01.nc'
+
+        nc_keys (list): The gridded variables to split out, e.g.
+            ['u100','v100'], default all of them.
+
+        split_dir (str): Where to put the split files, default
+            ERA5_SPLIT_DIR.
+
+        dtype (str): 'int16' to store packed values with scale_factor and
+            add_offset (variables that are already packed are copied
+            unchanged, so they read back identically), or 'float32'.
+
+        time_chunk (int): The chunk length along time.
+
+        space_chunk (int): The chunk size along lat and lon.
+
+        complevel (int): The zlib compression level (1-9).
+
+        overwrite (bool): If False, split files that are already there and
+            up to date are kept.
+
+    Returns:
+
+        split_files (list): The filenames of the split files.
+
+    """
+
+    if dtype not in ['int16','float32']:
+        raise ValueError("dtype must be 'int16' or 'float32', not " + str(dtype))
+    stat = os.stat(file_str)
+    source = Dataset(file_str,mode='r')
+    if nc_keys is None:
+        nc_keys = [name for name, variable in source.variables.items()
+                   if variable.ndim >= 3]
+
+    split_files = []
+    for nc_key in nc_keys:
+        split_filename = era5_split_file(file_str,nc_key,split_dir)
+        split_files.append(split_filename)
+        if not overwrite:
+            split_dataset = open_era5_split(file_str,[nc_key],split_dir)
+            if split_dataset is not None:
+                split_dataset.close()
+                continue
+        os.makedirs(os.path.dirname(split_filename),exist_ok=True)
+
+        variable = source.variables[nc_key]
+        info = _variable_info(variable)
+        tmp_file = split_filename + '.tmp'
+        target = Dataset(tmp_file,mode='w',format='NETCDF4')
+        target.source = os.path.basename(file_str)
+        target.source_size = str(stat.st_size)
+        target.source_mtime_ns = str(stat.st_mtime_ns)
+
+        # the coordinates of the variable's dimensions
+        for dimension in variable.dimensions:
+            length = len(source.dimensions[dimension])
+            target.createDimension(dimension,length)
+            if dimension in source.variables:
+                coordinate = source.variables[dimension]
+                copy = target.createVariable(dimension,coordinate.dtype,
+                                             coordinate.dimensions)
+                _copy_attributes(coordinate,copy)
+                copy[:] = coordinate[:]
+
+        chunk_lengths = {variable.ndim - 3: time_chunk,
+                         variable.ndim - 2: space_chunk,
+                         variable.ndim - 1: space_chunk}
+        chunksizes = [max(1,min(chunk_lengths.get(axis,1),length))
+                      for axis, length in enumerate(variable.shape)]
+
+        packed = info['scale_factor'] is not None and variable.dtype == np.int16
+        if dtype == 'int16' and packed:
+            fill_value = info['fill_values'][0] if len(info['fill_values']) > 0 else None
+            scale_factor, add_offset = info['scale_factor'], info['add_offset']
+            out_dtype = 'i2'
+        elif dtype == 'int16':
+            fill_value = -32767
+            scale_factor, add_offset = _int16_packing(variable,time_chunk)
+            out_dtype = 'i2'
+        else:
+            fill_value = np.float32(np.nan)
+            scale_factor, add_offset = None, None
+            out_dtype = 'f4'
+
+        split_variable = target.createVariable(nc_key,out_dtype,
+                                               variable.dimensions,zlib=True,
+                                               complevel=complevel,shuffle=True,
+                                               chunksizes=chunksizes,
+                                               fill_value=fill_value)
+        _copy_attributes(variable,split_variable)
+        if scale_factor is not None:
+            split_variable.scale_factor = scale_factor
+            split_variable.add_offset = add_offset if add_offset is not None else 0.
+
+        if dtype == 'int16' and packed:
+            # copy the packed values as they are
+            variable.set_auto_maskandscale(False)
+            split_variable.set_auto_maskandscale(False)
+        for start in range(0,variable.shape[-3],time_chunk):
+            index = era5_index(variable.ndim,slice(start,start+time_chunk))
+            split_variable[index] = variable[index]
+        variable.set_auto_maskandscale(True)
+        target.close()
+        os.replace(tmp_file,split_filename)
+    source.close()
+
+    return(split_files)
+
+
+def era5_index(ndim,time_slice=slice(None),lat_slice=slice(None),
+               lon_slice=slice(None),member_slice=slice(None)):
+
+    """
+    Returns the index of a hyperslab of a variable with ndim dimensions,
+    [time,lat,lon] or [member,time,lat,lon]. member_slice is only used for
+    the latter.
+    """
+
+    index = (time_slice,lat_slice,lon_slice)
+    if ndim == 4:
+        index = (member_slice,) + index
+    return(index)
+
+
+def era5_member_count(file_str,nc_key):
+
+    """
+    Returns the number of ensemble members of a variable, or None if it has
+    no member dimension.
+    """
+
+    dataset = open_era5_dataset(file_str,[nc_key])
+    shape = dataset.variables[nc_key].shape
+    dataset.close()
+    if len(shape) == 4:
+        return(shape[0])
+    return(None)
+
+
+def member_slices(n_members,members_per_chunk=1):
+
+    """
+    Returns slices that split n_members ensemble members into chunks of
+    members_per_chunk, to stream them through the models a chunk at a time.
+    """
+
+    return([slice(start,min(start+members_per_chunk,n_members))
+            for start in range(0,n_members,members_per_chunk)])
+
+
+@profiling.profiled
+def convert_era5_units(data,nc_key,out=None):
+
+    """
+    Puts ERA5 data in the units used by the energy models: t2m from Kelvin
+    to Celsius and ssrd from Jh-1m-2 to Wm-2. Other variables are returned
+    unchanged. If out is given (e.g. out=data) the result is written into
+    it rather than a new array.
+    """
+
+    if nc_key == 't2m':
+        data = np.subtract(data,273.15,out=out) # convert to Celsius from Kelvin
+    if nc_key == 'ssrd':
+        data = np.divide(data,3600.,out=out) # convert Jh-1m-2 to Wm-2
+
+    return(data)
+
+
+@profiling.profiled
+def load_era5_grid(file_str):
+
+    """
+    This function returns the longitudes and latitudes of an ERA5 file
+    without reading any of the weather data.
+
+    Args:
+
+        file_str (str): The full path of a .netcdf file
+            e.g. '/home/users/zd907959/ERA5_1979_01.nc'
+
+    Returns:
+
+        lons (array): Dimensions [lon].
+
+        lats (array): Dimensions [lat].
+
+    """
+
+    dataset = open_era5_dataset(file_str)
+    lons = dataset.variables['longitude'][:]
+    lats = dataset.variables['latitude'][:]
+    dataset.close()
+
+    return(lons,lats)
+
+
+@profiling.profiled
+def load_era5_variable(file_str,nc_key,lat_slice=slice(None),
+                       lon_slice=slice(None),time_slice=slice(None),fast=False,
+                       member_slice=slice(None),missing_values=None):
+
+    """
+    This function loads one variable from an ERA5 file and puts it in the
+    units used by the energy models (see convert_era5_units). If a lat/lon
+    window is given only that hyperslab is read from the file.
+
+    Args:
+
+        file_str (str): The full path of a .netcdf file
+            e.g. '/home/users/zd907959/ERA5_1979_01.nc'
+
+        nc_key (str): The string you need to load the .nc data
+            e.g. 't2m','ssrd'
+
+        lat_slice (slice): The latitude indices to read, default all.
+
+        lon_slice (slice): The longitude indices to read, default all.
+
+        time_slice (slice): The time indices to read, default all.
+
+        fast (bool): If True use load_era5_variable_fast, giving a plain
+            float32 array with missing values set to NaN.
+
+        member_slice (slice): For ensembles, the members to read, default
+            all.
+
+        missing_values (list): If given (and fast is True), the
+            MissingValues record of how the missing values were dealt with
+            is appended to it. Otherwise missing values are masked.
+
+    Returns:
+
+        lons (array): Dimensions [lon].
+
+        lats (array): Dimensions [lat].
+
+        data (array): The weather data, dimensions [time,lat,lon] or
+            [member,time,lat,lon].
+
+    """
+
+    if fast:
+        lons, lats, data, variable_missing = load_era5_variable_fast(
+            file_str,nc_key,lat_slice,lon_slice,time_slice,
+            member_slice=member_slice)
+        if missing_values is not None:
+            missing_values.append(variable_missing)
+        return(lons,lats,data)
+
+    dataset = open_era5_dataset(file_str,[nc_key])
+    lons = dataset.variables['longitude'][lon_slice]
+    lats = dataset.variables['latitude'][lat_slice]
+    # data in shape [time,lat,lon] or [member,time,lat,lon]
+    variable = dataset.variables[nc_key]
+    data = variable[era5_index(len(variable.shape),time_slice,lat_slice,
+                               lon_slice,member_slice)]
+    dataset.close()
+
+    data = convert_era5_units(data,nc_key)
+
+    return(lons,lats,data)
+
+
+@profiling.profiled
+def load_era5_variable_fast(file_str,nc_key,lat_slice=slice(None),
+                            lon_slice=slice(None),time_slice=slice(None),
+                            dtype=np.float32,missing_value=np.nan,
+                            chunk_size=168,member_slice=slice(None)):
+
+    """
+    This function does the same as load_era5_variable without netCDF4's
+    masked arrays. The packed values are read a chunk of timesteps at a
+    time and unpacked, converted to the model units and have their missing
+    values replaced, all in place in a preallocated plain array of dtype.
+    With dtype=np.float32 the values can differ from load_era5_variable in
+    the last bit of precision.
+
+    Args:
+
+        file_str (str): The full path of a .netcdf file
+            e.g. '/home/users/zd907959/ERA5_1979_01.nc'
+
+        nc_key (str): The string you need to load the .nc data
+            e.g. 't2m','ssrd'
+
+        lat_slice (slice): The latitude indices to read, default all.
+
+        lon_slice (slice): The longitude indices to read, default all.
+
+        time_slice (slice): The time indices to read, default all.
+
+        dtype (numpy dtype): The precision of the returned data.
+
+        missing_value (float): What missing values are set to.
+
+        chunk_size (int): The number of timesteps unpacked at once.
+
+        member_slice (slice): For ensembles, the members to read, default
+            all.
+
+    Returns:
+
+        lons (array): Dimensions [lon].
+
+        lats (array): Dimensions [lat].
+
+        data (array): The weather data, dimensions [time,lat,lon] or
+            [member,time,lat,lon].
+
+        missing_values (MissingValues): How many values were missing and
+            what they were replaced with. This is also printed if there
+            were any.
+
+    """
+
+    dataset = open_era5_dataset(file_str,[nc_key])
+    lons = np.ma.getdata(dataset.variables['longitude'][lon_slice])
+    lats = np.ma.getdata(dataset.variables['latitude'][lat_slice])
+    variable = dataset.variables[nc_key]
+    if isinstance(variable,_CachedVariable):
+        raw_variable, info = variable.raw, variable.info
+    else:
+        variable.set_auto_maskandscale(False)
+        raw_variable, info = variable, _variable_info(variable)
+
+    ndim = len(variable.shape)
+    len_time, len_lat, len_lon = variable.shape[-3:]
+    time_indices = range(*time_slice.indices(len_time))
+    data_shape = (len(time_indices),len(range(*lat_slice.indices(len_lat))),
+                  len(range(*lon_slice.indices(len_lon))))
+    if ndim == 4:
+        members = range(*member_slice.indices(variable.shape[0]))
+        data = np.empty((len(members),) + data_shape,dtype=dtype)
+        member_data = data
+    else:
+        members = [None]
+        data = np.empty(data_shape,dtype=dtype)
+        member_data = data[np.newaxis]
+
+    n_missing = 0
+    for i, member in enumerate(members):
+        for start in range(0,len(time_indices),chunk_size):
+            times = time_indices[start:start+chunk_size]
+            raw = np.asarray(raw_variable[era5_index(
+                ndim,slice(times.start,times.stop,times.step),lat_slice,
+                lon_slice,member)])
+            chunk = member_data[i,start:start+len(times)]
+            if info['scale_factor'] is not None:
+                np.multiply(raw,info['scale_factor'],out=chunk,casting='unsafe')
+            else:
+                chunk[...] = raw
+            if info['add_offset'] is not None:
+                chunk += info['add_offset']
+            convert_era5_units(chunk,nc_key,out=chunk)
+            if len(info['fill_values']) > 0:
+                missing = _fill_value_mask(raw,info['fill_values'])
+                n_missing += np.count_nonzero(missing)
+                chunk[missing] = missing_value
+    dataset.close()
+
+    missing_values = MissingValues(nc_key,int(n_missing),info['fill_values'],
+                                   missing_value)
+    if n_missing > 0:
+        print(nc_key + ': ' + str(n_missing) + ' missing values set to ' +
+              str(missing_value))
+
+    return(lons,lats,data,missing_values)
+
+
+@profiling.profiled
+def load_era5_times(file_str):
+
+    """
+    This function returns the time coordinate of an ERA5 file without
+    reading any of the weather data.
+
+    Args:
+
+        file_str (str): The full path of a .netcdf file
+            e.g. '/home/users/zd907959/ERA5_1979_01.nc'
+
+    Returns:
+
+        times (array): Dimensions [time], as numbers in time_units.
+
+        time_units (str): e.g. 'hours since 1900-01-01 00:00:00.0'
+
+        calendar (str): e.g. 'gregorian'
+
+    """
+
+    dataset = open_era5_dataset(file_str)
+    # files from the newer CDS call it valid_time
+    if 'time' in dataset.variables:
+        time_variable = dataset.variables['time']
+    else:
+        time_variable = dataset.variables['valid_time']
+    times = np.ma.getdata(time_variable[:])
+    time_units = time_variable.units
+    calendar = getattr(time_variable,'calendar','standard')
+    dataset.close()
+
+    return(times,time_units,calendar)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert ERA5 files to '
+                                     'memory-mapped caches, or split them '
+                                     'into per-variable files.')
+    parser.add_argument('files',nargs='+')
+    parser.add_argument('--variables',nargs='+',default=None)
+    parser.add_argument('--cache-dir',default=None)
+    parser.add_argument('--split',action='store_true',
+                        help='write per-variable files instead of a cache')
+    parser.add_argument('--split-dir',default=None)
+    parser.add_argument('--dtype',choices=['int16','float32'],default='int16')
+    args = parser.parse_args()
+
+    for file_str in args.files:
+        if args.split:
+            for split_filename in split_era5_file(file_str,args.variables,
+                                                  args.split_dir,args.dtype):
+                print(split_filename)
+        else:
+            print(convert_era5_to_cache(file_str,args.variables,args.cache_dir))
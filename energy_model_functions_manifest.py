@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+
+
+# The manifest records which (input file, model, country, configuration)
+# combinations have already been run and where their output went, so that
+# an interrupted or repeated run only does the work that is new.
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def load_manifest(manifest_file):
+
+    """
+    Loads a run manifest, or returns an empty one if it doesn't exist yet.
+
+    Args:
+
+        manifest_file (str): The filename of the manifest .json file.
+
+    Returns:
+
+        manifest (dict): entry key -> record, see record_complete.
+
+    """
+
+    if not os.path.exists(manifest_file):
+        return({})
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    return(manifest)
+
+
+def save_manifest(manifest,manifest_file):
+
+    """
+    Writes a run manifest. It is written to a temporary file first so a run
+    killed part way through can't leave a corrupt manifest behind.
+    """
+
+    manifest_dir = os.path.dirname(manifest_file)
+    if manifest_dir:
+        os.makedirs(manifest_dir,exist_ok=True)
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file,'w') as f:
+        json.dump(manifest,f,indent=1,sort_keys=True)
+    os.replace(tmp_file,manifest_file)
+
+
+_checksums = {} # (path, size, mtime_ns) -> sha1, so files are hashed once
+
+
+def file_checksum(file_str):
+
+    """
+    Returns the sha1 checksum of a file's contents. Each version of a file
+    is only read once per run.
+    """
+
+    stat = os.stat(file_str)
+    key = (os.path.abspath(file_str),stat.st_size,stat.st_mtime_ns)
+    if key not in _checksums:
+        file_hash = hashlib.sha1()
+        with open(file_str,'rb') as f:
+            for block in iter(lambda: f.read(1 << 20),b''):
+                file_hash.update(block)
+        _checksums[key] = file_hash.hexdigest()
+    return(_checksums[key])
+
+
+def input_signature(file_str,checksum=False):
+
+    """
+    This function describes the current state of an input file so changes to
+    it can be spotted: its size and modification time and, if checksum is
+    True, the sha1 of its contents.
+
+    Args:
+
+        file_str (str): The full path of the input file.
+
+        checksum (bool): Whether to also checksum the contents. This is
+            slower but means files that are re-downloaded unchanged (new
+            modification time, same contents) are still skipped.
+
+    Returns:
+
+        signature (dict): {'size': ..., 'mtime_ns': ..., ['sha1': ...]}
+
+    """
+
+    stat = os.stat(file_str)
+    signature = {'size': stat.st_size,'mtime_ns': stat.st_mtime_ns}
+    if checksum:
+        signature['sha1'] = file_checksum(file_str)
+    return(signature)
+
+
+def config_hash(settings):
+
+    """
+    Returns a hash of the settings of a run (anything that can be written as
+    JSON), so that outputs made with different settings are not mixed up.
+    """
+
+    settings_json = json.dumps(settings,sort_keys=True,default=str)
+    return(hashlib.sha1(settings_json.encode('utf-8')).hexdigest())
+
+
+def manifest_key(file_str,model,COUNTRY):
+    return('|'.join([os.path.abspath(file_str),model,COUNTRY]))
+
+
+def _same_input(recorded,file_str):
+    stat = os.stat(file_str)
+    if recorded['size'] != stat.st_size:
+        return(False)
+    if recorded['mtime_ns'] == stat.st_mtime_ns:
+        return(True)
+    # touched but maybe not changed, only trust a matching checksum
+    return('sha1' in recorded and recorded['sha1'] == file_checksum(file_str))
+
+
+def is_complete(manifest,file_str,model,COUNTRY,settings_hash):
+
+    """
+    This function checks whether a (file, model, country) has already been
+    run on the same input file with the same settings, and its output is
+    still there.
+
+    Args:
+
+        manifest (dict): from load_manifest.
+
+        file_str (str): The full path of the input file.
+
+        model (str): e.g. 'wind'
+
+        COUNTRY (str): e.g. 'France'
+
+        settings_hash (str): from config_hash.
+
+    Returns:
+
+        complete (bool): True if the work can be skipped.
+
+    """
+
+    record = manifest.get(manifest_key(file_str,model,COUNTRY))
+    if record is None:
+        return(False)
+    if record['config_hash'] != settings_hash:
+        return(False)
+    if not os.path.exists(file_str) or not _same_input(record['input'],file_str):
+        return(False)
+    if record['output'] is not None and not os.path.exists(record['output']):
+        return(False)
+    return(True)
+
+
+def record_complete(manifest,file_str,model,COUNTRY,settings_hash,output_file,
+                    checksum=False):
+
+    """
+    Records that a (file, model, country) has been run. output_file is where
+    its result was written, or None if there was nothing to write (e.g. no
+    installed capacity data for that country). If checksum is True the
+    input file's sha1 is stored too (see input_signature).
+    """
+
+    manifest[manifest_key(file_str,model,COUNTRY)] = {
+        'input': input_signature(file_str,checksum),
+        'config_hash': settings_hash,
+        'output': output_file,
+    }
@@ -0,0 +1,212 @@
+import os
+
+import numpy as np
+from netCDF4 import Dataset, date2num, num2date
+
+
+# The national time series (wind and solar capacity factors, HDD, CDD and
+# demand) are kept in one NetCDF4 file per quantity, e.g. store/wind_cf.nc,
+# with an unlimited time dimension and one variable per country. Each
+# variable is chunked along time and compressed, so a single country can be
+# read back for the whole record without touching the others, and new
+# months are appended without rewriting the file.
+STORE_TIME_UNITS = 'hours since 1900-01-01 00:00:00'
+STORE_CALENDAR = 'standard'
+CHUNK_LENGTH = 8784 # one (leap) year of hourly data
+
+QUANTITY_ATTRIBUTES = {
+    'wind_cf': {'units': '1','long_name': 'wind power capacity factor'},
+    'solar_cf': {'units': '1','long_name': 'solar PV capacity factor'},
+    'hdd': {'units': 'degree days','long_name': 'heating degree days'},
+    'cdd': {'units': 'degree days','long_name': 'cooling degree days'},
+    'demand': {'units': 'GW','long_name': 'weather-dependent demand'},
+    'demand_full': {'units': 'GW',
+                    'long_name': 'demand including day-of-week effects'},
+}
+
+
+def store_file(store_dir,quantity):
+
+    """
+    Returns the filename of the store for quantity, e.g.
+    store_dir/wind_cf.nc
+    """
+
+    return(os.path.join(store_dir,quantity + '.nc'))
+
+
+def country_variable_name(COUNTRY):
+    return(COUNTRY.replace(' ','_'))
+
+
+def _create_store(store_filename,quantity):
+    store_dir = os.path.dirname(store_filename)
+    if store_dir:
+        os.makedirs(store_dir,exist_ok=True)
+    dataset = Dataset(store_filename,mode='w',format='NETCDF4')
+    dataset.createDimension('time',None)
+    time_variable = dataset.createVariable('time','f8',('time',),
+                                           chunksizes=(CHUNK_LENGTH,))
+    time_variable.units = STORE_TIME_UNITS
+    time_variable.calendar = STORE_CALENDAR
+    dataset.quantity = quantity
+    return(dataset)
+
+
+def _country_variable(dataset,quantity,COUNTRY):
+    name = country_variable_name(COUNTRY)
+    if name not in dataset.variables:
+        # fill with NaN so earlier months read back as missing
+        variable = dataset.createVariable(name,'f8',('time',),zlib=True,
+                                          complevel=4,shuffle=True,
+                                          chunksizes=(CHUNK_LENGTH,),
+                                          fill_value=np.nan)
+        variable.country = COUNTRY
+        for attribute, value in QUANTITY_ATTRIBUTES.get(quantity,{}).items():
+            variable.setncattr(attribute,value)
+    return(dataset.variables[name])
+
+
+def append_time_series(store_filename,quantity,times,time_units,
+                       country_series,calendar='standard'):
+
+    """
+    This function adds one block of national time series (e.g. one month)
+    to a store, creating it if needed. Blocks are normally appended at the
+    end; if the block's times are already in the store (e.g. a month that
+    has been rerun) those values are overwritten instead. Blocks don't have
+    to be added in time order, read_time_series sorts them.
+
+    Args:
+
+        store_filename (str): From store_file, e.g. 'store/wind_cf.nc'
+
+        quantity (str): e.g. 'wind_cf', 'solar_cf', 'hdd', 'cdd', 'demand'
+
+        times (array): Dimensions [time], as numbers in time_units.
+
+        time_units (str): e.g. 'hours since 1900-01-01 00:00:00.0'
+
+        country_series (dict): {COUNTRY: time series, dimensions [time]}.
+
+        calendar (str): The calendar of times.
+
+    """
+
+    if len(times) == 0:
+        # nothing to append, e.g. a file with no timesteps
+        return
+
+    dates = num2date(times,time_units,calendar)
+    store_times = date2num(dates,STORE_TIME_UNITS,STORE_CALENDAR)
+
+    if os.path.exists(store_filename):
+        dataset = Dataset(store_filename,mode='a')
+    else:
+        dataset = _create_store(store_filename,quantity)
+
+    existing_times = dataset.variables['time'][:]
+    overlap = np.isin(store_times,existing_times)
+    if np.all(overlap):
+        order = np.argsort(existing_times)
+        positions = order[np.searchsorted(existing_times,store_times,
+                                          sorter=order)]
+    elif not np.any(overlap):
+        positions = len(existing_times) + np.arange(len(store_times))
+        dataset.variables['time'][positions[0]:] = store_times
+    else:
+        dataset.close()
+        raise ValueError('Some but not all of these times are already in ' +
+                         store_filename)
+
+    for COUNTRY in country_series:
+        series = np.asarray(country_series[COUNTRY])
+        if len(series) != len(store_times):
+            dataset.close()
+            raise ValueError('The time series for ' + COUNTRY + ' has ' +
+                             str(len(series)) + ' values but there are ' +
+                             str(len(store_times)) + ' times.')
+        variable = _country_variable(dataset,quantity,COUNTRY)
+        if np.all(np.diff(positions) == 1):
+            variable[positions[0]:positions[-1] + 1] = series
+        else:
+            order = np.argsort(positions)
+            variable[positions[order]] = series[order]
+
+    dataset.close()
+
+
+def store_countries(store_filename):
+
+    """
+    Returns the names of the countries in a store.
+    """
+
+    dataset = Dataset(store_filename,mode='r')
+    COUNTRIES = [variable.country for variable in dataset.variables.values()
+                 if hasattr(variable,'country')]
+    dataset.close()
+    return(COUNTRIES)
+
+
+def read_time_series(store_filename,COUNTRIES=None,start=None,end=None):
+
+    """
+    This function reads national time series back from a store. Only the
+    variables for the requested countries (and times) are read.
+
+    Args:
+
+        store_filename (str): From store_file, e.g. 'store/wind_cf.nc'
+
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France'], default all in the store.
+
+        start (datetime): The first time to read, default the start of the
+            record.
+
+        end (datetime): The last time to read, default the end of the
+            record.
+
+    Returns:
+
+        dates (array): Dimensions [time], as cftime datetimes in time order.
+
+        country_series (dict): {COUNTRY: time series, dimensions [time]}.
+
+    """
+
+    if COUNTRIES is None:
+        COUNTRIES = store_countries(store_filename)
+
+    dataset = Dataset(store_filename,mode='r')
+    store_times = np.ma.getdata(dataset.variables['time'][:])
+
+    selected = np.ones(len(store_times),dtype=bool)
+    if start is not None:
+        selected &= store_times >= date2num(start,STORE_TIME_UNITS,STORE_CALENDAR)
+    if end is not None:
+        selected &= store_times <= date2num(end,STORE_TIME_UNITS,STORE_CALENDAR)
+    positions = np.flatnonzero(selected)
+    positions = positions[np.argsort(store_times[positions],kind='stable')]
+
+    # read a contiguous block where possible (the usual case), otherwise
+    # only the block spanning the times wanted, rather than gathering
+    # individual times
+    contiguous = len(positions) > 0 and np.all(np.diff(positions) == 1)
+
+    country_series = {}
+    for COUNTRY in COUNTRIES:
+        variable = dataset.variables[country_variable_name(COUNTRY)]
+        if contiguous:
+            series = variable[positions[0]:positions[-1] + 1]
+        elif len(positions) > 0:
+            first, last = positions.min(), positions.max()
+            series = variable[first:last + 1][positions - first]
+        else:
+            series = np.zeros(0)
+        country_series[COUNTRY] = np.ma.filled(series,np.nan)
+    dataset.close()
+
+    dates = num2date(store_times[positions],STORE_TIME_UNITS,STORE_CALENDAR)
+    return(dates,country_series)
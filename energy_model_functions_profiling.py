@@ -0,0 +1,289 @@
+import atexit
+import collections
+import contextlib
+import csv
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+
+# Opt-in timing of the stages of the model chain. The public functions of
+# the energy_model_functions_* modules are wrapped with @profiled, and
+# other blocks of code can be timed with
+#
+#   with profiling.stage('wind_power.bias_correction'):
+#       ...
+#
+# For each stage the report gives the number of calls, the total time, the
+# time not spent in nested stages (self time), the slowest call and, if
+# memory tracking is on, the peak memory allocated during a call (from
+# tracemalloc, which numpy reports its arrays to).
+#
+# Profiling is off unless enable_profiling is called or ENERGY_MODEL_PROFILE
+# is set ('time', or 'memory' to track memory too, which is much slower).
+# When it is off a profiled function costs one extra check per call. With
+# ENERGY_MODEL_PROFILE set, a report is written when the run finishes to
+# ENERGY_MODEL_PROFILE_REPORT (.json or .csv, default
+# energy_model_profile.json).
+PROFILE_ENV = 'ENERGY_MODEL_PROFILE'
+PROFILE_REPORT_ENV = 'ENERGY_MODEL_PROFILE_REPORT'
+DEFAULT_REPORT = 'energy_model_profile.json'
+
+StageStats = collections.namedtuple('StageStats',
+    ['stage','calls','total_s','self_s','max_s','peak_memory_bytes'])
+
+_enabled = False
+_memory = False
+_started = None
+_stats = {} # stage -> [calls, total_s, self_s, max_s, peak_memory_bytes]
+_lock = threading.Lock()
+_local = threading.local() # each thread's stack of open stages
+_no_stage = contextlib.nullcontext()
+
+
+def enable_profiling(memory=False):
+
+    """
+    Turns profiling on, with memory tracking (tracemalloc) if memory is
+    True. The statistics gathered so far are kept, see reset_profile.
+    """
+
+    global _enabled, _memory, _started
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _memory = memory
+    _enabled = True
+    if _started is None:
+        _started = time.time()
+
+
+def disable_profiling():
+
+    """
+    Turns profiling (and memory tracking) off. The statistics are kept
+    until reset_profile.
+    """
+
+    global _enabled, _memory
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _memory = False
+
+
+def profiling_enabled():
+    return(_enabled)
+
+
+def reset_profile():
+
+    """
+    Clears the statistics gathered so far.
+    """
+
+    global _started
+    with _lock:
+        _stats.clear()
+    _started = time.time() if _enabled else None
+
+
+def _record(name,elapsed,self_time,peak):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = [0,0.,0.,0.,0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += self_time
+        stats[3] = max(stats[3],elapsed)
+        stats[4] = max(stats[4],peak)
+
+
+@contextlib.contextmanager
+def _timed_stage(name):
+    stack = getattr(_local,'stack',None)
+    if stack is None:
+        stack = _local.stack = []
+    memory = _memory and tracemalloc.is_tracing()
+    if memory:
+        # tracemalloc has a single peak, so the enclosing stage takes its
+        # peak so far before it is reset for this one
+        current, peak = tracemalloc.get_traced_memory()
+        if len(stack) > 0:
+            stack[-1]['peak'] = max(stack[-1]['peak'],peak)
+        tracemalloc.reset_peak()
+    else:
+        current = 0
+    entry = {'children': 0.,'start_memory': current,'peak': current}
+    stack.append(entry)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        peak = 0
+        if memory and tracemalloc.is_tracing():
+            entry['peak'] = max(entry['peak'],tracemalloc.get_traced_memory()[1])
+            peak = entry['peak'] - entry['start_memory']
+            if len(stack) > 0:
+                stack[-1]['peak'] = max(stack[-1]['peak'],entry['peak'])
+            tracemalloc.reset_peak()
+        if len(stack) > 0:
+            stack[-1]['children'] += elapsed
+        _record(name,elapsed,elapsed - entry['children'],peak)
+
+
+def stage(name):
+
+    """
+    Returns a context manager that times the code inside it as the stage
+    name, or does nothing if profiling is off.
+    """
+
+    if not _enabled:
+        return(_no_stage)
+    return(_timed_stage(name))
+
+
+def stage_name(function):
+
+    """
+    Returns the stage name of a function, e.g. 'wind_power.convert_to_windpower'
+    """
+
+    module = function.__module__.replace('energy_model_functions_','')
+    return(module + '.' + function.__qualname__)
+
+
+def profiled(function):
+
+    """
+    Decorator that times every call of function as a stage (see stage_name)
+    when profiling is on.
+    """
+
+    name = stage_name(function)
+
+    @functools.wraps(function)
+    def wrapper(*args,**kwargs):
+        if not _enabled:
+            return(function(*args,**kwargs))
+        with _timed_stage(name):
+            return(function(*args,**kwargs))
+    return(wrapper)
+
+
+def profile_snapshot():
+
+    """
+    Returns the statistics gathered so far in a form that can be pickled,
+    e.g. to send them from a worker process back to the parent, see
+    merge_profile.
+    """
+
+    with _lock:
+        return(dict((name,list(stats)) for name, stats in _stats.items()))
+
+
+def merge_profile(snapshot):
+
+    """
+    Adds the statistics in snapshot (from profile_snapshot, e.g. in a worker
+    process) to those of this process.
+    """
+
+    with _lock:
+        for name, other in snapshot.items():
+            stats = _stats.get(name)
+            if stats is None:
+                _stats[name] = list(other)
+                continue
+            stats[0] += other[0]
+            stats[1] += other[1]
+            stats[2] += other[2]
+            stats[3] = max(stats[3],other[3])
+            stats[4] = max(stats[4],other[4])
+
+
+def profile_report():
+
+    """
+    Returns the statistics of each stage as a list of StageStats, slowest
+    (by total time) first.
+    """
+
+    report = [StageStats(name,*stats) for name, stats in profile_snapshot().items()]
+    report.sort(key=lambda stats: stats.total_s,reverse=True)
+    return(report)
+
+
+def write_profile_report(report_file,metadata=None):
+
+    """
+    This function writes the profile of the run so far, one row per stage
+    (see StageStats), as JSON or CSV depending on the extension of
+    report_file.
+
+    Args:
+
+        report_file (str): e.g. 'profile.json' or 'profile.csv'
+
+        metadata (dict): Anything else to describe the run with (JSON only),
+            added to the start time, wall time, command line and versions.
+
+    Returns:
+
+        report (list): The StageStats written.
+
+    """
+
+    report = profile_report()
+    report_dir = os.path.dirname(report_file)
+    if report_dir:
+        os.makedirs(report_dir,exist_ok=True)
+
+    if report_file.endswith('.csv'):
+        with open(report_file,'w',newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(StageStats._fields)
+            for stats in report:
+                writer.writerow(stats)
+        return(report)
+
+    now = time.time()
+    run = {'started': None if _started is None else
+               datetime.datetime.fromtimestamp(_started).isoformat(),
+           'wall_s': None if _started is None else now - _started,
+           'argv': sys.argv,
+           'pid': os.getpid(),
+           'python': sys.version.split()[0],
+           'numpy': np.__version__,
+           'memory_tracking': _memory}
+    if metadata is not None:
+        run.update(metadata)
+    with open(report_file,'w') as f:
+        json.dump({'run': run,'stages': [stats._asdict() for stats in report]},
+                  f,indent=1,default=str)
+    return(report)
+
+
+def _write_report_at_exit():
+    # only the main process writes the report, not pool workers
+    if multiprocessing.parent_process() is None and len(_stats) > 0:
+        report_file = os.environ.get(PROFILE_REPORT_ENV,DEFAULT_REPORT)
+        write_profile_report(report_file)
+        print('Profile written to ' + report_file)
+
+
+if os.environ.get(PROFILE_ENV,'') not in ['','0']:
+    enable_profiling(memory=os.environ[PROFILE_ENV] == 'memory')
+    atexit.register(_write_report_at_exit)
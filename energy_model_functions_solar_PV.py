@@ -1,10 +1,21 @@
 import numpy as np
-import cartopy.io.shapereader as shpreader
-from netCDF4 import Dataset
-import shapely.geometry
+import energy_model_functions_aggregation as aggregation
+import energy_model_functions_country_masks as country_masks
+import energy_model_functions_era5_io as era5_io
+import energy_model_functions_profiling as profiling
 
 
-def load_country_weather_data(COUNTRY,data_dir,filename,nc_key):
+# reference values, see Evans and Florschuetz, (1977)
+T_REF = 25.
+EFF_REF = 0.9 #adapted based on Bett and Thornton (2016)
+BETA_REF = 0.0042
+G_REF = 1000.
+
+
+@profiling.profiled
+def load_country_weather_data(COUNTRY,data_dir,filename,nc_key,
+                              crop_to_country=False,fast=False,
+                              missing_values=None):
 
     """
     This function takes the ERA5 reanalysis data, loads it and applied a 
@@ -28,6 +39,18 @@ def load_country_weather_data(COUNTRY,data_dir,filename,nc_key):
         nc_key (str): The string you need to load the .nc data 
             e.g. 't2m','rsds'
 
+        crop_to_country (bool): If True only the lat/lon window around the
+            country is read from the file, and the returned arrays cover
+            that window rather than the whole domain.
+
+        fast (bool): If True the data is read without netCDF4's masked
+            arrays, as plain float32 with missing values set to NaN (see
+            era5_io.load_era5_variable_fast).
+
+        missing_values (list): If given (and fast is True), the
+            era5_io.MissingValues record of how the missing values of
+            nc_key were dealt with is appended to it.
+
     Returns:
 
         country_masked_data (array): Country-masked weather data, dimensions 
@@ -38,54 +61,125 @@ def load_country_weather_data(COUNTRY,data_dir,filename,nc_key):
            the data is within a country border and zeros if data is outside a 
            country border. 
 
-    """
+        (lat_offset, lon_offset) (tuple): Only returned if crop_to_country is
+           True, the index of the window's first gridpoint in the full grid.
 
+    """
 
-    # first loop through the countries and extract the appropraite shapefile
-    countries_shp = shpreader.natural_earth(resolution='10m',category='cultural',
-                                            name='admin_0_countries')
-    country_shapely = []
-    for country in shpreader.Reader(countries_shp).records():
-        if country.attributes['NAME_LONG'] == COUNTRY:
-            print('Found country')
-            country_shapely.append(country.geometry)
 
-    # load in the data you wish to mask
     file_str = data_dir + filename
-    dataset = Dataset(file_str,mode='r')
-    lons = dataset.variables['longitude'][:]
-    lats = dataset.variables['latitude'][:]
-    data = dataset.variables[nc_key][:] # data in shape [time,lat,lon]
-    dataset.close()
-
-    # get data in appropriate units for models
-    if nc_key == 't2m':
-        data = data-273.15 # convert to Kelvin from Celsius
-    if nc_key == 'ssrd':
-        data = data/3600. # convert Jh-1m-2 to Wm-2
-
-    LONS, LATS = np.meshgrid(lons,lats) # make grids of the lat and lon data
-    x, y = LONS.flatten(), LATS.flatten() # flatten these to make it easier to 
-    #loop over.
-    points = np.vstack((x,y)).T
-    MASK_MATRIX = np.zeros((len(x),1))
-    # loop through all the lat/lon combinations to get the masked points
-    for i in range(0,len(x)):
-        my_point = shapely.geometry.Point(x[i],y[i]) 
-        if country_shapely[0].contains(my_point) == True: 
-            MASK_MATRIX[i,0] = 1.0 # creates 1s and 0s where the country is
-    
-    MASK_MATRIX_RESHAPE = np.reshape(MASK_MATRIX,(len(lats),len(lons)))
+    if crop_to_country:
+        # find the country's window from the grid alone, then read only the
+        # hyperslab of data inside it.
+        lons, lats = era5_io.load_era5_grid(file_str)
+        full_mask = country_masks.get_country_mask(COUNTRY,lons,lats)
+        lat_slice, lon_slice = country_masks.country_mask_window(full_mask)
+        lons, lats, data = era5_io.load_era5_variable(file_str,nc_key,
+                                                      lat_slice,lon_slice,
+                                                      fast=fast,
+                                                      missing_values=missing_values)
+        MASK_MATRIX_RESHAPE = full_mask[lat_slice,lon_slice]
+        country_masked_data = country_masks.apply_country_mask(data,
+                                                               MASK_MATRIX_RESHAPE)
+        return(country_masked_data,MASK_MATRIX_RESHAPE,
+               (lat_slice.start,lon_slice.start))
+
+    # load in the data you wish to mask, in appropriate units for models
+    lons, lats, data = era5_io.load_era5_variable(file_str,nc_key,fast=fast,
+                                                  missing_values=missing_values)
+
+    # creates 1s and 0s where the country is (cached between calls)
+    MASK_MATRIX_RESHAPE = country_masks.get_country_mask(COUNTRY,lons,lats)
 
     # now apply the mask to the data that has been loaded in:
 
-    country_masked_data = data*MASK_MATRIX_RESHAPE
+    country_masked_data = country_masks.apply_country_mask(data,
+                                                           MASK_MATRIX_RESHAPE)
                                      
 
 
     return(country_masked_data,MASK_MATRIX_RESHAPE)
 
 
+@profiling.profiled
+def load_country_weather_data_multi(COUNTRIES,data_dir,filename,nc_key,
+                                    fast=False,member_slice=slice(None),
+                                    missing_values=None):
+
+    """
+    This function does the same as load_country_weather_data for a list of
+    countries at once. The file is read and converted to the model units
+    only once, then each country is cut out of it using its own lat/lon
+    window, so the results are cropped to each country rather than the
+    size of the original domain. Only the window covering all of the
+    countries is read from the file.
+
+    Args:
+        COUNTRIES (list): Names of countries e.g.
+            ['United Kingdom','France','Czech Republic']
+
+        data_dir (str): The parth for where the data is stored.
+            e.g '/home/users/zd907959/'
+
+        filename (str): The filename of a .netcdf file
+            e.g. 'ERA5_1979_01.nc'
+
+        nc_key (str): The string you need to load the .nc data
+            e.g. 't2m','rsds'
+
+        fast (bool): If True the data is read without netCDF4's masked
+            arrays, as plain float32 with missing values set to NaN (see
+            era5_io.load_era5_variable_fast).
+
+        member_slice (slice): For ensembles, the members to read, default
+            all. Members can be streamed through the models by reading a
+            few at a time, see era5_io.member_slices.
+
+        missing_values (list): If given (and fast is True), the
+            era5_io.MissingValues record of how the missing values of
+            nc_key were dealt with is appended to it.
+
+    Returns:
+
+        country_data (dict): COUNTRY -> (country_masked_data, country_mask,
+            (lat_offset, lon_offset)). country_masked_data has dimensions
+            [time,lat,lon] (or [member,time,lat,lon] for ensembles) and
+            country_mask [lat,lon], both over the country's
+            window only. The offsets give the index of the window's first
+            gridpoint in the original grid.
+
+    """
+
+    file_str = data_dir + filename
+    lons, lats = era5_io.load_era5_grid(file_str)
+    full_masks = [country_masks.get_country_mask(COUNTRY,lons,lats)
+                  for COUNTRY in COUNTRIES]
+
+    # read only the window that covers all of the countries
+    lat_window, lon_window = country_masks.union_mask_window(full_masks)
+    lons, lats, data = era5_io.load_era5_variable(file_str,nc_key,
+                                                  lat_window,lon_window,
+                                                  fast=fast,
+                                                  member_slice=member_slice,
+                                                  missing_values=missing_values)
+
+    country_data = {}
+    for COUNTRY, full_mask in zip(COUNTRIES,full_masks):
+        lat_slice, lon_slice = country_masks.country_mask_window(full_mask)
+        country_mask = full_mask[lat_slice,lon_slice]
+        # position of the country's window within the data that was read
+        lat_start = max(lat_slice.start-lat_window.start,0)
+        lon_start = max(lon_slice.start-lon_window.start,0)
+        country_masked_data = country_masks.apply_country_mask(
+            data[...,lat_start:lat_start+country_mask.shape[0],
+                 lon_start:lon_start+country_mask.shape[1]],country_mask)
+        country_data[COUNTRY] = (country_masked_data,country_mask,
+                                 (lat_slice.start,lon_slice.start))
+
+    return(country_data)
+
+
+@profiling.profiled
 def solar_PV_model(country_masked_data_T2m,country_masked_data_ssrd,country_mask):
 
     """
@@ -98,34 +192,201 @@ def solar_PV_model(country_masked_data_T2m,country_masked_data_ssrd,country_mask
     Args:
 
         country_masked_data_T2m (array): array of 2m temperatures, Dimensions 
-            [time, lat,lon] or [lat,lon] in units of celsius.
+            [time, lat,lon], [member,time,lat,lon] or [lat,lon] in units of
+            celsius.
         country_masked_data_ssrd (array): array of surface solar irradiance, 
-            Dimensions [time, lat,lon] or [lat,lon]in units of Wm-2.
+            Dimensions [time, lat,lon], [member,time,lat,lon] or [lat,lon]
+            in units of Wm-2.
         country_mask (array): dimensions [lat,lon] with 1's within a country 
-            border and 0 outside of it. 
+            border and 0 outside of it. For a capacity-weighted mean, the
+            AggregationWeights of an installed-capacity field can be given
+            instead (see load_solar_capacity_weights).
     Returns:
 
-        spatial_mean_solar_cf (array): Dimesions [time], Timeseries of solar 
-            power capacity factor, varying between 0 and 1.
+        spatial_mean_solar_cf (array): Dimesions [time] (or [member,time]),
+            Timeseries of solar power capacity factor, varying between 0 and 1.
 
 
     """
    # reference values, see Evans and Florschuetz, (1977)
-    T_ref = 25. 
-    eff_ref = 0.9 #adapted based on Bett and Thornton (2016)
-    beta_ref = 0.0042
-    G_ref = 1000.
+    T_ref = T_REF
+    eff_ref = EFF_REF
+    beta_ref = BETA_REF
+    G_ref = G_REF
  
     rel_efficiency_of_pannel = eff_ref*(1 - beta_ref*(country_masked_data_T2m - T_ref))
     capacity_factor_of_pannel = np.nan_to_num(rel_efficiency_of_pannel*
                                               (country_masked_data_ssrd/G_ref)) 
 
 
-    spatial_mean_solar_cf = np.zeros([len(capacity_factor_of_pannel)])
-    for i in range(0,len(capacity_factor_of_pannel)):
-        spatial_mean_solar_cf[i] = np.average(capacity_factor_of_pannel[i,:,:],
-                                        weights=country_mask)
+    if isinstance(country_mask,aggregation.AggregationWeights):
+        country_weights = country_mask
+    else:
+        country_weights = aggregation.make_aggregation_weights(country_mask)
+    spatial_mean_solar_cf = aggregation.aggregate_gridded_data(
+        capacity_factor_of_pannel,country_weights)
+
+    return(spatial_mean_solar_cf)
+
+
+
+
+@profiling.profiled
+def solar_PV_model_fused(country_masked_data_T2m,country_masked_data_ssrd,
+                         country_weights,chunk_size=168,dtype=np.float32):
+
+    """
+    This function gives the same national solar power capacity factor as
+    solar_PV_model, but only evaluates the panel efficiency at the
+    gridpoints inside the country. The temperature and irradiance at those
+    gridpoints are gathered a chunk of timesteps at a time into dtype
+    (float32 by default) and the efficiency and capacity factor are worked
+    out in place, so no full-size temporaries are made.
+
+    Args:
+
+        country_masked_data_T2m (array): array of 2m temperatures, Dimensions
+            [time,lat,lon] or [member,time,lat,lon] in units of celsius.
+
+        country_masked_data_ssrd (array): array of surface solar irradiance,
+            the same dimensions, in units of Wm-2.
+
+        country_weights (array or AggregationWeights): The country mask,
+            dimensions [lat,lon] with 1's within a country border and 0
+            outside of it, or weights from
+            aggregation.make_aggregation_weights.
+
+        chunk_size (int): The number of timesteps evaluated at once.
+
+        dtype (numpy dtype): The precision the capacity factor is worked
+            out in. The national mean is always accumulated in float64.
+
+    Returns:
+
+        spatial_mean_solar_cf (array): Dimesions [time] (or [member,time]),
+            Timeseries of solar power capacity factor, varying between 0
+            and 1.
+
+    """
+
+    if not isinstance(country_weights,aggregation.AggregationWeights):
+        country_weights = aggregation.make_aggregation_weights(country_weights)
+    index, shape = country_weights.index, country_weights.shape
+
+    data_shape = np.shape(country_masked_data_T2m)
+    len_time = data_shape[-3]
+    spatial_mean_solar_cf = np.zeros(data_shape[:-2])
+
+    for start in range(0,len_time,chunk_size):
+        chunk = (Ellipsis,slice(start,start+chunk_size),slice(None),slice(None))
+        capacity_factor = _gridpoint_capacity_factor(
+            country_masked_data_T2m[chunk],country_masked_data_ssrd[chunk],
+            index,shape,dtype)
+        spatial_mean_solar_cf[...,start:start+chunk_size] = np.dot(
+            capacity_factor,country_weights.weights)
 
     return(spatial_mean_solar_cf)
 
 
+def _gridpoint_capacity_factor(T2m_data,ssrd_data,index,shape,dtype):
+    # gather both fields at the gridpoints and work out the capacity factor,
+    # zero where either is missing (masked) as np.average did in
+    # solar_PV_model
+    t2m = aggregation.gather_gridpoints(T2m_data,index,shape)
+    ssrd = aggregation.gather_gridpoints(ssrd_data,index,shape)
+    missing = np.ma.mask_or(np.ma.getmask(t2m),np.ma.getmask(ssrd))
+    capacity_factor = _capacity_factor_in_place(
+        np.ma.getdata(t2m).astype(dtype,copy=False),np.ma.getdata(ssrd))
+    if np.any(missing):
+        capacity_factor[missing] = 0.
+    return(capacity_factor)
+
+
+def _capacity_factor_in_place(t2m,ssrd):
+    # eff_ref*(1 - beta_ref*(T - T_ref))*(G/G_ref), written over t2m
+    t2m -= T_REF
+    t2m *= -BETA_REF
+    t2m += 1.
+    t2m *= EFF_REF/G_REF
+    t2m *= ssrd
+    np.nan_to_num(t2m,copy=False)
+    return(t2m)
+
+
+@profiling.profiled
+def load_solar_capacity_weights(capacity_files):
+
+    """
+    This function loads gridded installed solar capacity, in the same format
+    as the wind farm files (a 'totals' variable on the ERA5 grid, e.g.
+    France_ERA5_windfarm_dist.nc), as weights for a capacity-weighted
+    national capacity factor. Only the gridboxes with capacity are kept.
+
+    Args:
+
+        capacity_files (str or list): The filename of a .nc file containing
+            the installed capacity in each reanalysis gridbox, or a list of
+            them, e.g. one per capacity scenario.
+
+    Returns:
+
+        capacity_weights (AggregationWeights or WeightMatrix): For one file,
+            to be passed to solar_PV_model or solar_PV_model_fused. For a
+            list, to be passed to solar_PV_model_multi.
+
+    """
+
+    if isinstance(capacity_files,str):
+        return(aggregation.load_capacity_weights(capacity_files))
+    return(aggregation.load_capacity_weight_matrix(capacity_files))
+
+
+@profiling.profiled
+def solar_PV_model_multi(T2m_data,ssrd_data,weight_matrix,chunk_size=168,
+                         dtype=np.float32):
+
+    """
+    This function does solar_PV_model_fused for many sets of weights at
+    once, e.g. several installed-capacity scenarios or several countries.
+    The capacity factor is evaluated once at every gridpoint that any of
+    them uses, then all of the weighted means are taken with one (sparse)
+    matrix product per chunk.
+
+    Args:
+
+        T2m_data (array): array of 2m temperatures, Dimensions
+            [time,lat,lon] or [member,time,lat,lon] in units of celsius.
+
+        ssrd_data (array): array of surface solar irradiance, the same
+            dimensions, in units of Wm-2.
+
+        weight_matrix (WeightMatrix): e.g. from load_solar_capacity_weights
+            with a list of files, or aggregation.make_weight_matrix.
+
+        chunk_size (int): The number of timesteps evaluated at once.
+
+        dtype (numpy dtype): The precision the capacity factor is worked
+            out in.
+
+    Returns:
+
+        solar_cf (array): Dimensions [time,n] (or [member,time,n]), the
+            solar power capacity factor for each of the n sets of weights.
+
+    """
+
+    index, shape = weight_matrix.index, weight_matrix.shape
+    data_shape = np.shape(T2m_data)
+    len_time = data_shape[-3]
+    solar_cf = np.zeros(data_shape[:-2] + (weight_matrix.matrix.shape[0],))
+
+    for start in range(0,len_time,chunk_size):
+        chunk = (Ellipsis,slice(start,start+chunk_size),slice(None),slice(None))
+        capacity_factor = _gridpoint_capacity_factor(T2m_data[chunk],
+                                                     ssrd_data[chunk],
+                                                     index,shape,dtype)
+        solar_cf[...,start:start+chunk_size,:] = \
+            aggregation.aggregate_gridpoint_data_multi(capacity_factor,
+                                                       weight_matrix)
+
+    return(solar_cf)
@@ -1,332 +1,1316 @@
+import collections
+import os
+
 import numpy as np
 from netCDF4 import Dataset
-
-def load_100mwindspeed_data(data_dir,filename):
+import energy_model_functions_aggregation as aggregation
+import energy_model_functions_era5_io as era5_io
+import energy_model_functions_profiling as profiling
+
+
+# A power curve interpolated onto uniform wind speed bins. wind_speeds are
+# the bin edges and capacity_factors the capacity factor at the middle of
+# each bin (the mean of the curve at its two edges).
+PowerCurveTable = collections.namedtuple('PowerCurveTable',
+                                         ['wind_speeds','capacity_factors',
+                                          'resolution'])
+
+# A histogram of (bias-corrected) wind speeds on the same bins as the
+# PowerCurveTables, so capacity factor statistics can be worked out from it
+# for any turbine without going back to the gridded data. counts has
+# dimensions [...,n_bins]: [lat,lon,n_bins] for one histogram per gridpoint
+# (in hours), [n_bins] for the capacity-weighted national histogram or
+# [n_classes+1,n_bins] for one split by optimal turbine class (in hours
+# times the share of the capacity, which sums to one).
+WindSpeedHistogram = collections.namedtuple('WindSpeedHistogram',
+                                            ['counts','wind_speeds',
+                                             'resolution'])
+
+# A turbine power curve as read from its .csv file, with read-only arrays.
+PowerCurve = collections.namedtuple('PowerCurve',
+                                    ['name','wind_speeds','capacity_factors'])
+
+# The power curves that can be asked for by name, see register_power_curve.
+_module_dir = os.path.dirname(os.path.abspath(__file__))
+POWER_CURVE_FILES = {
+    'Enercon_E70': os.path.join(_module_dir,'Enercon_E70_2300MW_ECEM_turbine.csv'),
+    'Gamesa_G87': os.path.join(_module_dir,'Gamesa_G87_2000MW_ECEM_turbine.csv'),
+    'Vestas_v110': os.path.join(_module_dir,'Vestas_v110_2000MW_ECEM_turbine.csv'),
+}
+
+_power_curves = {} # name or file path -> PowerCurve
+_correction_factors = {} # (file path, mtime, dtype) -> bias correction factors
+_power_curve_tables = {} # (name, resolution) -> (PowerCurve, PowerCurveTable)
+_class_tables = {} # (table ids, dtype) -> (PowerCurveTables, stacked capacity factors)
+
+@profiling.profiled
+def load_100mwindspeed_data(data_dir,filename,dtype=np.float64,fast=False,
+                            member_slice=slice(None),missing_values=None):
 
     """
-    This function takes the ERA5 reanalysis data, loads it and applied a 
-    country mask (ready for conversion to energy) it then returns
-    the array (of original size) with all irrelvelant gridpoints 
-    set to zeros.
-
-    You will need the shpreader.natural_earth data downloaded 
-    to find the shapefiles.
+    This function loads the 100m wind speed from an ERA5 file, worked out
+    from the u100 and v100 components over the whole domain.
 
     Args:
 
-        data_dir (str): The parth for where the data is stored.
+        data_dir (str): The path where the data is stored.
             e.g '/home/users/zd907959/'
 
         filename (str): The filename of a .netcdf file
             e.g. 'ERA5_1979_01.nc'
 
+        dtype (numpy dtype): The precision of the returned data, e.g.
+            np.float32 to halve the memory needed.
+
+        fast (bool): If True u100 and v100 are read without netCDF4's
+            masked arrays and unpacked in place (see
+            era5_io.load_era5_variable_fast). Missing values are set to
+            zero, so give a wind speed of zero. Otherwise missing values
+            are masked, as netCDF4 reads them.
+
+        member_slice (slice): For ensembles, the members to read, default
+            all.
+
+        missing_values (list): If given (and fast is True), the
+            era5_io.MissingValues of u100 and v100 are appended to it.
+
     Returns:
 
         wind_speed_data (array): 100m wind speed data, dimensions 
-            [time,lat,lon].
+            [time,lat,lon], or [member,time,lat,lon] for ensembles. A
+            masked array if any values are missing (and fast is False).
 
     """
 
   
     # load in the data you wish to mask
     file_str = data_dir + filename
-    dataset = Dataset(file_str,mode='r')
+    if fast:
+        data1, u_missing = era5_io.load_era5_variable_fast(
+            file_str,'u100',dtype=dtype,missing_value=0.,
+            member_slice=member_slice)[2:]
+        data2, v_missing = era5_io.load_era5_variable_fast(
+            file_str,'v100',dtype=dtype,missing_value=0.,
+            member_slice=member_slice)[2:]
+        if missing_values is not None:
+            missing_values.extend([u_missing,v_missing])
+        return(np.hypot(data1,data2,out=data1))
+
+    dataset = era5_io.open_era5_dataset(file_str,['u100','v100'])
     lons = dataset.variables['longitude'][:]
     lats = dataset.variables['latitude'][:]
-    data1 = dataset.variables['u100'][:] # data in shape [time,lat,lon]
-    data2 = dataset.variables['v100'][:] # data in shape [time,lat,lon]
+    # data in shape [time,lat,lon] or [member,time,lat,lon]
+    index = era5_io.era5_index(len(dataset.variables['u100'].shape),
+                               member_slice=member_slice)
+    data1 = dataset.variables['u100'][index]
+    data2 = dataset.variables['v100'][index]
     dataset.close()
 
-    wind_speed_data = np.sqrt(data1*data1 + data2*data2)
+    wind_speed_data = _wind_speed(data1,data2,dtype)
+
+    return(wind_speed_data)
+
+
 
+def _wind_speed(data1,data2,dtype):
+    # sqrt(u*u + v*v) without the temporaries, written over u. Where either
+    # is missing (masked) the speed is masked.
+    mask = np.ma.mask_or(np.ma.getmask(data1),np.ma.getmask(data2))
+    wind_speed_data = np.ma.getdata(data1).astype(dtype,copy=False)
+    np.hypot(wind_speed_data,np.ma.getdata(data2),out=wind_speed_data,
+             casting='same_kind')
+    if np.any(mask):
+        wind_speed_data = np.ma.masked_array(wind_speed_data,mask=mask)
     return(wind_speed_data)
 
 
 
-def meanBC_wind_speed_data(wind_speed_data,bias_correction_file):
+def iter_100mwindspeed_data(data_dir,filename,chunk_size=168,dtype=np.float64,
+                            member_slice=slice(None)):
+
+    """
+    This function does the same as load_100mwindspeed_data but reads the
+    file a chunk of timesteps at a time, so only one chunk is in memory.
+    For ensembles each chunk has all of the members in member_slice.
+
+    Args:
+
+        data_dir (str): The path where the data is stored.
+            e.g '/home/users/zd907959/'
+
+        filename (str): The filename of a .netcdf file
+            e.g. 'ERA5_1979_01.nc'
+
+        chunk_size (int): The number of timesteps read at once.
+
+        dtype (numpy dtype): The precision of the returned data.
+
+        member_slice (slice): For ensembles, the members to read, default
+            all.
+
+    Yields:
+
+        wind_speed_data (array): 100m wind speed data, dimensions
+            [chunk_size,lat,lon] or [member,chunk_size,lat,lon] (the last
+            chunk may be shorter). Missing values are masked, as in
+            load_100mwindspeed_data.
+
+    """
+
+    file_str = data_dir + filename
+    dataset = era5_io.open_era5_dataset(file_str,['u100','v100'])
+    try:
+        shape = dataset.variables['u100'].shape
+        for start in range(0,shape[-3],chunk_size):
+            index = era5_io.era5_index(len(shape),slice(start,start+chunk_size),
+                                       member_slice=member_slice)
+            # a generator can't be @profiled, time each chunk instead
+            with profiling.stage('wind_power.iter_100mwindspeed_data'):
+                wind_speed_data = _wind_speed(dataset.variables['u100'][index],
+                                              dataset.variables['v100'][index],
+                                              dtype)
+            yield wind_speed_data
+    finally:
+        dataset.close()
+
+
+
+@profiling.profiled
+def load_bias_correction_factors(bias_correction_file,dtype=np.float64):
 
     """
-    This function takes the ERA5 reanalysis data, loads it and applied a 
-    country mask (ready for conversion to energy) it then returns
-    the array (of original size) with all irrelvelant gridpoints 
-    set to zeros.
+    This function loads the mean bias correction factors from a .npy file.
+    The factors are kept in memory (read-only) so each file is only read
+    once, unless it changes on disk.
+
+    Args:
+
+        bias_correction_file (str): The filename of a .npy file
+            containing the mean Bias correction factors on this grid.
+
+        dtype (numpy dtype): The precision of the returned factors.
 
-    You will need the shpreader.natural_earth data downloaded 
-    to find the shapefiles.
+    Returns:
+
+        correction_factors (array): Dimensions [lat,lon].
+
+    """
+
+    modified = os.stat(bias_correction_file).st_mtime_ns
+    key = (os.path.abspath(bias_correction_file),modified,np.dtype(dtype).str)
+    if key not in _correction_factors:
+        correction_factors = np.load(bias_correction_file).astype(dtype)
+        correction_factors.setflags(write=False)
+        _correction_factors[key] = correction_factors
+    return(_correction_factors[key])
+
+
+
+
+@profiling.profiled
+def meanBC_wind_speed_data(wind_speed_data,bias_correction_file,out=None):
+
+    """
+    This function applies the mean bias correction factors (from the Global
+    Wind Atlas) to 100m wind speeds, adding them at every timestep and
+    setting any speeds that drop below zero to zero.
 
     Args:
 
         wind_speed_data (array): 100m wind speed  data, dimensions 
-            [time,lat,lon]
+            [time,lat,lon] or [member,time,lat,lon]
 
         bias_correction_file (str): The filename of a .npy file
             containing the mean Bias correction factors on this grid.
 
+        out (array): Where to write the result. Pass wind_speed_data itself
+            to correct it in place with no new allocation. By default a new
+            array of the same dtype as wind_speed_data is returned.
+
     Returns:
 
         BC_wind_speed_data (array): 100m wind speed  data, dimensions 
-            [time,lat,lon] with a mean bias correction calcualted based on the
+            [time,lat,lon] (or [member,time,lat,lon]) with a mean bias
+            correction calcualted based on the
             Global Wind Atlas data applied. globalwindatlas.info
+            Missing (masked) values stay masked.
 
     """
 
-    correction_factors = np.load(bias_correction_file)
+    if out is None:
+        out = np.empty_like(np.ma.getdata(wind_speed_data))
+    correction_factors = load_bias_correction_factors(bias_correction_file,
+                                                      out.dtype)
+
+    # the correction factors are broadcast over time
+    BC_wind_speed_data = np.add(np.ma.getdata(wind_speed_data),
+                                correction_factors,out=np.ma.getdata(out))
 
-    len_time = np.shape(wind_speed_data)[0]
-    BC_wind_speed_data = np.zeros(np.shape(wind_speed_data))
-    for i in range(0,len_time):
-        BC_wind_speed_data[i,:,:] = wind_speed_data[i,:,:] + correction_factors
     # set any times when the wind speed drops below zero to zero.
-    
+    np.maximum(BC_wind_speed_data,0.,out=BC_wind_speed_data)
 
-    BC_wind_speed_data[BC_wind_speed_data <0.] = 0.
+    if np.ma.is_masked(wind_speed_data):
+        BC_wind_speed_data = np.ma.masked_array(
+            BC_wind_speed_data,mask=np.ma.getmaskarray(wind_speed_data))
     
     return(BC_wind_speed_data)
 
 
 
 
+@profiling.profiled
+def load_100mwindspeed_data_BC(data_dir,filename,bias_correction_file,
+                               dtype=np.float32,chunk_size=24,
+                               member_slice=slice(None)):
+
+    """
+    This function does load_100mwindspeed_data and meanBC_wind_speed_data in
+    one pass. The output array is the only full-size allocation: u100 and
+    v100 are read a chunk of timesteps at a time, and the speed, bias
+    correction and clamping at zero are all done in place in the output.
+
+    Args:
+
+        data_dir (str): The path where the data is stored.
+            e.g '/home/users/zd907959/'
 
-def convert_to_windpower(wind_speed_data,power_curve_file):
+        filename (str): The filename of a .netcdf file
+            e.g. 'ERA5_1979_01.nc'
+
+        bias_correction_file (str): The filename of a .npy file
+            containing the mean Bias correction factors on this grid.
+
+        dtype (numpy dtype): The precision of the returned data.
+
+        chunk_size (int): The number of timesteps read at once.
+
+        member_slice (slice): For ensembles, the members to read, default
+            all.
+
+    Returns:
+
+        BC_wind_speed_data (array): 100m wind speed  data, dimensions
+            [time,lat,lon] (or [member,time,lat,lon] for ensembles) with the
+            mean bias correction applied. Missing values are set to NaN.
 
     """
-    This function takes the ERA5 reanalysis data, loads it and applied a 
-    country mask (ready for conversion to energy) it then returns
-    the array (of original size) with all irrelvelant gridpoints 
-    set to zeros.
 
-    You will need the shpreader.natural_earth data downloaded 
-    to find the shapefiles.
+    correction_factors = load_bias_correction_factors(bias_correction_file,dtype)
+
+    file_str = data_dir + filename
+    dataset = era5_io.open_era5_dataset(file_str,['u100','v100'])
+    u_variable = dataset.variables['u100']
+    v_variable = dataset.variables['v100']
+    ndim = len(u_variable.shape)
+    shape = list(u_variable.shape)
+    if ndim == 4:
+        shape[0] = len(range(*member_slice.indices(shape[0])))
+    BC_wind_speed_data = np.empty(shape,dtype=dtype)
+
+    for start in range(0,shape[-3],chunk_size):
+        index = era5_io.era5_index(ndim,slice(start,start+chunk_size),
+                                   member_slice=member_slice)
+        chunk = BC_wind_speed_data[...,start:start+chunk_size,:,:]
+        data1 = u_variable[index]
+        data2 = v_variable[index]
+        np.hypot(np.ma.getdata(data1),np.ma.getdata(data2),out=chunk,
+                 casting='same_kind')
+        chunk += correction_factors
+        np.maximum(chunk,0.,out=chunk)
+        # a plain array can't be masked, so missing values are NaN
+        mask = np.ma.mask_or(np.ma.getmask(data1),np.ma.getmask(data2))
+        if np.any(mask):
+            chunk[mask] = np.nan
+    dataset.close()
+
+    return(BC_wind_speed_data)
+
+
+
+
+def register_power_curve(name,power_curve_file):
+
+    """
+    Makes a turbine power curve available by name to the conversion
+    functions, e.g. register_power_curve('Vestas_v90','Vestas_v90.csv').
 
     Args:
 
-        gridded_wind_power (array): wind power capacity factor data, dimensions 
-            [time,lat,lon]. Capacity factors range between 0 and 1.
+        name (str): The name the curve will be requested by.
 
         power_curve_file (str): The filename of a .csv file
-            containing the wind speeds (column 0) and capacity factors 
-            (column 2) of the chosen wind turbine.
+            containing the wind speeds (column 0) and capacity factors
+            (column 2) of the wind turbine.
+
+    """
+
+    POWER_CURVE_FILES[name] = power_curve_file
+    _power_curves.pop(name,None)
+
+
+
+@profiling.profiled
+def load_power_curve(power_curve_file,name=None):
+
+    """
+    This function reads a turbine power curve from its whitespace-separated
+    .csv file into a PowerCurve with read-only arrays.
+
+    Args:
+
+        power_curve_file (str): The filename of a .csv file
+            containing the wind speeds (column 0) and capacity factors
+            (column 2) of the wind turbine.
+
+        name (str): The name to give the curve, defaults to the filename.
 
     Returns:
 
-        wind_power_cf (array): Gridded wind Power capacity factor  
-            data, dimensions [time,lat,lon]. Values vary between 0 and 1.
+        power_curve (PowerCurve): The wind speeds and capacity factors.
+
+    """
+
+    columns = np.loadtxt(power_curve_file,ndmin=2)
+    power_curve_w = np.ascontiguousarray(columns[:,0])
+    power_curve_p = np.ascontiguousarray(columns[:,2]) # get power curve output (CF)
+    power_curve_w.setflags(write=False)
+    power_curve_p.setflags(write=False)
+
+    if name is None:
+        name = power_curve_file
+    power_curve = PowerCurve(name,power_curve_w,power_curve_p)
+    return(power_curve)
+
+
+
+def get_power_curve(power_curve):
+
+    """
+    Returns a PowerCurve given either a PowerCurve, the name of a registered
+    curve (see POWER_CURVE_FILES) or the filename of a .csv file. Each
+    curve is only read from disk once.
+    """
+
+    if isinstance(power_curve,PowerCurve):
+        return(power_curve)
+
+    if power_curve not in _power_curves:
+        if power_curve in POWER_CURVE_FILES:
+            _power_curves[power_curve] = load_power_curve(
+                POWER_CURVE_FILES[power_curve],name=power_curve)
+        else:
+            _power_curves[power_curve] = load_power_curve(power_curve)
+    return(_power_curves[power_curve])
+
+
+
+def get_power_curve_table(power_curve,resolution=0.1):
+
+    """
+    Returns the PowerCurveTable of a power curve (a PowerCurve, registered
+    name or .csv filename) at the given resolution. Tables are memoized, so
+    repeated conversions with the same turbine do no file reading or
+    interpolation.
+    """
+
+    power_curve = get_power_curve(power_curve)
+    key = (power_curve.name,resolution)
+    if key not in _power_curve_tables or _power_curve_tables[key][0] is not power_curve:
+        power_curve_table = make_power_curve_table(power_curve.wind_speeds,
+                                                   power_curve.capacity_factors,
+                                                   resolution)
+        power_curve_table.wind_speeds.setflags(write=False)
+        power_curve_table.capacity_factors.setflags(write=False)
+        _power_curve_tables[key] = (power_curve,power_curve_table)
+    return(_power_curve_tables[key][1])
+
+
+
+@profiling.profiled
+def make_power_curve_table(power_curve_w,power_curve_p,resolution=0.1,
+                           max_speed=50.):
 
     """
+    This function interpolates a power curve onto uniform wind speed bins
+    and precomputes the capacity factor of every bin, so that wind speeds
+    can be converted to capacity factor by indexing rather than searching.
+
+    Args:
+
+        power_curve_w (array): The wind speeds of the power curve (m/s).
+
+        power_curve_p (array): The capacity factors of the power curve.
+
+        resolution (float): The width of the wind speed bins (m/s).
 
-    # first load in the power curve data
-    pc_w = []
-    pc_p = []
+        max_speed (float): The top of the last bin (m/s), the curve is
+            assumed to be constant above this.
 
-    with open(power_curve_file) as f:
-        for line in f:
-            columns = line.split()
-            #print columns[0]
-            pc_p.append(np.float(columns[2]))  
-            pc_w.append(np.float(columns[0]))  # get power curve output (CF)
+    Returns:
+
+        power_curve_table (PowerCurveTable): to be passed to
+            power_curve_lookup.
 
-    # convert to an array
-    power_curve_w = np.array(pc_w)
-    power_curve_p = np.array(pc_p)
+    """
 
-    #interpolate to fine resolution.
-    pc_winds = np.linspace(0,50,501) # make it finer resolution 
+    n_bins = int(round(max_speed/resolution))
+    pc_winds = np.linspace(0,max_speed,n_bins+1) # make it finer resolution
     pc_power = np.interp(pc_winds,power_curve_w,power_curve_p)
+    bin_cf = 0.5*(pc_power[:-1]+pc_power[1:])
 
-    reshaped_speed = wind_speed_data.flatten()
-    test = np.digitize(reshaped_speed,pc_winds,right=False) # indexing starts 
-    #from 1 so needs -1: 0 in the next bit to start from the lowest bin.
-    test[test ==len(pc_winds)] = 500 # make sure the bins don't go off the 
-    #end (power is zero by then anyway)
-    wind_power_flattened = 0.5*(pc_power[test-1]+pc_power[test])
+    power_curve_table = PowerCurveTable(pc_winds,bin_cf,resolution)
+    return(power_curve_table)
 
-    wind_power_cf = np.reshape(wind_power_flattened,(np.shape(wind_speed_data)))
-    
-    return(wind_power_cf)
 
 
+@profiling.profiled
+def power_curve_bin_index(wind_speed_data,power_curve_table):
 
+    """
+    This function finds which bin of a PowerCurveTable (or
+    WindSpeedHistogram) each wind speed is in. As the bins are uniform this
+    is a scaling of the speed, which is then nudged by one bin where
+    floating point rounding at the bin edges would otherwise disagree with
+    np.digitize. Speeds above the last bin are put in the last bin, and so
+    are missing speeds (NaN or masked), as np.digitize did.
 
+    Args:
 
+        wind_speed_data (array): wind speeds of any shape.
+
+        power_curve_table (PowerCurveTable): from make_power_curve_table,
+            or a WindSpeedHistogram, which has the same bins.
+
+    Returns:
+
+        bin_index (array): integer bin numbers, the same shape as
+            wind_speed_data.
 
-def convert_to_windpower_optimal_turbine(wind_speed_data,optimal_turbines,power_curve_file1,power_curve_file2,power_curve_file3):
-    
     """
-    This function takes the ERA5 reanalysis data, loads it and applied a 
-    country mask (ready for conversion to energy) it then returns
-    the array (of original size) with all irrelvelant gridpoints 
-    set to zeros.
 
-    You will need the shpreader.natural_earth data downloaded 
-    to find the shapefiles.
+    if np.ma.is_masked(wind_speed_data):
+        wind_speed_data = np.ma.filled(wind_speed_data,np.nan)
+    else:
+        wind_speed_data = np.ma.getdata(wind_speed_data)
+    bin_edges = power_curve_table.wind_speeds
+    n_bins = len(bin_edges) - 1
+
+    bin_index = np.multiply(wind_speed_data,1./power_curve_table.resolution)
+    # fmin rather than clip so that NaNs go in the last bin
+    np.fmin(bin_index,n_bins-1,out=bin_index)
+    np.maximum(bin_index,0,out=bin_index)
+    bin_index = bin_index.astype(np.intp)
+
+    # correct the bins of speeds that sit right on a bin edge
+    bin_index -= (wind_speed_data < bin_edges[bin_index]) & (bin_index > 0)
+    bin_index += ((wind_speed_data >= bin_edges[bin_index+1]) &
+                  (bin_index < n_bins-1))
+
+    return(bin_index)
+
+
+
+@profiling.profiled
+def power_curve_lookup(wind_speed_data,power_curve_table,dtype=None):
+
+    """
+    This function converts wind speeds to capacity factor with a
+    PowerCurveTable. The results are identical to the np.digitize method
+    used previously, without the binary search. Missing (NaN) speeds get
+    the capacity factor of the last bin, as they did with np.digitize, and
+    masked speeds are masked in the result.
 
     Args:
 
-        wind_speed_data (array): 100m wind speed data, dimensions 
-            [time,lat,lon].
+        wind_speed_data (array): wind speeds of any shape.
 
-        optimal_turbines (str): The filename of a .nc file
-            containing the optimal class of wind turbine to install in each 
-            ERA5 gridbox.
+        power_curve_table (PowerCurveTable): from make_power_curve_table.
 
-        power_curve_file1 (str): The filename of a .csv file
-            containing the wind speeds (column 0) and capacity factors 
-            (column 2) of the class 1 wind turbine
- 
-       power_curve_file2 (str): The filename of a .csv file
-            containing the wind speeds (column 0) and capacity factors 
-            (column 2) of the class 2 wind turbine
+        dtype (numpy dtype): The precision of the capacity factors. By
+            default they are the float64 values of the table, identical to
+            np.digitize. np.float32 halves the memory needed, with the
+            values rounded to float32.
+
+    Returns:
+
+        wind_power_cf (array): capacity factors, the same shape as
+            wind_speed_data.
+
+    """
+
+    bin_index = power_curve_bin_index(wind_speed_data,power_curve_table)
+    capacity_factors = power_curve_table.capacity_factors
+    if dtype is not None:
+        capacity_factors = capacity_factors.astype(dtype,copy=False)
+    wind_power_cf = capacity_factors[bin_index]
+    if np.ma.is_masked(wind_speed_data):
+        wind_power_cf = np.ma.masked_array(wind_power_cf,
+                                           mask=np.ma.getmaskarray(wind_speed_data))
+    return(wind_power_cf)
+
+
+
+@profiling.profiled
+def convert_to_windpower(wind_speed_data,power_curve_file,resolution=0.1,
+                         dtype=None):
+
+    """
+    This function converts gridded wind speeds to capacity factor with one
+    wind turbine's power curve, interpolated onto bins of width resolution,
+    in every gridbox.
+
+    Args:
 
-       power_curve_file3 (str): The filename of a .csv file
+        wind_speed_data (array): 100m wind speed data, dimensions
+            [time,lat,lon] or [member,time,lat,lon].
+
+        power_curve_file (str): The filename of a .csv file
             containing the wind speeds (column 0) and capacity factors 
-            (column 2) of the class 3 wind turbine
+            (column 2) of the chosen wind turbine. The name of a registered
+            curve (e.g. 'Enercon_E70') or a PowerCurve can be given instead.
+
+        resolution (float): The width of the wind speed bins the power
+            curve is interpolated onto (m/s).
+
+        dtype (numpy dtype): The precision of the capacity factors, default
+            float64 (see power_curve_lookup).
 
     Returns:
 
         wind_power_cf (array): Gridded wind Power capacity factor  
-            data, dimensions [time,lat,lon]. Values vary between 0 and 1.
+            data, the same dimensions as wind_speed_data. Values vary
+            between 0 and 1.
 
     """
 
-    # Load is the class 1 wind turbine
-    pc_w1 = []
-    pc_p1 = []
+    # the power curve, interpolated to fine resolution.
+    power_curve_table = get_power_curve_table(power_curve_file,resolution)
 
-    with open(power_curve_file1) as f:
-        for line in f:
-            columns = line.split()
-            #print columns[0]
-            pc_p1.append(np.float(columns[2]))  
-            pc_w1.append(np.float(columns[0])) 
+    wind_power_cf = power_curve_lookup(wind_speed_data,power_curve_table,dtype)
+    
+    return(wind_power_cf)
 
-    # convert to an array
-    power_curve_w1 = np.array(pc_w1)
-    power_curve_p1 = np.array(pc_p1)
 
-    # Load in the class 2 wind turbine
-    pc_w2 = []
-    pc_p2 = []
 
-    with open(power_curve_file2) as f:
-        for line in f:
-            columns = line.split()
-            #print columns[0]
-            pc_p2.append(np.float(columns[2]))  
-            pc_w2.append(np.float(columns[0]))  
 
-    # convert to an array
-    power_curve_w2 = np.array(pc_w2)
-    power_curve_p2 = np.array(pc_p2)
 
-    # Load in the class 3 wind turbine
-    pc_w3 = []
-    pc_p3 = []
 
-    with open(power_curve_file3) as f:
-        for line in f:
-            columns = line.split()
-            #print columns[0]
-            pc_p3.append(np.float(columns[2]))  
-            pc_w3.append(np.float(columns[0]))  
+@profiling.profiled
+def load_turbine_class_index(optimal_turbines,n_classes):
 
-    # convert to an array
-    power_curve_w3 = np.array(pc_w3)
-    power_curve_p3 = np.array(pc_p3)
+    """
+    This function loads the optimal turbine class of each gridbox and turns
+    it into a zero-based index into a stack of power curves. Gridboxes with
+    a class outside 1 to n_classes get the index n_classes, which
+    power_curve_lookup_by_class treats as having no turbine (zero output).
 
+    Args:
 
-    #interpolate to fine resolution.
-    pc_winds = np.linspace(0,50,501) # make it finer resolution 
-    pc_power1 = np.interp(pc_winds,power_curve_w1,power_curve_p1)
-    pc_power2 = np.interp(pc_winds,power_curve_w2,power_curve_p2)
-    pc_power3 = np.interp(pc_winds,power_curve_w3,power_curve_p3)
+        optimal_turbines (str): The filename of a .nc file
+            containing the optimal class of wind turbine to install in each
+            ERA5 gridbox ('totals', values 1,2,3...).
+
+        n_classes (int): The number of turbine classes available.
+
+    Returns:
+
+        class_index (array): Dimensions [lat,lon], integer index of the
+            power curve to use in each gridbox.
+
+    """
 
-    # load in the turbine type data.
     turbine_type_data = Dataset(optimal_turbines,mode='r')
-    turbine_totals = turbine_type_data.variables['totals'][:]
+    turbine_totals = np.ma.filled(turbine_type_data.variables['totals'][:],0)
     turbine_type_data.close()
 
-    # predefine an array to story the cf data in
-    len_timeseries = np.shape(wind_speed_data)[0]
-    wind_power_cf = np.zeros(np.shape(wind_speed_data))
-    
-    # calcualte cf at each timetep
-    for i in range(0,len_timeseries):
-        
-        reshaped_speed = wind_speed_data[i,:,:].flatten()
-        totals = turbine_totals.flatten()
-        test = np.digitize(reshaped_speed,pc_winds,right=False) # indexing starts       #from 1 so needs -1: 0 in the next bit to start from the lowest bin.
-        test[test ==len(pc_winds)] = 500 # make sure the bins don't go off the 
-        #end (power is zero by then anyway)
-
-        wind_power_class1 = 0.5*(pc_power1[test-1]+pc_power1[test])
-        wind_power_class2 = 0.5*(pc_power2[test-1]+pc_power2[test])
-        wind_power_class3 = 0.5*(pc_power3[test-1]+pc_power3[test])
-
-        # put as zero at gridpoints where we shouldnt be using this class.
-        wind_power_class1[totals ==2]=0
-        wind_power_class1[totals ==3]=0
-
-        wind_power_class2[totals ==1]=0
-        wind_power_class2[totals ==3]=0
- 
-        wind_power_class3[totals ==1]=0
-        wind_power_class3[totals ==2]=0
-
-        
-        wind_power = wind_power_class1 + wind_power_class2 +  wind_power_class3
-        wind_power_cf[i,:,:] = np.reshape(wind_power,(np.shape(wind_speed_data[i,:,:])))
+    class_index = np.rint(turbine_totals).astype(np.intp) - 1
+    class_index[(class_index < 0) | (class_index >= n_classes)] = n_classes
+
+    return(class_index)
+
+
+
+@profiling.profiled
+def power_curve_lookup_by_class(wind_speed_data,power_curve_tables,class_index,
+                                dtype=None):
+
+    """
+    This function converts wind speeds to capacity factor using the power
+    curve of each gridbox's turbine class. The curves are stacked into one
+    [n_classes+1, n_bins] table (the extra row is all zeros, for gridboxes
+    without a turbine), which is kept for the next call with the same
+    tables, and every gridpoint and timestep is converted with a single
+    gather. Missing speeds are treated as in power_curve_lookup.
+
+    Args:
+
+        wind_speed_data (array): wind speeds, dimensions [...,lat,lon].
+
+        power_curve_tables (list): PowerCurveTables, one per turbine class,
+            all with the same bins.
+
+        class_index (array): Dimensions [lat,lon], which table to use in
+            each gridbox, e.g. from load_turbine_class_index.
+
+        dtype (numpy dtype): The precision of the capacity factors, default
+            float64 (see power_curve_lookup).
+
+    Returns:
+
+        wind_power_cf (array): capacity factors, the same shape as
+            wind_speed_data.
+
+    """
+
+    n_bins = len(power_curve_tables[0].capacity_factors)
+    stacked_cf = _stacked_class_table(power_curve_tables,dtype)
+
+    # index into the flattened stack: row (class) * n_bins + bin
+    flat_index = power_curve_bin_index(wind_speed_data,power_curve_tables[0])
+    flat_index += class_index*n_bins
+    wind_power_cf = stacked_cf[flat_index]
+    if np.ma.is_masked(wind_speed_data):
+        wind_power_cf = np.ma.masked_array(wind_power_cf,
+                                           mask=np.ma.getmaskarray(wind_speed_data))
+
     return(wind_power_cf)
 
 
 
+def _stacked_class_table(power_curve_tables,dtype):
+    # the capacity factors of each class and a row of zeros, flattened to
+    # [(n_classes+1)*n_bins]. Memoized like get_power_curve_table, the
+    # tables are kept with it so a reused id can't give the wrong table
+    key = (tuple(id(power_curve_table) for power_curve_table in power_curve_tables),
+           None if dtype is None else np.dtype(dtype).str)
+    if key in _class_tables and all(
+            cached is power_curve_table for cached, power_curve_table
+            in zip(_class_tables[key][0],power_curve_tables)):
+        return(_class_tables[key][1])
+
+    for power_curve_table in power_curve_tables[1:]:
+        if not np.array_equal(power_curve_table.wind_speeds,
+                              power_curve_tables[0].wind_speeds):
+            raise ValueError('All of the power curves must use the same bins.')
+    n_bins = len(power_curve_tables[0].capacity_factors)
+    stacked_cf = np.concatenate([power_curve_table.capacity_factors
+                                 for power_curve_table in power_curve_tables] +
+                                [np.zeros(n_bins)])
+    if dtype is not None:
+        stacked_cf = stacked_cf.astype(dtype,copy=False)
+    stacked_cf.setflags(write=False)
+    _class_tables[key] = (tuple(power_curve_tables),stacked_cf)
+    return(stacked_cf)
+
+
+@profiling.profiled
+def convert_to_windpower_optimal_turbine(wind_speed_data,optimal_turbines,
+                                         *power_curve_files,resolution=0.1,
+                                         dtype=None):
 
+    """
+    This function converts gridded wind speeds to capacity factor with the
+    optimal class of wind turbine in each gridbox, using one power curve per
+    class (see power_curve_lookup_by_class).
 
-def country_wind_power(gridded_wind_power,wind_turbine_locations):
+    Args:
+
+        wind_speed_data (array): 100m wind speed data, dimensions 
+            [time,lat,lon] or [member,time,lat,lon].
+
+        optimal_turbines (str): The filename of a .nc file
+            containing the optimal class of wind turbine to install in each 
+            ERA5 gridbox.
+
+        power_curve_files (str): The filenames of .csv files
+            containing the wind speeds (column 0) and capacity factors 
+            (column 2) of the class 1, class 2, class 3 ... wind turbines,
+            given in class order. Any number of classes can be used, and
+            registered names or PowerCurves can be given instead of files.
+
+        resolution (float): The width of the wind speed bins the power
+            curves are interpolated onto (m/s).
+
+        dtype (numpy dtype): The precision of the capacity factors, default
+            float64 (see power_curve_lookup).
+
+    Returns:
+
+        wind_power_cf (array): Gridded wind Power capacity factor  
+            data, the same dimensions as wind_speed_data. Values vary
+            between 0 and 1.
+            Gridboxes whose class has no power curve are set to zero.
 
     """
-    This function takes the ERA5 reanalysis data, loads it and applied a 
-    country mask (ready for conversion to energy) it then returns
-    the array (of original size) with all irrelvelant gridpoints 
-    set to zeros.
 
-    You will need the shpreader.natural_earth data downloaded 
-    to find the shapefiles.
+    # the wind turbine of each class, interpolated to fine resolution.
+    power_curve_tables = [get_power_curve_table(power_curve_file,resolution)
+                          for power_curve_file in power_curve_files]
+
+    # load in the turbine type data.
+    class_index = load_turbine_class_index(optimal_turbines,
+                                           len(power_curve_tables))
+
+    # calcualte cf at every timestep and gridpoint at once
+    wind_power_cf = power_curve_lookup_by_class(wind_speed_data,
+                                                power_curve_tables,class_index,
+                                                dtype)
+    return(wind_power_cf)
+
+
+
+
+
+@profiling.profiled
+def country_wind_power(gridded_wind_power,wind_turbine_locations):
+
+    """
+    This function takes the capacity-weighted mean of gridded wind power
+    capacity factors over the gridboxes with installed capacity, giving the
+    national capacity factor time series.
 
     Args:
 
         gridded_wind_power (array): wind power capacity factor data, dimensions 
-            [time,lat,lon]. Capacity factors range between 0 and 1.
+            [time,lat,lon] or [member,time,lat,lon]. Capacity factors range
+            between 0 and 1.
 
         wind turbine locations (str): The filename of a .nc file
-            containing the wind speeds (column 0) and capacity factors 
-            (column 2) of the chosen wind turbine.
+            containing the installed capacity in each reanalysis gridbox,
+            or the AggregationWeights already loaded from it with
+            aggregation.load_capacity_weights.
 
     Returns:
 
-        wind_power_country_cf (array): Time series of wind Power capacity factor              data, weighted by the installed capacity in each reanalysis
-            gridbox from thewindpower.net database. dimensions [time]. 
-            Values vary between 0 and 1.
+        wind_power_country_cf (array): Time series of wind Power capacity
+            factor, weighted by the installed capacity in each reanalysis
+            gridbox from thewindpower.net database, dimensions [time] (or
+            [member,time]). Values vary between 0 and 1.
 
     """
 
     # first load in the installed capacity data.
+    if isinstance(wind_turbine_locations,aggregation.AggregationWeights):
+        capacity_weights = wind_turbine_locations
+    else:
+        capacity_weights = aggregation.load_capacity_weights(wind_turbine_locations)
 
- 
-    dataset_1 = Dataset(wind_turbine_locations,mode='r')
-    total_MW = dataset_1.variables['totals'][:]
-    dataset_1.close()
+    # capacity-weighted mean over the gridpoints with turbines in them
+    wind_power_country_cf = aggregation.aggregate_gridded_data(gridded_wind_power,
+                                                               capacity_weights)
 
-    len_timeseries = np.shape(gridded_wind_power)[0]
+    return(wind_power_country_cf)
 
-    wind_power_country_cf = np.zeros(len_timeseries)
 
-    for i in range(0,len_timeseries):
-        wind_power_weighted = gridded_wind_power[i,:,:]*total_MW
-        wind_power_country_cf[i] = np.sum(wind_power_weighted)/np.sum(total_MW)
 
-    
+
+def _power_curve_list(power_curves):
+    # one power curve (a filename, name or PowerCurve) or a sequence of them
+    if isinstance(power_curves,(str,PowerCurve)):
+        return([power_curves])
+    return(list(power_curves))
+
+
+def iter_country_wind_power(wind_speed_chunks,bias_correction_file,
+                            wind_turbine_locations,power_curve_files,
+                            optimal_turbines=None):
+
+    """
+    This function runs the wind power chain (bias correction, conversion to
+    capacity factor and national aggregation) on a stream of wind speed
+    chunks, yielding the national capacity factor for each chunk. Only one
+    chunk of gridded data is held in memory at a time.
+
+    Args:
+
+        wind_speed_chunks (iterable): Chunks of 100m wind speed data,
+            dimensions [time,lat,lon] or [member,time,lat,lon], e.g. from
+            iter_100mwindspeed_data.
+
+        bias_correction_file (str): The filename of a .npy file
+            containing the mean Bias correction factors on this grid.
+
+        wind_turbine_locations (str): The filename of a .nc file
+            containing the installed capacity in each reanalysis gridbox.
+
+        power_curve_files (str or list): The filename of a .csv file
+            containing the wind speeds (column 0) and capacity factors
+            (column 2) of the wind turbine, or with optimal_turbines a list
+            of them for the class 1, class 2, class 3 ... turbines in class
+            order. Registered names or PowerCurves can be given instead of
+            files.
+
+        optimal_turbines (str): If given, the filename of a .nc file
+            containing the optimal class of wind turbine to install in each
+            ERA5 gridbox (see convert_to_windpower_optimal_turbine).
+
+    Yields:
+
+        wind_power_country_cf (array): Time series of wind Power capacity
+            factor for each chunk, dimensions [time] or [member,time].
+
+    """
+
+    power_curve_files = _power_curve_list(power_curve_files)
+    if optimal_turbines is None and len(power_curve_files) != 1:
+        raise ValueError('Several power curves need optimal_turbines to say '
+                         'which to use in each gridbox.')
+
+    # load the installed capacity once rather than for every chunk
+    capacity_weights = aggregation.load_capacity_weights(wind_turbine_locations)
+
+    for wind_speed_data in wind_speed_chunks:
+        # the chunk isn't used again so correct it in place
+        BC_wind_speed_data = meanBC_wind_speed_data(wind_speed_data,
+                                                    bias_correction_file,
+                                                    out=np.ma.getdata(wind_speed_data))
+        if optimal_turbines is None:
+            wind_power_cf = convert_to_windpower(BC_wind_speed_data,
+                                                 power_curve_files[0],
+                                                 dtype=BC_wind_speed_data.dtype)
+        else:
+            wind_power_cf = convert_to_windpower_optimal_turbine(
+                BC_wind_speed_data,optimal_turbines,*power_curve_files,
+                dtype=BC_wind_speed_data.dtype)
+        yield country_wind_power(wind_power_cf,capacity_weights)
+
+
+
+
+@profiling.profiled
+def country_wind_power_streaming(data_dir,filenames,bias_correction_file,
+                                 wind_turbine_locations,power_curve_files,
+                                 optimal_turbines=None,chunk_size=168,
+                                 dtype=np.float64,members_per_chunk=None):
+
+    """
+    This function makes the national wind power capacity factor time series
+    for a long record (e.g. 40 years of monthly ERA5 files) by streaming the
+    files through the wind power chain in chunks of chunk_size timesteps.
+    Peak memory depends on the chunk size, not on the length of the record,
+    as only the national time series is kept. For ensembles, all of the
+    members are streamed together, or members_per_chunk at a time.
+
+    Args:
+
+        data_dir (str): The path where the data is stored.
+            e.g '/home/users/zd907959/'
+
+        filenames (list): The filenames of the .netcdf files in time order
+            e.g. ['ERA5_1979_01.nc','ERA5_1979_02.nc']
+
+        bias_correction_file (str): The filename of a .npy file
+            containing the mean Bias correction factors on this grid.
+
+        wind_turbine_locations (str): The filename of a .nc file
+            containing the installed capacity in each reanalysis gridbox.
+
+        power_curve_files (str or list): The wind turbine, or with
+            optimal_turbines one per class in class order, as for
+            iter_country_wind_power.
+
+        optimal_turbines (str): If given, the filename of a .nc file
+            containing the optimal class of wind turbine to install in each
+            ERA5 gridbox.
+
+        chunk_size (int): The number of timesteps processed at once.
+
+        dtype (numpy dtype): The precision of the gridded data, np.float32
+            halves the memory needed for each chunk.
+
+        members_per_chunk (int): For ensembles, the number of members
+            processed at once, default all of them. Each chunk of the
+            gridded data is [members_per_chunk,chunk_size,lat,lon].
+
+    Returns:
+
+        wind_power_country_cf (array): Time series of wind Power capacity
+            factor, dimensions [time] or [member,time]. Values vary between
+            0 and 1.
+
+    """
+
+    if isinstance(filenames,str):
+        filenames = [filenames]
+
+    if len(filenames) == 0:
+        return(np.zeros(0))
+
+    n_members = era5_io.era5_member_count(data_dir + filenames[0],'u100')
+    if n_members is None or members_per_chunk is None:
+        member_chunks = [slice(None)]
+    else:
+        member_chunks = era5_io.member_slices(n_members,members_per_chunk)
+
+    def wind_speed_chunks(member_slice):
+        for filename in filenames:
+            for wind_speed_data in iter_100mwindspeed_data(data_dir,filename,
+                                                           chunk_size,dtype,
+                                                           member_slice):
+                yield wind_speed_data
+
+    member_country_cf = []
+    for member_slice in member_chunks:
+        country_cf_chunks = list(iter_country_wind_power(
+            wind_speed_chunks(member_slice),bias_correction_file,
+            wind_turbine_locations,power_curve_files,optimal_turbines))
+        # the chunks follow each other in time, the last dimension
+        member_country_cf.append(np.concatenate(country_cf_chunks,axis=-1))
+
+    wind_power_country_cf = np.concatenate(member_country_cf,axis=0)
     return(wind_power_country_cf)
 
 
 
+@profiling.profiled
+def empty_wind_speed_histogram(shape=(),resolution=0.1,max_speed=50.):
+
+    """
+    Returns a WindSpeedHistogram with no counts, on the same bins as
+    make_power_curve_table. shape is () for a national histogram,
+    (n_classes+1,) for one split by turbine class or (lat,lon) for one per
+    gridpoint.
+    """
+
+    n_bins = int(round(max_speed/resolution))
+    wind_speeds = np.linspace(0,max_speed,n_bins+1)
+    histogram = WindSpeedHistogram(np.zeros(tuple(shape) + (n_bins,)),
+                                   wind_speeds,resolution)
+    return(histogram)
+
+
+@profiling.profiled
+def add_to_wind_speed_histogram(histogram,wind_speed_data,
+                                wind_turbine_locations=None,class_index=None):
+
+    """
+    This function adds wind speeds (e.g. one chunk of the record) to a
+    WindSpeedHistogram, in place. Every timestep (and ensemble member) is
+    pooled. Missing (NaN or masked) wind speeds are left out.
+
+    Args:
+
+        histogram (WindSpeedHistogram): from empty_wind_speed_histogram,
+            with shape (lat,lon) if wind_turbine_locations isn't given.
+
+        wind_speed_data (array): 100m wind speed data (usually bias
+            corrected), dimensions [time,lat,lon] or [member,time,lat,lon].
+
+        wind_turbine_locations (str): If given, the filename of a .nc file
+            containing the installed capacity in each reanalysis gridbox (or
+            the AggregationWeights loaded from it), to add to a
+            capacity-weighted national histogram. Otherwise each gridpoint
+            has its own histogram.
+
+        class_index (array): With wind_turbine_locations, the turbine class
+            of each gridbox (dimensions [lat,lon], see
+            load_turbine_class_index), to split the national histogram by
+            class. The histogram needs shape (class_index.max()+1,).
+
+    Returns:
+
+        histogram (WindSpeedHistogram): The same histogram, updated.
+
+    """
+
+    counts = histogram.counts
+    n_bins = counts.shape[-1]
+    if np.ma.is_masked(wind_speed_data):
+        wind_speed_data = np.ma.filled(wind_speed_data,np.nan)
+
+    if wind_turbine_locations is None:
+        gridpoint_data = np.ma.getdata(wind_speed_data)
+        lead_shape = np.shape(gridpoint_data)[:-2]
+        gridpoint_data = np.reshape(gridpoint_data,lead_shape + (-1,))
+        # each gridpoint has its own run of bins
+        offsets = np.arange(gridpoint_data.shape[-1])*n_bins
+        weights = None
+    else:
+        if isinstance(wind_turbine_locations,aggregation.AggregationWeights):
+            capacity_weights = wind_turbine_locations
+        else:
+            capacity_weights = aggregation.load_capacity_weights(wind_turbine_locations)
+        gridpoint_data = aggregation.gather_gridpoints(wind_speed_data,
+                                                       capacity_weights.index,
+                                                       capacity_weights.shape)
+        if class_index is None:
+            offsets = 0
+        else:
+            offsets = np.ravel(class_index)[capacity_weights.index]*n_bins
+        weights = capacity_weights.weights
+
+    offsets = np.broadcast_to(offsets,np.shape(gridpoint_data))
+    if weights is not None:
+        weights = np.broadcast_to(weights,np.shape(gridpoint_data))
+    finite = np.isfinite(gridpoint_data)
+    if not np.all(finite):
+        gridpoint_data = gridpoint_data[finite]
+        offsets = offsets[finite]
+        if weights is not None:
+            weights = weights[finite]
+
+    flat_index = power_curve_bin_index(gridpoint_data,histogram).ravel()
+    flat_index += offsets.ravel()
+    if weights is not None:
+        weights = weights.ravel()
+
+    if np.max(flat_index,initial=0) >= counts.size:
+        raise ValueError('The histogram has shape ' + str(counts.shape) +
+                         ', too small for this data.')
+    counts += np.bincount(flat_index,weights,
+                          minlength=counts.size).reshape(counts.shape)
+
+    return(histogram)
+
+
+@profiling.profiled
+def wind_speed_histogram_streaming(data_dir,filenames,bias_correction_file,
+                                   wind_turbine_locations=None,
+                                   optimal_turbines=None,n_classes=3,
+                                   chunk_size=168,dtype=np.float32,
+                                   resolution=0.1):
+
+    """
+    This function streams a long record of ERA5 files, a chunk of timesteps
+    at a time, into a histogram of bias-corrected 100m wind speeds (see
+    WindSpeedHistogram). The mean capacity factor and its distribution can
+    then be worked out for any turbine from the histogram alone (see
+    histogram_capacity_factor, histogram_cf_percentiles and
+    histogram_cf_duration_curve), without converting the gridded data to
+    capacity factor.
+
+    Args:
+
+        data_dir (str): The path where the data is stored.
+            e.g '/home/users/zd907959/'
+
+        filenames (list): The filenames of the .netcdf files
+            e.g. ['ERA5_1979_01.nc','ERA5_1979_02.nc']
+
+        bias_correction_file (str): The filename of a .npy file
+            containing the mean Bias correction factors on this grid.
+
+        wind_turbine_locations (str): If given, the filename of a .nc file
+            containing the installed capacity in each reanalysis gridbox,
+            for a capacity-weighted national histogram. Otherwise there is
+            one histogram per gridpoint, dimensions [lat,lon,n_bins].
+
+        optimal_turbines (str): With wind_turbine_locations, the filename
+            of a .nc file containing the optimal class of wind turbine in
+            each ERA5 gridbox, to split the national histogram by class.
+
+        n_classes (int): The number of turbine classes, gridboxes of any
+            other class go in an extra row (no turbine).
+
+        chunk_size (int): The number of timesteps processed at once.
+
+        dtype (numpy dtype): The precision of the gridded data.
+
+        resolution (float): The width of the wind speed bins (m/s), the
+            same as the power curves will be used at.
+
+    Returns:
+
+        histogram (WindSpeedHistogram): The histogram of the whole record.
+
+    """
+
+    if isinstance(filenames,str):
+        filenames = [filenames]
+
+    class_index = None
+    if wind_turbine_locations is not None:
+        wind_turbine_locations = aggregation.load_capacity_weights(wind_turbine_locations)
+        shape = ()
+        if optimal_turbines is not None:
+            class_index = load_turbine_class_index(optimal_turbines,n_classes)
+            shape = (n_classes+1,)
+    else:
+        lons, lats = era5_io.load_era5_grid(data_dir + filenames[0])
+        shape = (len(lats),len(lons))
+    histogram = empty_wind_speed_histogram(shape,resolution)
+
+    for filename in filenames:
+        for wind_speed_data in iter_100mwindspeed_data(data_dir,filename,
+                                                       chunk_size,dtype):
+            meanBC_wind_speed_data(wind_speed_data,bias_correction_file,
+                                   out=wind_speed_data)
+            add_to_wind_speed_histogram(histogram,wind_speed_data,
+                                        wind_turbine_locations,class_index)
+
+    return(histogram)
+
+
+def _histogram_capacity_factors(histogram,power_curves):
+    # the capacity factor of each bin of the histogram, [n_bins], or
+    # [n_classes+1,n_bins] with one power curve per class (zero for classes
+    # without one, as in power_curve_lookup_by_class)
+    if len(power_curves) == 0:
+        raise ValueError('At least one power curve is needed.')
+    power_curve_tables = [get_power_curve_table(power_curve,
+                                                histogram.resolution)
+                          for power_curve in power_curves]
+    for power_curve_table in power_curve_tables:
+        if not np.array_equal(power_curve_table.wind_speeds,
+                              histogram.wind_speeds):
+            raise ValueError('The power curves must use the same bins as the '
+                             'histogram.')
+
+    if histogram.counts.ndim != 2:
+        if len(power_curve_tables) > 1:
+            raise ValueError('Several power curves need a histogram split by '
+                             'turbine class.')
+        return(power_curve_tables[0].capacity_factors)
+
+    capacity_factors = np.zeros(histogram.counts.shape)
+    n_curves = min(len(power_curve_tables),histogram.counts.shape[0])
+    for i in range(0,n_curves):
+        capacity_factors[i] = power_curve_tables[i].capacity_factors
+    return(capacity_factors)
+
+
+def _cf_distribution(histogram,power_curves):
+    # the distinct capacity factors, in ascending order, and the counts of
+    # each, dimensions [...,n_values]
+    capacity_factors = _histogram_capacity_factors(histogram,power_curves)
+    counts = histogram.counts
+    if counts.ndim == 2:
+        # pool the turbine classes
+        capacity_factors = capacity_factors.ravel()
+        counts = counts.ravel()
+    values, inverse = np.unique(capacity_factors,return_inverse=True)
+    # sum the bins with the same capacity factor with a [n_bins,n_values]
+    # matrix, so per-gridpoint histograms are done in one product
+    combine = np.zeros((len(capacity_factors),len(values)))
+    combine[np.arange(len(capacity_factors)),inverse.ravel()] = 1.
+    return(values,counts @ combine)
+
+
+@profiling.profiled
+def histogram_capacity_factor(histogram,*power_curves):
+
+    """
+    This function works out the mean capacity factor over a
+    WindSpeedHistogram, the same as the mean over time of the capacity
+    factor from convert_to_windpower (and country_wind_power for national
+    histograms), but in O(bins) operations.
+
+    Args:
+
+        histogram (WindSpeedHistogram): e.g. from
+            wind_speed_histogram_streaming.
+
+        power_curves (str): One power curve (a .csv filename, registered
+            name or PowerCurve), or for a histogram split by turbine class
+            one per class in class order.
+
+    Returns:
+
+        mean_cf (float or array): The mean capacity factor, dimensions
+            [lat,lon] for per-gridpoint histograms (NaN where there are no
+            counts).
+
+    """
+
+    capacity_factors = _histogram_capacity_factors(histogram,power_curves)
+    counts = histogram.counts
+    if counts.ndim == 2:
+        return(np.sum(counts*capacity_factors)/np.sum(counts))
+
+    total = np.sum(counts,axis=-1)
+    mean_cf = np.divide(counts @ capacity_factors,total,
+                        out=np.full(np.shape(total),np.nan),where=total > 0)
+    if np.ndim(mean_cf) == 0:
+        return(float(mean_cf))
+    return(mean_cf)
+
+
+@profiling.profiled
+def histogram_cf_percentiles(histogram,percentiles,*power_curves):
+
+    """
+    This function works out percentiles of the capacity factor from a
+    WindSpeedHistogram in O(bins) operations. They are the same as
+    np.percentile(..., method='inverted_cdf') of the gridded capacity
+    factors from convert_to_windpower.
+
+    For a capacity-weighted national histogram these are percentiles of
+    the pooled distribution of gridpoint-hour capacity factors, weighted by
+    capacity, not of the national capacity factor time series. The
+    national series is a mean over gridpoints at each hour, so it varies
+    less and its percentiles are less extreme. The mean is the same either
+    way.
+
+    Args:
+
+        histogram (WindSpeedHistogram): e.g. from
+            wind_speed_histogram_streaming.
+
+        percentiles (float or array): Between 0 and 100.
+
+        power_curves (str): As for histogram_capacity_factor.
+
+    Returns:
+
+        cf_percentiles (float or array): Dimensions [percentile], or
+            [percentile,lat,lon] for per-gridpoint histograms, as
+            np.percentile.
+
+    """
+
+    values, counts = _cf_distribution(histogram,power_curves)
+    cumulative = np.cumsum(counts,axis=-1)
+    total = cumulative[...,-1:]
+
+    cf_percentiles = []
+    for percentile in np.atleast_1d(percentiles):
+        # the first value whose cumulative count reaches the percentile
+        target = np.maximum(percentile/100.*total,np.finfo(np.float64).tiny)
+        index = np.argmax(cumulative >= target,axis=-1)
+        # NaN for empty histograms, which have no percentiles
+        cf_percentile = np.where(total[...,0] > 0,values[index],np.nan)
+        cf_percentiles.append(cf_percentile)
+    cf_percentiles = np.array(cf_percentiles)
+
+    if np.ndim(percentiles) == 0:
+        return(cf_percentiles[0])
+    return(cf_percentiles)
+
+
+@profiling.profiled
+def histogram_cf_duration_curve(histogram,*power_curves):
+
+    """
+    This function gives the capacity factor duration curve of a
+    WindSpeedHistogram: the fraction of the time the capacity factor is at
+    or above each value. As with histogram_cf_percentiles, for a
+    capacity-weighted national histogram this is the duration curve of the
+    pooled gridpoint-hours, weighted by capacity, not of the national time
+    series.
+
+    Args:
+
+        histogram (WindSpeedHistogram): e.g. from
+            wind_speed_histogram_streaming.
+
+        power_curves (str): As for histogram_capacity_factor.
+
+    Returns:
+
+        capacity_factors (array): The capacity factors the turbines can
+            produce, in descending order.
+
+        exceedance (array): The fraction of the time at or above each
+            capacity factor, dimensions [n_values] or [lat,lon,n_values]
+            for per-gridpoint histograms.
+
+    """
 
+    values, counts = _cf_distribution(histogram,power_curves)
+    total = np.sum(counts,axis=-1,keepdims=True)
+    # count from the top down
+    at_or_above = np.cumsum(counts[...,::-1],axis=-1)
+    exceedance = np.divide(at_or_above,total,
+                           out=np.full(at_or_above.shape,np.nan),
+                           where=total > 0)
+    return(values[::-1],exceedance)
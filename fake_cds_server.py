@@ -0,0 +1,140 @@
+#
+#
+# A local stand-in for the Climate Data Store, for testing
+# energy_model_functions_download.py offline, e.g.
+#
+#   python fake_cds_server.py --port 8765 --failure-rate 0.2 &
+#   python energy_model_functions_download.py 2019 2020 \
+#       --url http://localhost:8765 --backoff 0.1 --output-dir /tmp/ERA5
+#
+# Each POST to /retrieve with {'dataset': ..., 'request': ...} returns a
+# small synthetic ERA5-like netCDF file with the requested days and hours,
+# on a coarse grid over the requested area. A fraction of requests fail,
+# and the server can be made slow, to exercise retries and concurrency.
+#
+import argparse
+import datetime
+import http.server
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from netCDF4 import Dataset, date2num
+
+import energy_model_functions_download as download
+
+
+ERA5_KEYS = {'100m_u_component_of_wind': 'u100',
+             '100m_v_component_of_wind': 'v100',
+             '2m_temperature': 't2m',
+             'surface_solar_radiation_downwards': 'ssrd'}
+
+
+def make_fake_era5_file(request,target,n_lat=10,n_lon=12):
+
+    """
+    Writes a synthetic ERA5 file for a CDS request (see
+    energy_model_functions_download.era5_month_request) to target. The
+    variables are packed as int16, as in the real files.
+    """
+
+    north, west, south, east = request['area']
+    times = [datetime.datetime(int(year),int(month),int(day),int(hour[:2]))
+             for year in request['year'] for month in request['month']
+             for day in request['day'] for hour in request['time']]
+
+    dataset = Dataset(target,mode='w')
+    dataset.createDimension('longitude',n_lon)
+    dataset.createDimension('latitude',n_lat)
+    dataset.createDimension('time',None)
+    longitude = dataset.createVariable('longitude','f4',('longitude',))
+    longitude[:] = np.linspace(west,east,n_lon)
+    latitude = dataset.createVariable('latitude','f4',('latitude',))
+    latitude[:] = np.linspace(north,south,n_lat)
+    time_variable = dataset.createVariable('time','i4',('time',))
+    time_variable.units = 'hours since 1900-01-01 00:00:00.0'
+    time_variable.calendar = 'gregorian'
+    time_variable[:] = date2num(times,time_variable.units,time_variable.calendar)
+
+    rng = np.random.default_rng(len(times))
+    for variable in request['variable']:
+        nc_key = ERA5_KEYS.get(variable,variable)
+        base, scale = {'t2m': (280.,8.),'ssrd': (3e5,3e5)}.get(nc_key,(0.,5.))
+        data_variable = dataset.createVariable(nc_key,'i2',
+                                               ('time','latitude','longitude'),
+                                               fill_value=-32767)
+        data_variable.scale_factor = 4*scale/65000.
+        data_variable.add_offset = base
+        values = scale*rng.standard_normal((len(times),n_lat,n_lon)).clip(-1.9,1.9)
+        if nc_key == 'ssrd':
+            values = np.abs(values)
+        data_variable[:] = base + values
+    dataset.close()
+
+
+class FakeCDSHandler(http.server.BaseHTTPRequestHandler):
+
+    failure_rate = 0.
+    delay = 0.
+
+    def do_POST(self):
+        if self.path != '/retrieve':
+            self.send_error(404)
+            return
+        length = int(self.headers['Content-Length'])
+        body = json.loads(self.rfile.read(length))
+        time.sleep(self.delay)
+        if random.random() < self.failure_rate:
+            self.send_error(503,'Fake failure')
+            return
+
+        handle, target = tempfile.mkstemp(suffix='.nc')
+        os.close(handle)
+        try:
+            # the netCDF library isn't thread safe, share the download
+            # manager's lock so the server can run in the same process
+            with download._netcdf_lock:
+                make_fake_era5_file(body['request'],target)
+            with open(target,'rb') as f:
+                data = f.read()
+        finally:
+            os.remove(target)
+        self.send_response(200)
+        self.send_header('Content-Type','application/x-netcdf')
+        self.send_header('Content-Length',str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self,format,*args):
+        pass
+
+
+def make_server(port=8765,failure_rate=0.,delay=0.):
+
+    """
+    Returns a fake CDS server on localhost:port (port 0 picks a free port,
+    see server.server_address). Run it with server.serve_forever(), e.g. in
+    a thread.
+    """
+
+    handler = type('Handler',(FakeCDSHandler,),{'failure_rate': failure_rate,
+                                                'delay': delay})
+    server = http.server.ThreadingHTTPServer(('localhost',port),handler)
+    return(server)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='A local fake CDS server.')
+    parser.add_argument('--port',type=int,default=8765)
+    parser.add_argument('--failure-rate',type=float,default=0.)
+    parser.add_argument('--delay',type=float,default=0.,
+                        help='seconds to wait before answering each request')
+    args = parser.parse_args()
+
+    server = make_server(args.port,args.failure_rate,args.delay)
+    print('Fake CDS server on http://localhost:' + str(server.server_address[1]))
+    server.serve_forever()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the energy_model_functions_* modules live in the top level of the repo
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
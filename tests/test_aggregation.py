@@ -0,0 +1,60 @@
+import numpy as np
+
+import energy_model_functions_aggregation as aggregation
+
+
+def _masked_field():
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(280.,5.,size=(24,6,8))
+    mask = rng.random(size=data.shape) < 0.2
+    # the raw values under the mask are fill values, they must not leak in
+    data[mask] = -32767.
+    return(np.ma.masked_array(data,mask=mask))
+
+
+def _weight_field():
+
+    weight_field = np.zeros((6,8))
+    weight_field[1:5,2:7] = 1.
+    weight_field[2,3] = 3.
+    return(weight_field)
+
+
+def _baseline_mean(gridded_data,weight_field):
+
+    # the original models took np.average of each timestep
+    return(np.array([np.average(gridded_data[i],weights=weight_field)
+                     for i in range(len(gridded_data))]))
+
+
+def test_aggregate_masked_data_matches_baseline():
+
+    gridded_data = _masked_field()
+    weight_field = _weight_field()
+    weights = aggregation.make_aggregation_weights(weight_field)
+    aggregated = aggregation.aggregate_gridded_data(gridded_data,weights)
+    assert np.allclose(aggregated,_baseline_mean(gridded_data,weight_field))
+
+
+def test_aggregate_multi_masked_data_matches_baseline():
+
+    gridded_data = _masked_field()
+    weight_fields = [_weight_field(),np.ones((6,8))]
+    weight_matrix = aggregation.make_weight_matrix(weight_fields)
+    aggregated = aggregation.aggregate_gridded_data_multi(gridded_data,
+                                                          weight_matrix)
+    for i, weight_field in enumerate(weight_fields):
+        assert np.allclose(aggregated[:,i],
+                           _baseline_mean(gridded_data,weight_field))
+
+
+def test_gather_gridpoints_keeps_mask():
+
+    gridded_data = _masked_field()
+    weights = aggregation.make_aggregation_weights(_weight_field())
+    gridpoint_data = aggregation.gather_gridpoints(gridded_data,weights.index,
+                                                   weights.shape)
+    flat_mask = np.reshape(np.ma.getmaskarray(gridded_data),(24,-1))
+    assert np.array_equal(np.ma.getmaskarray(gridpoint_data),
+                          flat_mask[:,weights.index])
@@ -0,0 +1,32 @@
+import numpy as np
+
+import energy_model_functions_country_masks as country_masks
+
+
+def test_shapefile_version_includes_dbf(tmp_path):
+
+    countries_shp = tmp_path / 'countries.shp'
+    countries_shp.write_bytes(b'geometries')
+    (tmp_path / 'countries.dbf').write_bytes(b'France')
+    version = country_masks.shapefile_version(str(countries_shp))
+    (tmp_path / 'countries.dbf').write_bytes(b'Francia')
+    assert country_masks.shapefile_version(str(countries_shp)) != version
+
+
+def test_natural_earth_version_found_once(tmp_path,monkeypatch):
+
+    countries_shp = tmp_path / 'countries.shp'
+    countries_shp.write_bytes(b'geometries')
+    calls = []
+
+    def natural_earth_shapefile():
+        calls.append(1)
+        return(str(countries_shp))
+
+    monkeypatch.setattr(country_masks,'natural_earth_shapefile',
+                        natural_earth_shapefile)
+    monkeypatch.setattr(country_masks,'_natural_earth_version',None)
+    lons, lats = np.arange(5.), np.arange(4.)
+    keys = [country_masks.mask_cache_key('France',lons,lats) for i in range(3)]
+    assert len(set(keys)) == 1
+    assert len(calls) == 1
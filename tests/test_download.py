@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+import energy_model_functions_download as download
+import energy_model_functions_manifest as manifest
+
+
+def _retrieve(dataset,request,target):
+    # writes a month with the right number of hours, as the CDS would
+    with Dataset(target,mode='w') as nc:
+        nc.createDimension('time',24*len(request['day']))
+        nc.createVariable('time','i4',('time',))[:] = np.arange(
+            24*len(request['day']))
+
+
+def _count_checksums(monkeypatch):
+    checksums = []
+    file_checksum = manifest.file_checksum
+
+    def counted_file_checksum(file_str):
+        checksums.append(file_str)
+        return(file_checksum(file_str))
+
+    monkeypatch.setattr(manifest,'file_checksum',counted_file_checksum)
+    return(checksums)
+
+
+def test_downloaded_months_are_only_checksummed_if_changed(tmp_path,
+                                                            monkeypatch):
+
+    output_dir = str(tmp_path)
+    months = [(2020,1),(2020,2)]
+    assert len(download.download_era5_months(months,output_dir,_retrieve)) == 2
+
+    checksums = _count_checksums(monkeypatch)
+    assert download.download_era5_months(months,output_dir,_retrieve) == []
+    assert checksums == []
+
+    # touched but unchanged: checksummed once, then trusted again
+    target = os.path.join(output_dir,download.ERA5_FILENAME.format(year=2020,
+                                                                   month=1))
+    os.utime(target,ns=(0,0))
+    assert download.download_era5_months(months,output_dir,_retrieve) == []
+    assert checksums == [target]
+    assert download.download_era5_months(months,output_dir,_retrieve) == []
+    assert checksums == [target]
+
+    assert download.download_era5_months(months,output_dir,_retrieve,
+                                         verify=True) == []
+    assert len(checksums) == 3
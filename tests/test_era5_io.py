@@ -0,0 +1,62 @@
+import numpy as np
+from netCDF4 import Dataset
+
+import energy_model_functions_era5_io as era5_io
+
+
+def _write_era5_file(file_str,dtype='f4',fill_value=np.float32(np.nan)):
+
+    # a small ERA5-like file of t2m with some missing values
+    rng = np.random.default_rng(2)
+    t2m = np.ma.masked_array(rng.normal(285.,5.,size=(30,4,6)),
+                             mask=rng.random((30,4,6)) < 0.1)
+    dataset = Dataset(file_str,mode='w',format='NETCDF4')
+    dataset.createDimension('time',30)
+    dataset.createDimension('latitude',4)
+    dataset.createDimension('longitude',6)
+    dataset.createVariable('time','i4',('time',))[:] = np.arange(30)
+    dataset.variables['time'].units = 'hours since 1900-01-01 00:00:00.0'
+    dataset.createVariable('latitude','f4',('latitude',))[:] = [52.,51.5,51.,50.5]
+    dataset.createVariable('longitude','f4',('longitude',))[:] = np.arange(6)*0.5
+    variable = dataset.createVariable('t2m',dtype,('time','latitude','longitude'),
+                                      fill_value=fill_value)
+    variable[:] = t2m
+    dataset.close()
+    return(t2m)
+
+
+def test_cache_masks_nan_fill_values(tmp_path):
+
+    file_str = str(tmp_path / 'ERA5_1hr_2020_01_DET.nc')
+    t2m = _write_era5_file(file_str)
+    era5_io.convert_era5_to_cache(file_str,cache_dir=str(tmp_path / 'cache'))
+    dataset = era5_io.open_era5_dataset(file_str,['t2m'],
+                                        cache_dir=str(tmp_path / 'cache'))
+    assert isinstance(dataset,era5_io._CachedDataset)
+    cached = dataset.variables['t2m'][:]
+    dataset.close()
+    assert np.array_equal(np.ma.getmaskarray(cached),np.ma.getmaskarray(t2m))
+    assert np.allclose(np.ma.compressed(cached),np.ma.compressed(t2m))
+
+
+def test_fast_loader_replaces_nan_fill_values_of_float32_split(tmp_path,
+                                                              monkeypatch):
+
+    # the split files go beside the .nc file
+    monkeypatch.setattr(era5_io,'ERA5_SPLIT_DIR','')
+    file_str = str(tmp_path / 'ERA5_1hr_2020_01_DET.nc')
+    t2m = _write_era5_file(file_str,dtype='i2',fill_value=-32767)
+    era5_io.split_era5_file(file_str,['t2m'],dtype='float32')
+    split_dataset = era5_io.open_era5_dataset(file_str,['t2m'])
+    assert np.isnan(split_dataset.variables['t2m']._FillValue)
+    split_dataset.close()
+
+    masked = era5_io.load_era5_variable(file_str,'t2m')[2]
+    lons, lats, data, missing_values = era5_io.load_era5_variable_fast(
+        file_str,'t2m',missing_value=-999.)
+
+    mask = np.ma.getmaskarray(t2m)
+    assert np.array_equal(np.ma.getmaskarray(masked),mask)
+    assert missing_values.count == np.count_nonzero(mask)
+    assert np.all(data[mask] == -999.)
+    assert np.allclose(data[~mask],np.ma.compressed(masked))
@@ -0,0 +1,32 @@
+import datetime
+
+import numpy as np
+
+import energy_model_functions_output_store as output_store
+
+
+TIME_UNITS = 'hours since 2020-01-01 00:00:00'
+
+
+def test_read_time_series_of_blocks_out_of_order(tmp_path):
+
+    store_filename = output_store.store_file(str(tmp_path),'wind_cf')
+    # February, then March, then January
+    for first_hour in [744,1440,0]:
+        times = np.arange(first_hour,first_hour + 48)
+        output_store.append_time_series(store_filename,'wind_cf',times,
+                                        TIME_UNITS,{'France': times/10000.})
+
+    dates, country_series = output_store.read_time_series(store_filename)
+    hours = np.array([(date - dates[0]).total_seconds()/3600. for date in dates])
+    assert np.all(np.diff(hours) > 0)
+    assert np.allclose(country_series['France'][:48],np.arange(48)/10000.)
+
+    # a window that spans blocks that are not next to each other in the file
+    dates, country_series = output_store.read_time_series(
+        store_filename,['France'],start=datetime.datetime(2020,1,2),
+        end=datetime.datetime(2020,2,1,5))
+    assert len(dates) == 24 + 6
+    assert np.allclose(country_series['France'],
+                       np.concatenate([np.arange(24,48),
+                                       np.arange(744,750)])/10000.)
@@ -0,0 +1,82 @@
+import numpy as np
+
+import energy_model_functions_aggregation as aggregation
+import energy_model_functions_solar_PV as solar_PV
+
+
+def _weather(missing_fraction=0.):
+
+    rng = np.random.default_rng(1)
+    T2m = rng.normal(15.,8.,size=(50,5,7))
+    ssrd = rng.uniform(0.,900.,size=(50,5,7))
+    if missing_fraction > 0.:
+        T2m = np.ma.masked_array(T2m,mask=rng.random(T2m.shape) < missing_fraction)
+        ssrd = np.ma.masked_array(ssrd,mask=rng.random(ssrd.shape) < missing_fraction)
+        # the raw values under the masks are fill values
+        np.ma.getdata(T2m)[np.ma.getmaskarray(T2m)] = -32767.
+        np.ma.getdata(ssrd)[np.ma.getmaskarray(ssrd)] = -32767.
+    return(T2m,ssrd)
+
+
+def _country_mask():
+
+    country_mask = np.zeros((5,7))
+    country_mask[1:4,1:6] = 1.
+    return(country_mask)
+
+
+def _baseline_solar_PV_model(T2m,ssrd,country_mask):
+
+    # the original solar_PV_model: np.average of each timestep
+    rel_efficiency_of_pannel = 0.9*(1 - 0.0042*(T2m - 25.))
+    capacity_factor_of_pannel = np.nan_to_num(rel_efficiency_of_pannel*
+                                              (ssrd/1000.))
+    return(np.array([np.average(capacity_factor_of_pannel[i],
+                                weights=country_mask)
+                     for i in range(len(capacity_factor_of_pannel))]))
+
+
+def test_fused_matches_baseline():
+
+    T2m, ssrd = _weather()
+    baseline = _baseline_solar_PV_model(T2m,ssrd,_country_mask())
+    assert np.allclose(solar_PV.solar_PV_model(T2m,ssrd,_country_mask()),
+                       baseline)
+    fused = solar_PV.solar_PV_model_fused(T2m,ssrd,_country_mask(),
+                                          chunk_size=7)
+    assert np.allclose(fused,baseline,rtol=1e-5)
+
+
+def test_fused_matches_baseline_with_missing_values():
+
+    T2m, ssrd = _weather(missing_fraction=0.1)
+    baseline = _baseline_solar_PV_model(T2m,ssrd,_country_mask())
+    assert np.allclose(solar_PV.solar_PV_model(T2m,ssrd,_country_mask()),
+                       baseline)
+    fused = solar_PV.solar_PV_model_fused(T2m,ssrd,_country_mask(),
+                                          chunk_size=7)
+    assert np.allclose(fused,baseline,rtol=1e-5)
+
+
+def test_fused_treats_nan_as_missing():
+
+    # the fast loaders give NaN rather than masked values
+    T2m, ssrd = _weather(missing_fraction=0.1)
+    baseline = _baseline_solar_PV_model(T2m,ssrd,_country_mask())
+    fused = solar_PV.solar_PV_model_fused(np.ma.filled(T2m,np.nan),
+                                          np.ma.filled(ssrd,np.nan),
+                                          _country_mask())
+    assert np.allclose(fused,baseline,rtol=1e-5)
+
+
+def test_multi_matches_baseline_with_missing_values():
+
+    T2m, ssrd = _weather(missing_fraction=0.1)
+    country_masks = [_country_mask(),np.ones((5,7))]
+    weight_matrix = aggregation.make_weight_matrix(country_masks)
+    solar_cf = solar_PV.solar_PV_model_multi(T2m,ssrd,weight_matrix,
+                                             chunk_size=7)
+    for i, country_mask in enumerate(country_masks):
+        assert np.allclose(solar_cf[:,i],
+                           _baseline_solar_PV_model(T2m,ssrd,country_mask),
+                           rtol=1e-5)
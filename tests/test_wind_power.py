@@ -0,0 +1,31 @@
+import numpy as np
+
+import energy_model_functions_wind_power as wind_power
+
+
+POWER_CURVES = ['Enercon_E70','Gamesa_G87','Vestas_v110']
+
+
+def test_power_curve_lookup_by_class_matches_each_class():
+
+    power_curve_tables = [wind_power.get_power_curve_table(power_curve)
+                          for power_curve in POWER_CURVES]
+    rng = np.random.default_rng(3)
+    wind_speed_data = rng.uniform(0.,30.,size=(10,4,5))
+    class_index = rng.integers(0,4,size=(4,5))
+
+    wind_power_cf = wind_power.power_curve_lookup_by_class(
+        wind_speed_data,power_curve_tables,class_index)
+    for i, power_curve_table in enumerate(power_curve_tables):
+        in_class = np.broadcast_to(class_index == i,wind_speed_data.shape)
+        expected = wind_power.power_curve_lookup(wind_speed_data,
+                                                 power_curve_table)
+        assert np.array_equal(wind_power_cf[in_class],expected[in_class])
+    no_turbine = np.broadcast_to(class_index == 3,wind_speed_data.shape)
+    assert np.all(wind_power_cf[no_turbine] == 0.)
+
+    # the stacked table is kept for the next call with the same tables
+    stacked_cf = wind_power._stacked_class_table(power_curve_tables,None)
+    assert wind_power._stacked_class_table(power_curve_tables,None) is stacked_cf
+    assert wind_power._stacked_class_table(power_curve_tables,
+                                           np.float32).dtype == np.float32